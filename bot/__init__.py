@@ -124,3 +124,173 @@ try:
         ENABLE_DRIVE_SEARCH = False
 except KeyError:
     ENABLE_DRIVE_SEARCH = False
+
+try:
+    # answer /list and the torrent duplicate check from a local index of the drive
+    USE_DRIVE_INDEX = getConfig('USE_DRIVE_INDEX')
+    if USE_DRIVE_INDEX.lower() == 'true':
+        USE_DRIVE_INDEX = True
+    else:
+        USE_DRIVE_INDEX = False
+except KeyError:
+    USE_DRIVE_INDEX = False
+
+try:
+    UPLOAD_WORKERS = int(getConfig('UPLOAD_WORKERS'))
+    if UPLOAD_WORKERS < 1:
+        UPLOAD_WORKERS = 1
+except (KeyError, ValueError):
+    UPLOAD_WORKERS = 1
+
+try:
+    # GB a service account may push per day, drive's hard limit is 750GB
+    SA_DAILY_CAP = int(getConfig('SA_DAILY_CAP')) * 1024 * 1024 * 1024
+except (KeyError, ValueError):
+    SA_DAILY_CAP = 735 * 1024 * 1024 * 1024
+
+try:
+    # where the bytes every service account sent today are kept across restarts
+    SA_USAGE_FILE = getConfig('SA_USAGE_FILE')
+except KeyError:
+    SA_USAGE_FILE = 'data/sa_usage.json'
+
+try:
+    STREAM_ARCHIVE = getConfig('STREAM_ARCHIVE')
+    if STREAM_ARCHIVE.lower() == 'true':
+        STREAM_ARCHIVE = True
+    else:
+        STREAM_ARCHIVE = False
+except KeyError:
+    STREAM_ARCHIVE = False
+
+try:
+    GDRIVE_RESUME = getConfig('GDRIVE_RESUME')
+    if GDRIVE_RESUME.lower() == 'true':
+        GDRIVE_RESUME = True
+    else:
+        GDRIVE_RESUME = False
+except KeyError:
+    GDRIVE_RESUME = False
+# partial drive downloads live here in resume mode, the cleanups leave it alone
+GDRIVE_RESUME_DIR = f'{DOWNLOAD_DIR}gdresume/'
+try:
+    # hours a partial drive download is kept for a resume before the cleanup drops it
+    GDRIVE_RESUME_TTL = int(getConfig('GDRIVE_RESUME_TTL')) * 3600
+except (KeyError, ValueError):
+    GDRIVE_RESUME_TTL = 72 * 3600
+
+try:
+    CLONE_WORKERS = int(getConfig('CLONE_WORKERS'))
+    if CLONE_WORKERS < 1:
+        CLONE_WORKERS = 1
+except (KeyError, ValueError):
+    CLONE_WORKERS = 4
+
+try:
+    # parallel Range requests the /wget relay opens when the source supports them
+    RELAY_CONNECTIONS = int(getConfig('RELAY_CONNECTIONS'))
+    if RELAY_CONNECTIONS < 1:
+        RELAY_CONNECTIONS = 1
+except (KeyError, ValueError):
+    RELAY_CONNECTIONS = 4
+
+try:
+    # files of a drive folder fetched at once by GDdownload, 1 keeps the old sequential walk
+    GDRIVE_DOWNLOAD_WORKERS = int(getConfig('GDRIVE_DOWNLOAD_WORKERS'))
+    if GDRIVE_DOWNLOAD_WORKERS < 1:
+        GDRIVE_DOWNLOAD_WORKERS = 1
+except (KeyError, ValueError):
+    GDRIVE_DOWNLOAD_WORKERS = 4
+
+try:
+    # parallel Range requests GDdownload splits one large drive file into
+    GDRIVE_FILE_CONNECTIONS = int(getConfig('GDRIVE_FILE_CONNECTIONS'))
+    if GDRIVE_FILE_CONNECTIONS < 1:
+        GDRIVE_FILE_CONNECTIONS = 1
+except (KeyError, ValueError):
+    GDRIVE_FILE_CONNECTIONS = 4
+
+try:
+    # jobs of all engines that may run at once, 0 for no limit
+    MAX_CONCURRENT_JOBS = int(getConfig('MAX_CONCURRENT_JOBS'))
+except (KeyError, ValueError):
+    try:
+        MAX_CONCURRENT_JOBS = int(MAX_SIMULTANEOUS_DOWNLOADS)
+    except ValueError:
+        MAX_CONCURRENT_JOBS = 0
+if MAX_CONCURRENT_JOBS < 0:
+    MAX_CONCURRENT_JOBS = 0
+
+# per engine budgets on top of MAX_CONCURRENT_JOBS, like "aria2:5 qbit:3 gdrive:2"
+ENGINE_JOB_LIMITS = {}
+try:
+    for limit in getConfig('ENGINE_JOB_LIMITS').split():
+        engine, _, count = limit.partition(':')
+        ENGINE_JOB_LIMITS[engine.lower()] = int(count)
+except KeyError:
+    pass
+except ValueError:
+    LOGGER.error("ENGINE_JOB_LIMITS must look like aria2:5 qbit:3, ignoring it")
+    ENGINE_JOB_LIMITS = {}
+
+try:
+    # fifo, or priority to start the owner's jobs before the rest of the queue
+    JOB_QUEUE_POLICY = getConfig('JOB_QUEUE_POLICY').lower()
+    if JOB_QUEUE_POLICY not in ('fifo', 'priority'):
+        JOB_QUEUE_POLICY = 'fifo'
+except KeyError:
+    JOB_QUEUE_POLICY = 'fifo'
+
+try:
+    # tar, zip and extract jobs run at once, they are cpu and disk heavy
+    PIPELINE_POSTPROCESS_WORKERS = int(getConfig('PIPELINE_POSTPROCESS_WORKERS'))
+    if PIPELINE_POSTPROCESS_WORKERS < 1:
+        PIPELINE_POSTPROCESS_WORKERS = 1
+except (KeyError, ValueError):
+    PIPELINE_POSTPROCESS_WORKERS = 2
+
+try:
+    # finished jobs uploaded to drive at once
+    PIPELINE_UPLOAD_WORKERS = int(getConfig('PIPELINE_UPLOAD_WORKERS'))
+    if PIPELINE_UPLOAD_WORKERS < 1:
+        PIPELINE_UPLOAD_WORKERS = 1
+except (KeyError, ValueError):
+    PIPELINE_UPLOAD_WORKERS = 4
+
+try:
+    # jobs waiting in a pipeline stage before no new download is started
+    PIPELINE_QUEUE_DEPTH = int(getConfig('PIPELINE_QUEUE_DEPTH'))
+    if PIPELINE_QUEUE_DEPTH < 1:
+        PIPELINE_QUEUE_DEPTH = 1
+except (KeyError, ValueError):
+    PIPELINE_QUEUE_DEPTH = 16
+
+try:
+    # GB of the download disk never promised to a job
+    DISK_FREE_MARGIN = int(getConfig('DISK_FREE_MARGIN')) * 1024 * 1024 * 1024
+except (KeyError, ValueError):
+    DISK_FREE_MARGIN = 1024 * 1024 * 1024
+
+try:
+    # none, gzip or zstd, /tar compresses with it on ARCHIVE_THREADS threads
+    TAR_CODEC = getConfig('TAR_CODEC').lower()
+    if TAR_CODEC not in ('none', 'gzip', 'zstd'):
+        TAR_CODEC = 'none'
+except KeyError:
+    TAR_CODEC = 'none'
+
+try:
+    # store or deflate, media that is already compressed is always stored
+    ZIP_CODEC = getConfig('ZIP_CODEC').lower()
+    if ZIP_CODEC not in ('store', 'deflate'):
+        ZIP_CODEC = 'store'
+except KeyError:
+    ZIP_CODEC = 'store'
+
+try:
+    # threads compressing archives, shared by all /tar and /zip jobs
+    ARCHIVE_THREADS = int(getConfig('ARCHIVE_THREADS'))
+    if ARCHIVE_THREADS < 1:
+        ARCHIVE_THREADS = 1
+except (KeyError, ValueError):
+    ARCHIVE_THREADS = os.cpu_count() or 1
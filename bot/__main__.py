@@ -1,4 +1,5 @@
 import signal
+import asyncio
 import pickle
 import os
 from os import path, remove
@@ -12,11 +13,16 @@ from bot import (
     TELEGRAM_HASH
 )
 from bot.helper.ext_utils import fs_utils
+from bot.helper.ext_utils.bot_utils import start_status_sampler, start_metrics_sampler
+from bot.helper.mirror_utils.upload_utils.gdriveTools import start_drive_index
 
 BOT_USERNAME = None
 
 def main():
     fs_utils.start_cleanup()
+    start_status_sampler()
+    start_metrics_sampler()
+    start_drive_index()
     # Check if the bot is restarting
     if path.exists('restart.pickle'):
         with open('restart.pickle', 'rb') as status:
@@ -40,10 +46,14 @@ def main():
 
     LOGGER.info("Bot Started!")
 
-    os.mkdir(DOWNLOAD_DIR)
+    # resume mode keeps DOWNLOAD_DIR across restarts
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
     
     app.start()
 
+    from bot.modules.mirror import resume_wget_relays
+    asyncio.get_event_loop().create_task(resume_wget_relays(app))
+
     idle() 
 
     # app.send_message(chat_id="-1001271941524", text="Bot Session Started #booted")
@@ -5,10 +5,15 @@ import threading
 import time
 import requests
 import shutil, psutil
+import heapq
+import itertools
+import math
+from concurrent.futures import ThreadPoolExecutor
 from bot import download_dict, download_dict_lock
 import random
 import urllib.parse as urlparse
 from urllib.parse import parse_qs
+from typing import NamedTuple, Optional
 from bot.helper.telegram_helper.bot_commands import BotCommands
 
 LOGGER = logging.getLogger(__name__)
@@ -35,6 +40,7 @@ class MirrorStatus:
     STATUS_FORCED = "Forced"
     STATUS_PAUSED = "Paused"
     STATUS_SEEDING = "Seeding"
+    STATUS_CLONING = "Cloning"
 
 
 PROGRESS_MAX_SIZE = 100 // 8
@@ -42,20 +48,109 @@ PROGRESS_INCOMPLETE = ['▏', '▎', '▍', '▌', '▋', '▊', '▉']
 
 SIZE_UNITS = ['B', 'KB', 'MB', 'GB', 'TB', 'PB']
 
+STATUS_SAMPLE_INTERVAL = 1
+METRICS_SAMPLE_INTERVAL = 2
+# states that only render the name and the gid, nothing else is sampled for them
+IDLE_STATES = (MirrorStatus.STATUS_WAITING, MirrorStatus.STATUS_ALLOCATING, MirrorStatus.STATUS_CHECKING,
+               MirrorStatus.STATUS_FORCED, MirrorStatus.STATUS_PAUSED, MirrorStatus.STATUS_SEEDING,
+               MirrorStatus.STATUS_STALLED, MirrorStatus.STATUS_FETCHING_METADATA)
+
+
+# every periodic callback of the bot runs off one timer thread and this many workers
+INTERVAL_WORKERS = 8
+# due times are rounded up to the tick so callbacks that fall close together fire in one wakeup
+INTERVAL_TICK = 0.1
+
+
+class TimerWheel:
+    """
+    Heap of (due time, timer) entries served by a single thread. Due timers are handed to
+    a small thread pool, so hundreds of intervals cost one sleeping thread instead of one
+    each.
+    """
+
+    def __init__(self, workers=INTERVAL_WORKERS, tick=INTERVAL_TICK):
+        self.__heap = []
+        self.__counter = itertools.count()
+        self.__cond = threading.Condition()
+        self.__tick = tick
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='interval')
+        self.__thread = None
+
+    def schedule(self, timer, due):
+        due = math.ceil(due / self.__tick) * self.__tick
+        with self.__cond:
+            heapq.heappush(self.__heap, (due, next(self.__counter), timer))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='timer-wheel', daemon=True)
+                self.__thread.start()
+            self.__cond.notify()
+
+    def submit(self, fn):
+        return self.__executor.submit(fn)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                if not self.__heap:
+                    self.__cond.wait()
+                    continue
+                now = time.time()
+                if self.__heap[0][0] > now:
+                    self.__cond.wait(self.__heap[0][0] - now)
+                    continue
+                due = []
+                while self.__heap and self.__heap[0][0] <= now:
+                    due.append(heapq.heappop(self.__heap)[2])
+            for timer in due:
+                try:
+                    timer.fire()
+                except Exception as e:
+                    LOGGER.error(f"Interval dispatch failed: {e}")
+
+
+TIMER_WHEEL = TimerWheel()
+
 
 class setInterval:
-    def __init__(self, interval, action):
+    """
+    Calls action every interval seconds on the shared TIMER_WHEEL until cancel().
+    A run is never started while the previous one is still going, missed ticks are
+    dropped instead of queued. jitter spreads the first run over that many seconds.
+    """
+
+    def __init__(self, interval, action, jitter=0):
         self.interval = interval
         self.action = action
         self.stopEvent = threading.Event()
-        thread = threading.Thread(target=self.__setInterval)
-        thread.start()
-
-    def __setInterval(self):
-        nextTime = time.time() + self.interval
-        while not self.stopEvent.wait(nextTime - time.time()):
-            nextTime += self.interval
-            self.action()
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__next = time.time() + interval + random.uniform(0, jitter)
+        TIMER_WHEEL.schedule(self, self.__next)
+
+    def fire(self):
+        if self.stopEvent.is_set():
+            return
+        now = time.time()
+        self.__next += self.interval
+        if self.__next <= now:
+            self.__next += math.ceil((now - self.__next) / self.interval) * self.interval
+        TIMER_WHEEL.schedule(self, self.__next)
+        with self.__lock:
+            if self.__running:
+                return
+            self.__running = True
+        TIMER_WHEEL.submit(self.__run_action)
+
+    def __run_action(self):
+        try:
+            if not self.stopEvent.is_set():
+                self.action()
+        except Exception as e:
+            LOGGER.error(f"Interval callback {getattr(self.action, '__name__', self.action)} failed: {e}")
+        finally:
+            with self.__lock:
+                self.__running = False
 
     def cancel(self):
         self.stopEvent.set()
@@ -93,8 +188,8 @@ def getDownloadByaria2Gid(gid):
     return None
 
 def get_progress_bar_string(status):
-    completed = status.processed_bytes() / 8
-    total = status.size_raw() / 8
+    completed = (status.processed_bytes or 0) / 8
+    total = (status.size_raw or 0) / 8
     if total == 0:
         p = 0
     else:
@@ -110,8 +205,8 @@ def get_progress_bar_string(status):
     return p_str
 
 def get_progress_bar_string_forgd(status):
-    completed = status.processed_bytes() / 8
-    total = status.size_raw_progress() / 8
+    completed = (status.processed_bytes or 0) / 8
+    total = (status.size_raw_progress or 0) / 8
     if total == 0:
         p = 0
     else:
@@ -134,68 +229,227 @@ def generate_spin(status):
     return p_str    
 
 
-def get_readable_message():
-    cpuUsage = psutil.cpu_percent(interval=0.5)
-    total, used, free, diskpercent = psutil.disk_usage('.')
-    memory = psutil.virtual_memory().percent
+class TaskSnapshot(NamedTuple):
+    """What the status message shows for one task, sampled off the download_dict_lock"""
+    status: str
+    name: str
+    gid: Optional[str] = None
+    size: Optional[str] = None
+    size_raw: Optional[int] = None
+    processed_bytes: Optional[int] = None
+    progress: Optional[str] = None
+    speed: Optional[str] = None
+    speed_raw: int = 0
+    eta: Optional[str] = None
+    completed: Optional[str] = None
+    seeds: Optional[int] = None
+    leechers: Optional[int] = None
+    isgdfolder: Optional[bool] = None
+    downloaded_bytes: Optional[str] = None
+    totalsize: Optional[str] = None
+    downloadingname: Optional[str] = None
+    currentsize: Optional[str] = None
+    size_raw_progress: Optional[int] = None
+    in_flight: Optional[int] = None
+
+
+_status_snapshot = ()
+
+
+def _sample(download, method):
+    # not every status class has every accessor, missing ones are left empty
+    accessor = getattr(download, method, None)
+    if accessor is None:
+        return None
+    return accessor()
+
+
+def snapshot_task(download):
+    status = download.status()
+    record = TaskSnapshot(status=status, name=download.name(), gid=_sample(download, 'gid'),
+                          isgdfolder=_sample(download, 'isgdfolder'))
+    if status in IDLE_STATES:
+        return record
+    fields = {}
+    for method in ('size', 'size_raw', 'processed_bytes', 'progress', 'speed', 'speed_raw', 'eta',
+                   'completed', 'seeds', 'leechers'):
+        fields[method] = _sample(download, method)
+    if record.isgdfolder is True:
+        for method in ('downloaded_bytes', 'totalsize', 'downloadingname', 'currentsize', 'size_raw_progress',
+                       'in_flight'):
+            fields[method] = _sample(download, method)
+    fields['speed_raw'] = fields['speed_raw'] or 0
+    return record._replace(**fields)
+
+
+def take_status_snapshot():
+    """
+    Copies the tasks out of download_dict and samples them without the lock held, so
+    slow accessors (aria2 rpc, qbittorrent) never stall the download callbacks
+    """
+    global _status_snapshot
+    with download_dict_lock:
+        downloads = list(download_dict.values())
+    records = []
+    for download in downloads:
+        try:
+            records.append(snapshot_task(download))
+        except Exception as e:
+            LOGGER.error(f"Could not sample status of a task: {e}")
+    _status_snapshot = tuple(records)
+    return _status_snapshot
+
+
+def get_status_snapshot():
+    return _status_snapshot
+
+
+def start_status_sampler():
+    take_status_snapshot()
+    return setInterval(STATUS_SAMPLE_INTERVAL, take_status_snapshot)
+
+
+class SystemMetrics(NamedTuple):
+    cpu: float = 0.0
+    memory: float = 0.0
+    disk_total: int = 0
+    disk_used: int = 0
+    disk_free: int = 0
+    disk_percent: float = 0.0
+    sent: int = 0
+    recv: int = 0
+    # bytes per second since the previous sample
+    sent_rate: float = 0.0
+    recv_rate: float = 0.0
+    timestamp: float = 0.0
+
+
+_system_metrics = SystemMetrics()
+
+
+def take_system_metrics():
+    """
+    Samples cpu, ram, disk and network counters. cpu_percent(None) compares against the
+    previous call, so nothing here sleeps.
+    """
+    global _system_metrics
+    previous = _system_metrics
+    now = time.time()
+    disk = psutil.disk_usage('.')
+    netio = psutil.net_io_counters()
+    sent_rate = recv_rate = 0.0
+    elapsed = now - previous.timestamp
+    if previous.timestamp and elapsed > 0:
+        sent_rate = max(netio.bytes_sent - previous.sent, 0) / elapsed
+        recv_rate = max(netio.bytes_recv - previous.recv, 0) / elapsed
+    _system_metrics = SystemMetrics(cpu=psutil.cpu_percent(interval=None),
+                                    memory=psutil.virtual_memory().percent,
+                                    disk_total=disk.total, disk_used=disk.used, disk_free=disk.free,
+                                    disk_percent=disk.percent, sent=netio.bytes_sent, recv=netio.bytes_recv,
+                                    sent_rate=sent_rate, recv_rate=recv_rate, timestamp=now)
+    return _system_metrics
+
+
+def get_system_metrics():
+    return _system_metrics
+
+
+def start_metrics_sampler():
+    # first cpu_percent(None) call only sets the baseline
+    psutil.cpu_percent(interval=None)
+    take_system_metrics()
+    return setInterval(METRICS_SAMPLE_INTERVAL, take_system_metrics)
+
+
+# label and counts() of every pipeline stage, their running and waiting jobs show under /status
+STAGE_PROBES = []
+
+
+def register_stage(label, counts):
+    STAGE_PROBES.append((label, counts))
+
+
+def get_readable_message(snapshot=None):
+    if snapshot is None:
+        snapshot = get_status_snapshot()
+    metrics = get_system_metrics()
     dl = 0
     ul = 0
-    with download_dict_lock:
-        msg = ""
-        for download in list(download_dict.values()):
-            if download.isgdfolder() is not None and download.isgdfolder() is True:
-                msg += f"<b>{download.status()}</b>: <code>{download.name()}</code>" \
-                    f"\n<b>Status</b>: <code>Downloading From GDRIVE ▼ </code>"
-                if download.downloaded_bytes() != '0B':
-                    msg += f"\n<b>Downloaded</b>: <code>{download.downloaded_bytes()} / {download.totalsize()}</code>"
-                msg += f"\n<b>Completed</b>: <code>{download.completed()}</code>" \
-                       f"\n<i>{download.downloadingname()} | {download.currentsize()}</i>" \
-                       f"\n<b>Progress</b>: <code>{get_progress_bar_string_forgd(download)} {download.progress()}</code>" \
-                       f"\n<b>Speed</b>: <code>{download.speed()}</code>" \
-                       f"\n<b>ETA</b>: <code>{download.eta()}</code>" \
-                       f"\n<b>To Stop</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid()}</code>"
-                if download.status() == MirrorStatus.STATUS_DOWNLOADING:
-                    dl += download.speed_raw()
-                msg += "\n\n"    
-            elif download.status() == MirrorStatus.STATUS_ARCHIVING or download.status() == MirrorStatus.STATUS_EXTRACTING:
-                msg += f"{generate_spin(download)}<i> {download.status()} </i>{generate_spin(download)}: <code>{download.name()}</code>"  \
-                       f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid()}</code>" \
-                       f"\n<b>Size</b>: <code>{download.size()}</code>" \
-                       f"\n\n"     
-            elif download.status() == MirrorStatus.STATUS_WAITING:
-                msg += f"{generate_spin(download)}<i> {download.status()} </i>{generate_spin(download)}: <code>{download.name()}</code>"  \
-                       f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid()}</code>" \
-                       f"\n\n"    
-            elif download.status() == MirrorStatus.STATUS_ARCHIVING or download.status() == MirrorStatus.STATUS_EXTRACTING or download.status() == MirrorStatus.STATUS_ALLOCATING or download.status() == MirrorStatus.STATUS_WAITING or download.status() == MirrorStatus.STATUS_CHECKING or download.status() == MirrorStatus.STATUS_FORCED or download.status() == MirrorStatus.STATUS_PAUSED or download.status() == MirrorStatus.STATUS_SEEDING:
-                msg += f"{generate_spin(download)}<i> {download.status()} </i>{generate_spin(download)}: <code>{download.name()}</code>"  \
-                       f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid()}</code>" \
-                       f"\n\n"
-            elif download.status() == MirrorStatus.STATUS_STALLED or download.status() == MirrorStatus.STATUS_FETCHING_METADATA:
-                msg += f"{generate_spin(download)}<i> {download.status()} </i>{generate_spin(download)}: <code>{download.name()}</code>"  \
-                       f"\n<b>Cancel</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid()}</code>" \
-                       f"\n\n"          
+    msg = ""
+    for download in snapshot:
+        if download.isgdfolder is not None and download.isgdfolder is True:
+            msg += f"<b>{download.status}</b>: <code>{download.name}</code>" \
+                f"\n<b>Status</b>: <code>Downloading From GDRIVE ▼ </code>"
+            if download.downloaded_bytes != '0B':
+                msg += f"\n<b>Downloaded</b>: <code>{download.downloaded_bytes} / {download.totalsize}</code>"
+            msg += f"\n<b>Completed</b>: <code>{download.completed}</code>"
+            if download.in_flight is not None:
+                msg += f"\n<b>In Flight</b>: <code>{download.in_flight} files</code>"
             else:
-                msg += f"<b>{download.status()}</b>: <code>{download.name()}</code>"
-                if download.completed() is not None:
-                    msg += f"\n<b>Status</b>: <code>Downloading From GDRIVE ▼ </code>" \
-                        f"\n<b>Completed</b>: <code>{download.completed()}</code>" 
-                if download.status() != MirrorStatus.STATUS_ARCHIVING or download.status() != MirrorStatus.STATUS_EXTRACTING or download.status() != MirrorStatus.STATUS_ALLOCATING or download.status() != MirrorStatus.STATUS_WAITING or download.status() != MirrorStatus.STATUS_CHECKING or download.status() != MirrorStatus.STATUS_FORCED or download.status() != MirrorStatus.STATUS_PAUSED or download.status() != MirrorStatus.STATUS_SEEDING:
-                    msg += f"\n<b>Size</b>: <code>{download.size()}</code>" \
-                        f"\n<b>Progress</b>: <code>{get_progress_bar_string(download)} {download.progress()}</code>" \
-                        f"\n<b>Speed</b>: <code>{download.speed()}</code>" \
-                        f"\n<b>ETA</b>: <code>{download.eta()}</code>"
-                if download.status() == MirrorStatus.STATUS_DOWNLOADING:
-                    dl += download.speed_raw()                             
-                    if download.seeds() is not None:
-                        msg += f"\n<b>Seeders</b>: <code>{download.seeds()}</code>" \
-                            f"\t\t\t<b>Peers</b>: <code>{download.leechers()}</code>"
-                    msg += f"\n<b>To Stop</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid()}</code>"
-                if download.status() == MirrorStatus.STATUS_UPLOADING:
-                    ul += download.speed_raw()   
-                msg += "\n\n" 
-        msg += f"<b>CPU</b>: {cpuUsage}%\t\t<b>DISK</b>: {diskpercent}%\t\t<b>RAM</b>: {memory}%\n" \
-               f"<b>DL</b>: <code>{get_readable_file_size(dl)}ps</code> ▼\t<b>UL</b>: <code>{get_readable_file_size(ul)}ps</code> ▲"    
-        return msg
+                msg += f"\n<i>{download.downloadingname} | {download.currentsize}</i>"
+            msg += f"\n<b>Progress</b>: <code>{get_progress_bar_string_forgd(download)} {download.progress}</code>" \
+                   f"\n<b>Speed</b>: <code>{download.speed}</code>" \
+                   f"\n<b>ETA</b>: <code>{download.eta}</code>" \
+                   f"\n<b>To Stop</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid}</code>"
+            if download.status == MirrorStatus.STATUS_DOWNLOADING:
+                dl += download.speed_raw
+            msg += "\n\n"
+        elif download.status == MirrorStatus.STATUS_ARCHIVING or download.status == MirrorStatus.STATUS_EXTRACTING:
+            msg += f"{generate_spin(download)}<i> {download.status} </i>{generate_spin(download)}: <code>{download.name}</code>"  \
+                   f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid}</code>" \
+                   f"\n<b>Size</b>: <code>{download.size}</code>"
+            # streamed archives are uploading while they are being built
+            if download.processed_bytes:
+                msg += f"\n<b>Progress</b>: <code>{get_progress_bar_string(download)} {download.progress}</code>" \
+                       f"\n<b>Speed</b>: <code>{download.speed}</code>" \
+                       f"\n<b>ETA</b>: <code>{download.eta}</code>"
+                ul += download.speed_raw
+            msg += "\n\n"
+        elif download.status == MirrorStatus.STATUS_CLONING:
+            msg += f"<b>{download.status}</b>: <code>{download.name}</code>" \
+                   f"\n<b>Completed</b>: <code>{download.completed}</code>" \
+                   f"\n<b>Size</b>: <code>{download.size}</code>" \
+                   f"\n<b>Progress</b>: <code>{get_progress_bar_string(download)} {download.progress}</code>" \
+                   f"\n<b>Speed</b>: <code>{download.speed}</code>" \
+                   f"\n<b>ETA</b>: <code>{download.eta}</code>" \
+                   f"\n<b>To Stop</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid}</code>" \
+                   f"\n\n"
+        elif download.status == MirrorStatus.STATUS_WAITING:
+            msg += f"{generate_spin(download)}<i> {download.status} </i>{generate_spin(download)}: <code>{download.name}</code>"  \
+                   f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid}</code>" \
+                   f"\n\n"
+        elif download.status == MirrorStatus.STATUS_ALLOCATING or download.status == MirrorStatus.STATUS_CHECKING or download.status == MirrorStatus.STATUS_FORCED or download.status == MirrorStatus.STATUS_PAUSED or download.status == MirrorStatus.STATUS_SEEDING:
+            msg += f"{generate_spin(download)}<i> {download.status} </i>{generate_spin(download)}: <code>{download.name}</code>"  \
+                   f"\n<b>Source</b>: <code>/{BotCommands.SourceCommand[0]} {download.gid}</code>" \
+                   f"\n\n"
+        elif download.status == MirrorStatus.STATUS_STALLED or download.status == MirrorStatus.STATUS_FETCHING_METADATA:
+            msg += f"{generate_spin(download)}<i> {download.status} </i>{generate_spin(download)}: <code>{download.name}</code>"  \
+                   f"\n<b>Cancel</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid}</code>" \
+                   f"\n\n"
+        else:
+            msg += f"<b>{download.status}</b>: <code>{download.name}</code>"
+            if download.completed is not None:
+                msg += f"\n<b>Status</b>: <code>Downloading From GDRIVE ▼ </code>" \
+                    f"\n<b>Completed</b>: <code>{download.completed}</code>"
+            msg += f"\n<b>Size</b>: <code>{download.size}</code>" \
+                f"\n<b>Progress</b>: <code>{get_progress_bar_string(download)} {download.progress}</code>" \
+                f"\n<b>Speed</b>: <code>{download.speed}</code>" \
+                f"\n<b>ETA</b>: <code>{download.eta}</code>"
+            if download.status == MirrorStatus.STATUS_DOWNLOADING:
+                dl += download.speed_raw
+                if download.seeds is not None:
+                    msg += f"\n<b>Seeders</b>: <code>{download.seeds}</code>" \
+                        f"\t\t\t<b>Peers</b>: <code>{download.leechers}</code>"
+                msg += f"\n<b>To Stop</b>: <code>/{BotCommands.CancelMirror[0]} {download.gid}</code>"
+            if download.status == MirrorStatus.STATUS_UPLOADING:
+                ul += download.speed_raw
+            msg += "\n\n"
+    if STAGE_PROBES:
+        stages = "\t".join(f"{label} <code>{'/'.join(map(str, counts()))}</code>" for label, counts in STAGE_PROBES)
+        msg += f"<b>Running/Queued</b>: {stages}\n"
+    msg += f"<b>CPU</b>: {metrics.cpu}%\t\t<b>DISK</b>: {metrics.disk_percent}%\t\t<b>RAM</b>: {metrics.memory}%\n" \
+           f"<b>DL</b>: <code>{get_readable_file_size(dl)}ps</code> ▼\t<b>UL</b>: <code>{get_readable_file_size(ul)}ps</code> ▲"
+    return msg
 
 def get_readable_time(seconds: int) -> str:
     result = ''
@@ -0,0 +1,102 @@
+import os
+import shutil
+import logging
+import threading
+
+from bot import DOWNLOAD_DIR, DISK_FREE_MARGIN
+from bot.helper.ext_utils.fs_utils import get_path_size
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DiskLedger:
+    """
+    Disk space promised to running jobs. A job reserves its expected peak footprint
+    before it starts, the part of a reservation a job has not written yet is taken off
+    the free space the next job sees, so concurrent jobs cannot overcommit the disk
+    between two looks at shutil.disk_usage. Reservations are keyed by the job uid and
+    set against what the job already wrote to DOWNLOAD_DIR/<uid> and the directories
+    it track()s, as of the last measure().
+    """
+
+    def __init__(self, path, margin):
+        self.__path = path
+        self.__margin = margin
+        self.__lock = threading.Lock()
+        self.__reserved = {}
+        # uid: directories the job writes to besides DOWNLOAD_DIR/<uid>
+        self.__paths = {}
+        # uid: bytes on disk at the last measure()
+        self.__written = {}
+
+    def __outstanding(self):
+        outstanding = 0
+        for uid, size in self.__reserved.items():
+            outstanding += max(0, size - self.__written.get(uid, 0))
+        return outstanding
+
+    def track(self, uid, path):
+        """Counts what uid writes to path against its reservation, like the resume dir of a drive job"""
+        with self.__lock:
+            self.__paths.setdefault(uid, set()).add(path)
+
+    def measure(self):
+        """Walks the directories of every reservation, called once per JobScheduler sweep"""
+        with self.__lock:
+            paths = {uid: {f"{DOWNLOAD_DIR}{uid}"} | self.__paths.get(uid, set()) for uid in self.__reserved}
+        # the walk runs without the lock, submit and wake use the sizes of the last one
+        written = {uid: sum(get_path_size(path) for path in dirs if os.path.exists(path))
+                   for uid, dirs in paths.items()}
+        with self.__lock:
+            self.__written = {uid: size for uid, size in written.items() if uid in self.__reserved}
+
+    def available(self):
+        """:return: bytes a new reservation may take"""
+        with self.__lock:
+            return shutil.disk_usage(self.__path).free - self.__outstanding() - self.__margin
+
+    def capacity(self):
+        """:return: the largest reservation the disk could ever hold"""
+        return shutil.disk_usage(self.__path).total - self.__margin
+
+    def reserve(self, uid, size, force=False):
+        """
+        Grows the reservation of uid to size, a smaller size keeps the current one
+        :return: False if the growth does not fit and force is not set
+        """
+        with self.__lock:
+            current = self.__reserved.get(uid, 0)
+            if size <= current:
+                return True
+            if not force:
+                free = shutil.disk_usage(self.__path).free - self.__outstanding() - self.__margin
+                if size - current > free:
+                    return False
+            self.__reserved[uid] = size
+            return True
+
+    def resize(self, uid, size):
+        """Sets the reservation of uid to size, for a job whose footprint shrank"""
+        with self.__lock:
+            if uid in self.__reserved:
+                self.__reserved[uid] = size
+
+    def release(self, uid):
+        with self.__lock:
+            self.__reserved.pop(uid, None)
+            self.__paths.pop(uid, None)
+            self.__written.pop(uid, None)
+
+    def reserved(self):
+        with self.__lock:
+            return sum(self.__reserved.values())
+
+
+DISK_LEDGER = DiskLedger(DOWNLOAD_DIR, DISK_FREE_MARGIN)
+
+
+def job_footprint(size, isTar=False, isZip=False, extract=False):
+    """:return: peak bytes a job of size needs, an archive or extraction sits next to its source"""
+    if isTar or isZip or extract:
+        return 2 * size
+    return size
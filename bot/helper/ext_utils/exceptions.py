@@ -9,4 +9,8 @@ class NotSupportedExtractionArchive(Exception):
 
 class ProcessCanceled(Exception):
     """ raise if thread has terminated """
-    pass
\ No newline at end of file
+    pass
+
+class DriveQuotaExceeded(Exception):
+    """ raise when drive refuses a transfer because the account ran out of quota """
+    pass
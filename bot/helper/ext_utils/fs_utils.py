@@ -1,11 +1,16 @@
 import sys
-from bot import aria2, LOGGER, DOWNLOAD_DIR
+from bot import aria2, LOGGER, DOWNLOAD_DIR, GDRIVE_RESUME, GDRIVE_RESUME_DIR, GDRIVE_RESUME_TTL, TAR_CODEC, ZIP_CODEC, ARCHIVE_THREADS
 import shutil
 import os
+import time
+import zlib
+import struct
 import pathlib
 import magic
 import tarfile
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .exceptions import NotSupportedExtractionArchive
 import subprocess
 import threading
@@ -18,16 +23,49 @@ def clean_download(path: str):
         shutil.rmtree(path)
 
 
+def clean_download_dir():
+    if not GDRIVE_RESUME:
+        shutil.rmtree(DOWNLOAD_DIR)
+        return
+    # keep the partial drive downloads so the same link can be resumed
+    for entry in os.scandir(DOWNLOAD_DIR):
+        if os.path.join(entry.path, '') == GDRIVE_RESUME_DIR:
+            clean_resume_dir()
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+def clean_resume_dir():
+    """Drops the partial drive downloads nobody resumed within GDRIVE_RESUME_TTL"""
+    expiry = time.time() - GDRIVE_RESUME_TTL
+    for entry in os.scandir(GDRIVE_RESUME_DIR):
+        # a manifest is saved while its job runs, the directory of a job without one is judged by itself
+        manifest = entry.path if entry.name.endswith('.json') else f"{entry.path}.json"
+        try:
+            if os.path.getmtime(manifest if os.path.exists(manifest) else entry.path) > expiry:
+                continue
+        except FileNotFoundError:
+            continue
+        LOGGER.info(f"Dropping expired resume data: {entry.path}")
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+
 def start_cleanup():
     try:
-        shutil.rmtree(DOWNLOAD_DIR)
+        clean_download_dir()
     except FileNotFoundError:
         pass
 
 
 def clean_all():
     aria2.remove_all(True)
-    shutil.rmtree(DOWNLOAD_DIR)
+    clean_download_dir()
 
 
 def exit_clean_up(signal, frame):
@@ -51,14 +89,196 @@ def get_path_size(path):
     return total_size
 
 
-def tar(org_path, selflistener):
+# already compressed formats, deflating them again costs cpu and saves nothing
+COMPRESSED_EXTENSIONS = {
+    'mkv', 'mp4', 'm4v', 'avi', 'mov', 'webm', 'flv', 'wmv', 'ts', 'm2ts',
+    'mp3', 'm4a', 'aac', 'flac', 'ogg', 'opus',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic',
+    'zip', 'rar', '7z', 'gz', 'tgz', 'bz2', 'xz', 'zst', 'apk',
+}
+# share of the bytes in compressed media above which a tar is not compressed at all
+COMPRESSED_SHARE = 0.9
+TAR_SUFFIXES = {'none': 'tar', 'gzip': 'tar.gz', 'zstd': 'tar.zst'}
+ARCHIVE_BUFFER_SIZE = 1024 * 1024
+DEFLATE_BLOCK_SIZE = 1024 * 1024
+DEFLATE_WINDOW = 32 * 1024
+DEFLATE_LEVEL = 6
+# entries and offsets past this need zip64 records, the same limit zipfile uses
+ZIP64_LIMIT = (1 << 31) - 1
+
+_archive_pool = None
+_archive_pool_lock = threading.Lock()
+
+
+def archive_pool():
+    """:return: the threads compressing archives, started by the first archive that needs them"""
+    global _archive_pool
+    with _archive_pool_lock:
+        if _archive_pool is None:
+            _archive_pool = ThreadPoolExecutor(max_workers=ARCHIVE_THREADS, thread_name_prefix='archive')
+        return _archive_pool
+
+
+def is_compressed_media(name):
+    return pathlib.PurePath(name).suffix[1:].lower() in COMPRESSED_EXTENSIONS
+
+
+def tar_codec(org_path):
+    """:return: the codec a tar of org_path is written with, TAR_CODEC unless it would not pay off"""
+    if TAR_CODEC == 'none':
+        return 'none'
+    total = media = 0
+    for root, dirs, files in os.walk(org_path):
+        for name in files:
+            size = os.path.getsize(os.path.join(root, name))
+            total += size
+            if is_compressed_media(name):
+                media += size
+    if total and media / total >= COMPRESSED_SHARE:
+        LOGGER.info(f"{org_path} is mostly compressed media, writing a plain tar")
+        return 'none'
+    if TAR_CODEC == 'zstd' and shutil.which('zstd') is None:
+        LOGGER.warning("zstd is not installed, compressing the tar with gzip")
+        return 'gzip'
+    return TAR_CODEC
+
+
+def archive_suffix(archive_type, codec='none'):
+    if archive_type == 'zip':
+        return 'zip'
+    return TAR_SUFFIXES[codec]
+
+
+class _ParallelDeflate:
+    """
+    pigz style raw deflate with the interface of a zlib compressobj. The input is cut in
+    blocks that are compressed on archive_pool(), each primed with the last 32K of the one
+    before so matches still reach across blocks, and joined back in order.
+    """
+
+    def __init__(self, pool=None, threads=ARCHIVE_THREADS, level=DEFLATE_LEVEL):
+        self.__pool = pool or archive_pool()
+        self.__level = level
+        # blocks in flight, enough to keep every thread busy without buffering the whole file
+        self.__limit = 2 * threads
+        self.__pending = deque()
+        self.__buf = bytearray()
+        self.__tail = b''
+
+    def __deflate(self, data, zdict, last):
+        if zdict:
+            compressor = zlib.compressobj(self.__level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+        else:
+            compressor = zlib.compressobj(self.__level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # a sync flush ends the block on a byte boundary without marking the stream final
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def __submit(self, data, last):
+        self.__pending.append(self.__pool.submit(self.__deflate, data, self.__tail, last))
+        self.__tail = data[-DEFLATE_WINDOW:]
+
+    def compress(self, data):
+        self.__buf += data
+        while len(self.__buf) >= DEFLATE_BLOCK_SIZE:
+            self.__submit(bytes(self.__buf[:DEFLATE_BLOCK_SIZE]), False)
+            del self.__buf[:DEFLATE_BLOCK_SIZE]
+        done = []
+        while len(self.__pending) > self.__limit:
+            done.append(self.__pending.popleft().result())
+        return b''.join(done)
+
+    def flush(self):
+        self.__submit(bytes(self.__buf), True)
+        self.__buf.clear()
+        done = [block.result() for block in self.__pending]
+        self.__pending.clear()
+        return b''.join(done)
+
+
+class _GzipWriter:
+    """Writes a gzip member into fileobj, the deflate runs on archive_pool()"""
+
+    def __init__(self, fileobj):
+        self.__fileobj = fileobj
+        self.__deflate = _ParallelDeflate()
+        self.__crc = 0
+        self.__size = 0
+        fileobj.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\xff')
+
+    def write(self, data):
+        self.__crc = zlib.crc32(data, self.__crc)
+        self.__size += len(data)
+        self.__fileobj.write(self.__deflate.compress(data))
+        return len(data)
+
+    def close(self):
+        self.__fileobj.write(self.__deflate.flush())
+        self.__fileobj.write(struct.pack('<II', self.__crc, self.__size & 0xffffffff))
+
+    def abort(self):
+        pass
+
+
+class _ZstdWriter:
+    """Pipes the data through zstd -T<ARCHIVE_THREADS> into fileobj"""
+
+    def __init__(self, fileobj):
+        self.__fileobj = fileobj
+        self.__error = None
+        self.__proc = subprocess.Popen(["zstd", f"-T{ARCHIVE_THREADS}", "-q", "-c"], stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, bufsize=ARCHIVE_BUFFER_SIZE)
+        self.__pump = threading.Thread(target=self.__drain, daemon=True)
+        self.__pump.start()
+
+    def __drain(self):
+        try:
+            for chunk in iter(lambda: self.__proc.stdout.read(ARCHIVE_BUFFER_SIZE), b''):
+                self.__fileobj.write(chunk)
+        except BaseException as e:
+            # an upload cancelled mid-way lands here, the writer side raises it again
+            self.__error = e
+            self.__proc.kill()
+
+    def write(self, data):
+        try:
+            self.__proc.stdin.write(data)
+        except BrokenPipeError:
+            raise self.__error or OSError("zstd exited early")
+        return len(data)
+
+    def close(self):
+        try:
+            self.__proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.__pump.join()
+        code = self.__proc.wait()
+        if self.__error is not None:
+            raise self.__error
+        if code != 0:
+            raise OSError(f"zstd exited with {code}")
+
+    def abort(self):
+        if self.__proc.poll() is None:
+            self.__proc.kill()
+            self.__proc.wait()
+
+
+def _codec_writer(fileobj, codec):
+    if codec == 'zstd':
+        return _ZstdWriter(fileobj)
+    if codec == 'gzip':
+        return _GzipWriter(fileobj)
+    return None
+
+
+def tar(org_path, selflistener, codec=None):
     try:
-        tar_path = org_path + ".tar"
-        path = pathlib.PurePath(org_path)
+        codec = codec or tar_codec(org_path)
+        tar_path = f"{org_path}.{archive_suffix('tar', codec)}"
         LOGGER.info(f'Tar: orig_path: {org_path}, tar_path: {tar_path}')
-        tar = tarfile.open(tar_path, "w")
-        tar.add(org_path, arcname=path.name)
-        tar.close()
+        with open(tar_path, "wb") as f:
+            stream_tar(org_path, f, codec=codec)
         return tar_path
     except OSError as err:
         LOGGER.info(f"OsError Is {err}")
@@ -71,14 +291,8 @@ def tar(org_path, selflistener):
 def zip(orig_path: str, dir_path: str, selflistener):
     try:
         zip_path = orig_path + ".zip"
-        zf = zipfile.ZipFile(zip_path, "w")
-        abs_src = os.path.abspath(orig_path)
-        for dirname, subdirs, files in os.walk(orig_path):
-            for filename in files:
-                absname = os.path.abspath(os.path.join(dirname, filename))
-                arcname = absname[len(abs_src) + 1:]
-                zf.write(absname, arcname)
-        zf.close()        
+        with open(zip_path, "wb") as f:
+            stream_zip(orig_path, f)
         return zip_path
     except OSError as err:
         LOGGER.info(f"OsError Is {err}")
@@ -87,6 +301,156 @@ def zip(orig_path: str, dir_path: str, selflistener):
         LOGGER.info(f"Deleting Folder : {orig_path}")
         return False     
 
+class _ProgressReader:
+    """Wraps a file opened for reading and reports every read to on_progress"""
+
+    def __init__(self, fileobj, on_progress=None):
+        self.__fileobj = fileobj
+        self.__on_progress = on_progress
+
+    def read(self, size=-1):
+        data = self.__fileobj.read(size)
+        if self.__on_progress is not None and data:
+            self.__on_progress(len(data))
+        return data
+
+
+def stream_tar(org_path, fileobj, on_progress=None, codec='none'):
+    """
+    Writes a tar of org_path into fileobj as a stream, fileobj does not need to be seekable.
+    on_progress gets the number of source bytes archived after every read, codec is one
+    of TAR_SUFFIXES.
+    """
+    path = pathlib.PurePath(org_path)
+    writer = _codec_writer(fileobj, codec)
+    try:
+        with tarfile.open(fileobj=writer or fileobj, mode="w|", bufsize=ARCHIVE_BUFFER_SIZE) as tar:
+            tar.add(org_path, arcname=path.name, recursive=False)
+            for root, dirs, files in os.walk(org_path):
+                for name in dirs + files:
+                    absname = os.path.join(root, name)
+                    arcname = os.path.join(path.name, os.path.relpath(absname, org_path))
+                    tarinfo = tar.gettarinfo(absname, arcname)
+                    if tarinfo.isreg():
+                        with open(absname, "rb") as f:
+                            tar.addfile(tarinfo, _ProgressReader(f, on_progress))
+                    else:
+                        tar.addfile(tarinfo)
+        if writer is not None:
+            writer.close()
+    finally:
+        if writer is not None:
+            writer.abort()
+
+
+class _ZipWriter:
+    """
+    Writes a zip into fileobj front to back, it never seeks. Every entry is its local
+    header, the data and a data descriptor with the crc and sizes, the central directory
+    follows at close(). Deflated entries go through _ParallelDeflate.
+    """
+
+    def __init__(self, fileobj):
+        self.__fileobj = fileobj
+        self.__offset = 0
+        self.__entries = []
+
+    def __write(self, data):
+        self.__fileobj.write(data)
+        self.__offset += len(data)
+
+    @staticmethod
+    def __dos_time(mtime):
+        t = time.localtime(mtime)
+        if t.tm_year < 1980:
+            return 0, (1 << 5) | 1
+        return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+               ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    def add(self, path, arcname, deflate, on_progress=None):
+        st = os.stat(path)
+        name = arcname.replace(os.sep, '/').encode('utf-8')
+        dos_time, dos_date = self.__dos_time(st.st_mtime)
+        method = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+        # data descriptor follows, the name is utf-8
+        flags = 0x08 | 0x800
+        zip64 = st.st_size * 1.05 > ZIP64_LIMIT
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            header_size = 0xffffffff
+        else:
+            extra = b''
+            header_size = 0
+        offset = self.__offset
+        self.__write(struct.pack('<4s5H3L2H', b'PK\x03\x04', 45 if zip64 else 20, flags, method,
+                                 dos_time, dos_date, 0, header_size, header_size, len(name), len(extra)))
+        self.__write(name + extra)
+        compressor = _ParallelDeflate() if deflate else None
+        crc = size = compress_size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ARCHIVE_BUFFER_SIZE), b''):
+                if on_progress is not None:
+                    on_progress(len(chunk))
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                compress_size += len(chunk)
+                self.__write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            self.__write(chunk)
+        if not zip64 and max(size, compress_size) > ZIP64_LIMIT:
+            raise OSError(f"{path} grew past the zip64 limit while it was archived")
+        self.__write(struct.pack('<4sLQQ' if zip64 else '<4s3L', b'PK\x07\x08', crc, compress_size, size))
+        self.__entries.append((name, flags, method, dos_time, dos_date, crc, compress_size, size, offset, st.st_mode,
+                               zip64))
+
+    def close(self):
+        start = self.__offset
+        for name, flags, method, dos_time, dos_date, crc, compress_size, size, offset, mode, zip64 in self.__entries:
+            # zip64 extra holds only the fields too big for the header, in this order, an entry
+            # whose local header was zip64 keeps its sizes there so both headers agree
+            fields = []
+            if zip64 or max(size, compress_size) > ZIP64_LIMIT:
+                fields += [size, compress_size]
+                size = compress_size = 0xffffffff
+            if offset > ZIP64_LIMIT:
+                fields.append(offset)
+                offset = 0xffffffff
+            extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+            version = 45 if fields else 20
+            # made by unix, so the mode survives extraction
+            self.__write(struct.pack('<4s4B4H3L5H2L', b'PK\x01\x02', version, 3, version, 0, flags, method,
+                                     dos_time, dos_date, crc, compress_size, size, len(name), len(extra), 0,
+                                     0, 0, (mode & 0xffff) << 16, offset))
+            self.__write(name + extra)
+        count = len(self.__entries)
+        cd_size = self.__offset - start
+        if count >= 0xffff or start > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            end64 = self.__offset
+            self.__write(struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, cd_size, start))
+            self.__write(struct.pack('<4sLQL', b'PK\x06\x07', 0, end64, 1))
+        self.__write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, min(count, 0xffff), min(count, 0xffff),
+                                 min(cd_size, 0xffffffff), min(start, 0xffffffff), 0))
+
+
+def stream_zip(orig_path, fileobj, on_progress=None):
+    """
+    Same as stream_tar but writes a zip, fileobj does not need to be seekable either.
+    Entries are deflated when ZIP_CODEC is deflate, compressed media is stored.
+    """
+    abs_src = os.path.abspath(orig_path)
+    zf = _ZipWriter(fileobj)
+    for dirname, subdirs, files in os.walk(orig_path):
+        for filename in files:
+            absname = os.path.abspath(os.path.join(dirname, filename))
+            arcname = absname[len(abs_src) + 1:]
+            zf.add(absname, arcname, ZIP_CODEC == 'deflate' and not is_compressed_media(filename), on_progress)
+    zf.close()
+
+
 def get_base_name(orig_path: str):
     if orig_path.endswith(".tar.bz2"):
         return orig_path.replace(".tar.bz2", "")
@@ -0,0 +1,251 @@
+import logging
+import itertools
+import threading
+from typing import NamedTuple, Callable
+
+from bot import download_dict, download_dict_lock, OWNER_ID, MAX_CONCURRENT_JOBS, ENGINE_JOB_LIMITS, \
+    JOB_QUEUE_POLICY
+from bot.helper.ext_utils.bot_utils import setInterval, register_stage, get_readable_file_size
+from bot.helper.ext_utils.disk_ledger import DISK_LEDGER, job_footprint
+from bot.helper.ext_utils.pipeline import POSTPROCESS_STAGE, UPLOAD_STAGE
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds between two looks for slots held by jobs that left download_dict without a listener callback
+JOB_SWEEP_INTERVAL = 60
+
+ENGINE_ARIA2 = 'aria2'
+ENGINE_QBIT = 'qbit'
+ENGINE_GDRIVE = 'gdrive'
+ENGINE_TELEGRAM = 'telegram'
+ENGINE_YTDL = 'ytdl'
+ENGINE_WGET = 'wget'
+# engines that write to disk but only learn the size of a job once it runs
+SIZED_LATE = (ENGINE_ARIA2, ENGINE_QBIT, ENGINE_YTDL)
+
+
+class Job(NamedTuple):
+    uid: int
+    engine: str
+    start: Callable
+    status: object
+    priority: int
+    seq: int
+    # disk bytes reserved in DISK_LEDGER before the job starts, 0 when the size is not known up front
+    space: int
+    # isTar, isZip and extract of the listener, a size learnt later is turned into a footprint with them
+    modes: tuple
+
+
+class JobScheduler:
+    """
+    Admission control in front of every download engine. A job starts right away when
+    the global budget and the budget of its engine both have a free slot and
+    DISK_LEDGER can reserve its footprint, otherwise it waits in download_dict as a
+    QueueStatus until a running job releases its slot or its space.
+    Waiting jobs are started in arrival order, or highest priority first, skipping the
+    ones whose engine is still full or whose footprint does not fit yet. No job starts
+    while one of the pipeline stages behind the downloads is full.
+    release() hands back the download slot once the files are on disk, finish() ends
+    the job and also frees its disk reservation. An engine that learns the size of a
+    job only once it started and finds no room for it hands it back with requeue().
+    Lock order is scheduler then download_dict_lock, neither is called with
+    download_dict_lock held.
+    A started job keeps its QueueStatus until the engine registers its own status, some
+    engines start asynchronously (the /wget relay). Engines report through started()
+    once they took the job and finish() when it ends, a job that has not reported a
+    start on two sweeps in a row is taken as lost and finished. The sweep also grows the
+    reservation of jobs whose size only became known once they started.
+    """
+
+    def __init__(self, total=0, budgets=None, policy='fifo', stages=()):
+        self.__lock = threading.Lock()
+        self.__total = total
+        self.__stages = stages
+        self.__budgets = budgets or {}
+        self.__policy = policy
+        self.__seq = itertools.count()
+        # uid: Job holding a download slot
+        self.__running = {}
+        # uids of running jobs whose engine reported a start
+        self.__started = set()
+        self.__queue = []
+        self.__missing = set()
+        self.__sweeper = None
+
+    def __fits(self, engine):
+        if any(stage.full() for stage in self.__stages):
+            return False
+        if self.__total and len(self.__running) >= self.__total:
+            return False
+        budget = self.__budgets.get(engine)
+        return not budget or sum(1 for job in self.__running.values() if job.engine == engine) < budget
+
+    def __order(self, job):
+        if self.__policy == 'priority':
+            return -job.priority, job.seq
+        return job.seq
+
+    def __admit(self, job):
+        self.__running[job.uid] = job
+        DISK_LEDGER.reserve(job.uid, job.space, force=True)
+
+    def submit(self, uid, engine, start, status, priority=0, space=0):
+        """
+        Runs start() now when a slot and space are free, otherwise shows status for the
+        job until they are and start() is called on a thread of its own
+        :return: True if the job started right away
+        """
+        if space > DISK_LEDGER.capacity():
+            status.listener.onDownloadError(f"Needs {get_readable_file_size(space)} of disk space, "
+                                            f"more than this server has")
+            return False
+        listener = status.listener
+        job = Job(uid, engine, start, status, priority, next(self.__seq), space,
+                  (listener.isTar, listener.isZip, listener.extract))
+        with self.__lock:
+            if self.__sweeper is None:
+                self.__sweeper = setInterval(JOB_SWEEP_INTERVAL, self.__sweep)
+            if self.__fits(engine) and space <= DISK_LEDGER.available():
+                self.__admit(job)
+                queued = False
+            else:
+                self.__queue.append(job)
+                self.__queue.sort(key=self.__order)
+                with download_dict_lock:
+                    download_dict[uid] = status
+                queued = True
+        if queued:
+            LOGGER.info(f"Queued {engine} job {uid}, {len(self.__queue)} waiting")
+            return False
+        self.__start(job)
+        return True
+
+    def started(self, uid):
+        """Called by the engine once it took the job, the sweep leaves the job alone from then on"""
+        with self.__lock:
+            if uid in self.__running:
+                self.__started.add(uid)
+
+    def requeue(self, uid, space):
+        """
+        Puts a started job back in the queue, it starts again once space bytes are free
+        :return: False if the job is not running or space is more than the disk could hold
+        """
+        if space > DISK_LEDGER.capacity():
+            return False
+        with self.__lock:
+            job = self.__running.pop(uid, None)
+            if job is None:
+                return False
+            self.__started.discard(uid)
+            DISK_LEDGER.release(uid)
+            # the job keeps its seq and so its place in line
+            job = job._replace(space=space)
+            self.__queue.append(job)
+            self.__queue.sort(key=self.__order)
+            with download_dict_lock:
+                download_dict[uid] = job.status
+        LOGGER.info(f"Requeued {job.engine} job {uid} until {get_readable_file_size(space)} are free")
+        self.wake()
+        return True
+
+    def release(self, uid):
+        """Frees the download slot of a job whose files are on disk, its space stays reserved"""
+        with self.__lock:
+            self.__running.pop(uid, None)
+            self.__started.discard(uid)
+        self.wake()
+
+    def finish(self, uid):
+        """Drops a finished, failed or cancelled job with its slot and disk reservation"""
+        with self.__lock:
+            self.__running.pop(uid, None)
+            self.__started.discard(uid)
+            self.__queue = [job for job in self.__queue if job.uid != uid]
+            DISK_LEDGER.release(uid)
+        self.wake()
+
+    def wake(self):
+        """Starts the waiting jobs that fit now"""
+        promoted = []
+        with self.__lock:
+            if not self.__queue:
+                return
+            room = DISK_LEDGER.available()
+            for job in list(self.__queue):
+                if self.__fits(job.engine) and job.space <= room:
+                    self.__queue.remove(job)
+                    self.__admit(job)
+                    room -= job.space
+                    promoted.append(job)
+        for job in promoted:
+            LOGGER.info(f"Starting queued {job.engine} job {job.uid}")
+            threading.Thread(target=self.__start, args=(job,), daemon=True).start()
+
+    def cancel(self, uid):
+        """:return: True if the job was still waiting and is now dropped"""
+        with self.__lock:
+            for job in self.__queue:
+                if job.uid == uid:
+                    self.__queue.remove(job)
+                    return True
+        return False
+
+    def __start(self, job):
+        try:
+            job.start()
+        except Exception as e:
+            LOGGER.error(f"Could not start {job.engine} job {job.uid}: {e}")
+            # the listener drops the job and releases its slot
+            job.status.listener.onDownloadError(f"Could not start the download: {e}")
+
+    def __sweep(self):
+        with self.__lock:
+            running = list(self.__running.values())
+            missing = {job.uid for job in running if job.uid not in self.__started}
+            with download_dict_lock:
+                statuses = {job: download_dict[job.uid] for job in running
+                            if job.uid in download_dict and job.engine in SIZED_LATE}
+            stale = missing & self.__missing
+            self.__missing = missing - stale
+        for job in running:
+            if job.uid not in stale:
+                continue
+            LOGGER.warning(f"Job {job.uid} never reported a start, finishing it")
+            with download_dict_lock:
+                # an engine that stopped before registering its own status leaves the queued one behind
+                if download_dict.get(job.uid) is job.status:
+                    del download_dict[job.uid]
+            self.finish(job.uid)
+        for job, status in statuses.items():
+            try:
+                size = status.size_raw()
+            except Exception:
+                continue
+            if not isinstance(size, int) or size <= 0:
+                continue
+            footprint = job_footprint(size, *job.modes)
+            if not DISK_LEDGER.reserve(job.uid, footprint):
+                # the engine already writes, the forced growth keeps the queue waiting until it is done
+                LOGGER.warning(f"{job.engine} job {job.uid} needs {get_readable_file_size(footprint)}, "
+                               f"more than is free, holding back queued jobs")
+                DISK_LEDGER.reserve(job.uid, footprint, force=True)
+        DISK_LEDGER.measure()
+        self.wake()
+
+    def counts(self):
+        """:return: running and waiting jobs"""
+        with self.__lock:
+            return len(self.__running), len(self.__queue)
+
+
+JOB_SCHEDULER = JobScheduler(MAX_CONCURRENT_JOBS, ENGINE_JOB_LIMITS, JOB_QUEUE_POLICY,
+                             (POSTPROCESS_STAGE, UPLOAD_STAGE))
+POSTPROCESS_STAGE.on_drain = JOB_SCHEDULER.wake
+UPLOAD_STAGE.on_drain = JOB_SCHEDULER.wake
+register_stage('DL', JOB_SCHEDULER.counts)
+
+
+def job_priority(message):
+    return 1 if message.from_user is not None and message.from_user.id == OWNER_ID else 0
@@ -0,0 +1,101 @@
+import os
+import time
+import base64
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from bot.helper.ext_utils import Hash_Fetch
+
+LOGGER = logging.getLogger(__name__)
+
+MIRROR_CACHE_DB = "mirror_cache.db"
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+
+class MirrorCache:
+    """
+    Drive links of finished mirrors, keyed by what identifies the source (torrent
+    info-hash, normalized url or telegram file_unique_id) and the mirror mode, since a
+    tar of a source is a different result than the plain mirror of it
+    """
+
+    def __init__(self, db_path=MIRROR_CACHE_DB):
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(db_path, check_same_thread=False)
+        self.__db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT, mode TEXT, name TEXT, size TEXT, "
+                          "link TEXT, index_link TEXT, created REAL, PRIMARY KEY (key, mode))")
+        self.__db.commit()
+
+    def get(self, key, mode):
+        if key is None:
+            return None
+        with self.__lock:
+            row = self.__db.execute("SELECT name, size, link, index_link FROM results WHERE key = ? AND mode = ?",
+                                    (key, mode)).fetchone()
+        if row is None:
+            return None
+        LOGGER.info(f"Mirror cache hit for {key} ({mode})")
+        return dict(zip(('name', 'size', 'link', 'index_link'), row))
+
+    def put(self, key, mode, name, size, link, index_link=None):
+        if key is None:
+            return
+        with self.__lock:
+            self.__db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (key, mode, name, size, link, index_link, time.time()))
+            self.__db.commit()
+
+    def forget(self, key, mode):
+        with self.__lock:
+            self.__db.execute("DELETE FROM results WHERE key = ? AND mode = ?", (key, mode))
+            self.__db.commit()
+
+
+MIRROR_CACHE = MirrorCache()
+
+
+def mirror_mode(isTar=False, extract=False, isZip=False):
+    if isTar:
+        return 'tar'
+    if isZip:
+        return 'zip'
+    if extract:
+        return 'extract'
+    return 'mirror'
+
+
+def normalize_url(url):
+    """Lowercases scheme and host, drops default ports and fragments and sorts the query"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{parts.port}"
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def key_for_link(link):
+    """:return: cache key of a magnet, a downloaded .torrent file or an url, None if it has none"""
+    try:
+        if link.startswith('magnet:'):
+            info_hash = Hash_Fetch.get_hash_magnet(link)
+            if info_hash and len(info_hash) == 32:
+                # base32 magnets name the same torrent as the hex ones .torrent files give
+                info_hash = base64.b32decode(info_hash.upper()).hex()
+            return f"btih:{info_hash}" if info_hash else None
+        if os.path.isfile(link):
+            info_hash = Hash_Fetch.get_hash_file(link)
+            return f"btih:{info_hash}" if info_hash else None
+        return f"url:{normalize_url(link)}"
+    except Exception as e:
+        LOGGER.warning(f"No mirror cache key for {link}: {e}")
+        return None
+
+
+def key_for_media(media):
+    return f"tg:{media.file_unique_id}"
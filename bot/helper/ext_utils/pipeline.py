@@ -0,0 +1,98 @@
+import logging
+import threading
+from collections import deque
+
+from bot import PIPELINE_POSTPROCESS_WORKERS, PIPELINE_UPLOAD_WORKERS, PIPELINE_QUEUE_DEPTH
+from bot.helper.ext_utils.bot_utils import register_stage
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    One step of the mirror pipeline after the download: a queue of jobs and a fixed
+    pool of worker threads draining it. submit() never blocks, it runs on the engine
+    callback threads. A stage holding depth jobs or more is full(), JobScheduler starts
+    no new download then, so a stage that falls behind slows the downloads instead of
+    piling up work. on_drain is called once a full stage has room again.
+    """
+
+    def __init__(self, name, workers, depth):
+        self.name = name
+        self.__workers = workers
+        self.__depth = depth
+        self.__cond = threading.Condition()
+        self.__jobs = deque()
+        self.__active = 0
+        self.__started = False
+        self.on_drain = None
+
+    def __start_workers(self):
+        for i in range(self.__workers):
+            threading.Thread(target=self.__run, name=f"{self.name}-{i}", daemon=True).start()
+        self.__started = True
+
+    def submit(self, listener, work):
+        """Queues work() for the pool, a failure in it is reported as an upload error of listener"""
+        with self.__cond:
+            if not self.__started:
+                self.__start_workers()
+            self.__jobs.append((listener, work))
+            self.__cond.notify()
+
+    def full(self):
+        with self.__cond:
+            return len(self.__jobs) >= self.__depth
+
+    def cancel(self, uid):
+        """:return: True if the job of uid was still waiting and is now dropped"""
+        with self.__cond:
+            for job in self.__jobs:
+                if job[0].uid == uid:
+                    drained = len(self.__jobs) == self.__depth
+                    self.__jobs.remove(job)
+                    break
+            else:
+                return False
+        if drained:
+            self.__drained()
+        return True
+
+    def __drained(self):
+        if self.on_drain is not None:
+            self.on_drain()
+
+    def counts(self):
+        """:return: running and waiting jobs"""
+        with self.__cond:
+            return self.__active, len(self.__jobs)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__jobs:
+                    self.__cond.wait()
+                drained = len(self.__jobs) == self.__depth
+                listener, work = self.__jobs.popleft()
+                self.__active += 1
+            if drained:
+                self.__drained()
+            try:
+                work()
+            except Exception as e:
+                LOGGER.exception(f"{self.name} stage failed for {listener.uid}")
+                # the worker must outlive a listener that has nothing left to clean up
+                try:
+                    listener.onUploadError(f"{self.name} failed: {e}")
+                except Exception:
+                    LOGGER.exception(f"Could not report the {self.name} failure of {listener.uid}")
+            finally:
+                with self.__cond:
+                    self.__active -= 1
+
+
+# archiving and extraction are cpu bound, they get their own pool so they never hold up uploads
+POSTPROCESS_STAGE = Stage('Post-process', PIPELINE_POSTPROCESS_WORKERS, PIPELINE_QUEUE_DEPTH)
+UPLOAD_STAGE = Stage('Upload', PIPELINE_UPLOAD_WORKERS, PIPELINE_QUEUE_DEPTH)
+register_stage('PP', POSTPROCESS_STAGE.counts)
+register_stage('UL', UPLOAD_STAGE.counts)
@@ -19,6 +19,8 @@ from httplib2 import Http
 from googleapiclient.errors import HttpError
 from google.auth.transport.requests import Request
 from bot.helper.ext_utils.exceptions import ProcessCanceled
+from bot.helper.ext_utils.mirror_cache import MIRROR_CACHE, mirror_mode
+from bot.helper.ext_utils.job_scheduler import JOB_SCHEDULER
 from bot.helper.telegram_helper.message_utils import *
 from bot.helper.telegram_helper import button_build
 
@@ -26,10 +28,11 @@ from tenacity import *
 from bot.helper.ext_utils.bot_utils import *
 
 from bot import parent_id, DOWNLOAD_DIR, IS_TEAM_DRIVE, INDEX_URL, \
-    USE_SERVICE_ACCOUNTS, download_dict, download_dict_lock, Interval
+    USE_SERVICE_ACCOUNTS, download_dict, download_dict_lock, Interval, RELAY_CONNECTIONS
 from bot.helper.ext_utils.bot_utils import *
 from bot.helper.ext_utils.fs_utils import get_mime_type
 from bot.helper.mirror_utils.upload_utils import gdriveTools
+from bot.helper.mirror_utils.upload_utils.stream_upload import get_committed_offset
 from bot.helper.mirror_utils.status_utils.aio_download_status import AioDownloadStatus
 from bot.helper.telegram_helper.bot_commands import BotCommands
 
@@ -37,11 +40,39 @@ from bot.helper.telegram_helper.bot_commands import BotCommands
 global_lock = threading.Lock()
 GLOBAL_GID = set()
 
+# drive wants every chunk but the last one to be a multiple of 256KB
+RELAY_CHUNK_SIZE = 10 * 1024 * 1024
+# buffers shared by the source reader and the drive writer, caps the relay's memory
+RELAY_BUFFERS = 3
+RANGE_RETRIES = 3
+# how often a broken relay is picked up again from drive's committed offset
+RELAY_RESUMES = 5
+# outside DOWNLOAD_DIR so start_cleanup leaves it alone, next to the other runtime state in data/
+RELAY_JOURNAL_DIR = "data/relay_journal"
+
 
 LOGGER = logging.getLogger(__name__)
 logging.getLogger('googleapiclient.discovery').setLevel(logging.ERROR)
 
 
+def load_relay_journals():
+    """:return journals of the relays that were still running when the bot went down"""
+    journals = []
+    if not os.path.isdir(RELAY_JOURNAL_DIR):
+        return journals
+    for name in os.listdir(RELAY_JOURNAL_DIR):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(RELAY_JOURNAL_DIR, name)
+        try:
+            with open(path) as f:
+                journals.append(json.load(f))
+        except (OSError, ValueError) as e:
+            LOGGER.error(f"Dropping unreadable relay journal {path}: {e}")
+            os.remove(path)
+    return journals
+
+
 class AioHttpDownload:
     def __init__(self, name=None, listener=None):
         super().__init__()
@@ -56,7 +87,6 @@ class AioHttpDownload:
         self.__G_DRIVE_BASE_DOWNLOAD_URL = "https://drive.google.com/uc?id={}&export=download"
         self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL = "https://drive.google.com/drive/folders/{}"
         self.__listener = None
-        self.__service = gdriveTools.GoogleDriveHelper().authorize()
         self._parent_id = parent_id
         self.completed = 0
         self.list = 1
@@ -91,6 +121,12 @@ class AioHttpDownload:
         self.done_chunk = 0
         self.link = None
         self.gdrivelink = None
+        self.accept_ranges = False
+
+    @property
+    def __service(self):
+        # the drive client of whichever thread runs the call
+        return gdriveTools.drive_service()
 
     @property
     def gid(self):
@@ -155,15 +191,19 @@ class AioHttpDownload:
                     self.size = size    
                     self.__listener = listener
                     self.mimeType = response.headers['content-type']
+                    self.accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
                     LOGGER.info(f"mimetype is {self.mimeType}")     
                     try: 
                         self.updater = setInterval(self.update_interval, self._on_download_progress)     
                         self.__onDownloadStart(filename, size, listener) 
                         self.getsessionuri()
                         self.link = link
-                        await self._download(link)
+                        self.__save_journal()
+                        await self._download(response)
                     except HttpError as err:
                         LOGGER.info(f"Http error {err}")  
+                    finally:
+                        self.updater.cancel()
             except ClientResponseError as cerr:
                     await self.onClientError(cerr.message)
                     return None
@@ -184,37 +224,255 @@ class AioHttpDownload:
             error = (f"<b>HttpError {err.resp.status}</b>\n{err._get_reason()}")
             self.__onDownloadError(str(error))                                                                   
 
-    async def _download(self, link) -> None:
+    async def _download(self, response) -> None:
+        """
+        Relays the source into the resumable session. One task reads the source into a
+        small pool of reusable buffers while another PUTs the filled ones to drive, so
+        the fetch and the upload overlap instead of taking turns. When the relay breaks,
+        drive is asked how much it kept and the source is picked up again from there.
+        response is None when the source still has to be opened at done_chunk.
+        """
+        attempt = 0
+        while self.gdrivelink is None:
+            try:
+                await self.__relay(response)
+            except ProcessCanceled:
+                self.__drop_journal()
+                await self.onClientError("<b>Cancelled Due To User Request</b>")
+                return None
+            except Exception as e:
+                attempt += 1
+                if isinstance(e, ClientResponseError):
+                    e = e.message
+                if attempt > RELAY_RESUMES or not (self.accept_ranges or self.done_chunk == 0):
+                    LOGGER.error(f"Relay of {self.name} failed: {e}")
+                    self.__drop_journal()
+                    await self.onClientError(str(e))
+                    return None
+                LOGGER.warning(f"Relay of {self.name} broke at {self.done_chunk} ({e}), "
+                               f"resuming ({attempt}/{RELAY_RESUMES})")
+                await asyncio.sleep(2 ** attempt)
+                try:
+                    await self.__sync_offset()
+                except Exception as err:
+                    LOGGER.error(f"Could not query the upload session of {self.name}: {err}")
+            response = None
+        self.__drop_journal()
+        LOGGER.info(f"Relayed {get_readable_file_size(self.done_chunk)} of {self.name}")
+        await self.__onUploadComplete()
+
+    async def __relay(self, response=None):
+        ranged = self.size - self.done_chunk > RELAY_CHUNK_SIZE and RELAY_CONNECTIONS > 1 and self.accept_ranges
+        if response is not None and (ranged or self.done_chunk):
+            response.close()
+            response = None
+        if response is None and not ranged:
+            headers = {'Range': f'bytes={self.done_chunk}-'} if self.done_chunk else None
+            async with self.session.get(self.link, headers=headers) as response:
+                if self.done_chunk and response.status != 206:
+                    raise Exception(f"Source ignored the range request ({response.status})")
+                return await self.__relay(response)
+        # ranged fetches get a buffer per connection on top, that is the reorder window
+        buffers = RELAY_BUFFERS + RELAY_CONNECTIONS if ranged else RELAY_BUFFERS
+        free = asyncio.Queue()
+        for _ in range(buffers):
+            free.put_nowait(bytearray(RELAY_CHUNK_SIZE))
+        filled = asyncio.Queue(maxsize=buffers)
+        if ranged:
+            LOGGER.info(f"Relaying {self.name} over {RELAY_CONNECTIONS} ranged connections")
+            producer = asyncio.ensure_future(self.__read_ranges(free, filled))
+        else:
+            producer = asyncio.ensure_future(self.__read_source(response.content, free, filled))
+        consumer = asyncio.ensure_future(self.__write_drive(free, filled))
         try:
-            async with self.session.get(link) as response:
-                while True:
-                    if self._is_canceled == True:
-                        await self.onClientError("<b>Cancelled Due To User Request</b>")
-                        break
-                    try:
-                        chunk = await response.content.readexactly(10485760) #5mb chunk recommended is 50mb for best performace
-                        self.downloaded_chunk += len(chunk)
-                        await self.upload_file(chunk)
-                        self.done_chunk += len(chunk)
-                        if response.content.at_eof():
-                            LOGGER.info("Ya and i'm done with the chunks")
-                            LOGGER.info(get_readable_file_size(self.downloaded_chunk))
-                            break  
-                    except asyncio.IncompleteReadError as err:
-                        eofchunk = err.partial
-                        self.downloaded_chunk += len(eofchunk)
-                        await self.upload_file(eofchunk)
-                        self.done_chunk += len(eofchunk)
-                        if response.content.at_eof():
-                            LOGGER.info("Ya and i'm done with the chunks")
-                            LOGGER.info(get_readable_file_size(self.downloaded_chunk))
-                            break                           
-        except ClientResponseError as cerr:   
-            await self.onClientError(cerr.message)
-            return None
-            
+            await asyncio.gather(producer, consumer)
+        finally:
+            producer.cancel()
+            consumer.cancel()
+
+    async def __sync_offset(self):
+        """Asks the resumable session how many bytes drive kept and rewinds to there"""
+        async with aiohttp.ClientSession() as session:
+            async with session.put(self.resumableuri, allow_redirects=False,
+                                   headers={"Content-Range": f"bytes */{self.size or '*'}"}) as r:
+                if r.status in (200, 201):
+                    result = await r.json(content_type=None)
+                    self.gdrivelink = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(result['id'])
+                    self.done_chunk = int(result.get('size', self.size or self.done_chunk))
+                    self.size = self.done_chunk
+                elif r.status == 308:
+                    self.done_chunk = get_committed_offset(r.headers.get('Range'))
+                else:
+                    raise Exception(f"Upload session is gone: {r.status} {await r.text()}")
+        self.downloaded_chunk = self.done_chunk
+        self.__save_journal()
+
+    def __journal_path(self):
+        return os.path.join(RELAY_JOURNAL_DIR, f"{self.__listener.uid}.json")
+
+    def __save_journal(self):
+        journal = {
+            'link': self.link,
+            'name': self.name,
+            'size': self.size,
+            'mimeType': self.mimeType,
+            'resumableuri': self.resumableuri,
+            'done_chunk': self.done_chunk,
+            'accept_ranges': self.accept_ranges,
+            'chat_id': self.__listener.message.chat.id,
+            'message_id': self.__listener.message.id,
+        }
+        try:
+            os.makedirs(RELAY_JOURNAL_DIR, exist_ok=True)
+            tmp = self.__journal_path() + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(journal, f)
+            os.replace(tmp, self.__journal_path())
+        except OSError as e:
+            LOGGER.error(f"Could not write relay journal of {self.name}: {e}")
+
+    def __drop_journal(self):
+        try:
+            os.remove(self.__journal_path())
+        except OSError:
+            pass
+
+    async def resume_download(self, journal, listener):
+        """Picks up a relay from its journal after a restart"""
+        self.__listener = listener
+        self.link = journal['link']
+        self.size = journal['size']
+        self.mimeType = journal['mimeType']
+        self.resumableuri = journal['resumableuri']
+        self.accept_ranges = journal['accept_ranges']
+        self.done_chunk = self.downloaded_chunk = journal['done_chunk']
+        LOGGER.info(f"Resuming relay of {journal['name']} at {self.done_chunk}")
+        self.updater = setInterval(self.update_interval, self._on_download_progress)
+        self.__onDownloadStart(journal['name'], self.size, listener)
+        try:
+            async with aiohttp.ClientSession(raise_for_status=True) as self.session:
+                await self.__sync_offset()
+                await self._download(None)
         except Exception as e:
-            LOGGER.info(f"{e}") 
+            LOGGER.error(f"Could not resume relay of {journal['name']}: {e}")
+            self.__drop_journal()
+            await self.onClientError(str(e))
+        finally:
+            self.updater.cancel()
+
+    async def __read_source(self, reader, free, filled):
+        while True:
+            if self._is_canceled:
+                raise ProcessCanceled
+            buf = await free.get()
+            length = 0
+            while length < len(buf):
+                data = await reader.read(len(buf) - length)
+                if not data:
+                    break
+                buf[length:length + len(data)] = data
+                length += len(data)
+                self.downloaded_chunk += len(data)
+            eof = length < len(buf)
+            await filled.put((buf, length, eof))
+            if eof:
+                return
+
+    async def __read_ranges(self, free, filled):
+        """
+        Fetches RELAY_CHUNK_SIZE segments over RELAY_CONNECTIONS parallel Range requests
+        and queues them for drive strictly in order. A worker takes a buffer before it
+        claims the next segment, so the oldest missing segment always has one.
+        """
+        segments = [(start, min(start + RELAY_CHUNK_SIZE, self.size))
+                    for start in range(self.done_chunk, self.size, RELAY_CHUNK_SIZE)]
+        ready = {}
+        cursor = {'claimed': 0, 'queued': 0}
+
+        async def worker():
+            while True:
+                if self._is_canceled:
+                    raise ProcessCanceled
+                buf = await free.get()
+                if cursor['claimed'] == len(segments):
+                    free.put_nowait(buf)
+                    return
+                index = cursor['claimed']
+                cursor['claimed'] += 1
+                start, end = segments[index]
+                ready[index] = (buf, await self.__fetch_range(buf, start, end))
+                while cursor['queued'] in ready:
+                    buf, length = ready.pop(cursor['queued'])
+                    cursor['queued'] += 1
+                    filled.put_nowait((buf, length, cursor['queued'] == len(segments)))
+
+        await asyncio.gather(*(worker() for _ in range(min(RELAY_CONNECTIONS, len(segments)))))
+
+    async def __fetch_range(self, buf, start, end):
+        for attempt in range(1, RANGE_RETRIES + 1):
+            length = 0
+            try:
+                async with self.session.get(self.link, headers={'Range': f'bytes={start}-{end - 1}'}) as r:
+                    if r.status != 206:
+                        raise Exception(f"Source ignored the range request ({r.status})")
+                    while length < end - start:
+                        data = await r.content.read(end - start - length)
+                        if not data:
+                            break
+                        buf[length:length + len(data)] = data
+                        length += len(data)
+                        self.downloaded_chunk += len(data)
+                if length == end - start:
+                    return length
+                raise aiohttp.ClientPayloadError(f"Got {length} of {end - start} bytes at {start}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.downloaded_chunk -= length
+                if attempt == RANGE_RETRIES:
+                    raise
+                LOGGER.warning(f"Range {start}-{end - 1} of {self.name} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt)
+
+    async def __write_drive(self, free, filled):
+        async with aiohttp.ClientSession() as session:
+            while True:
+                buf, length, eof = await filled.get()
+                if self._is_canceled:
+                    raise ProcessCanceled
+                await self.__put_chunk(session, memoryview(buf)[:length], eof)
+                free.put_nowait(buf)
+                if eof:
+                    break
+        if self.gdrivelink is None:
+            raise Exception("Drive did not confirm the upload")
+
+    async def __put_chunk(self, session, chunk, final):
+        """PUTs chunk at done_chunk, resending whatever part drive did not keep"""
+        offset = 0
+        while self.gdrivelink is None:
+            start = self.done_chunk
+            part = chunk[offset:]
+            # chunked sources have no Content-Length, drive learns the total on the last chunk
+            total = start + len(part) if final else (self.size or '*')
+            if len(part):
+                content_range = f"bytes {start}-{start + len(part) - 1}/{total}"
+            else:
+                content_range = f"bytes */{total}"
+            async with session.put(self.resumableuri, data=part, allow_redirects=False,
+                                   headers={"Content-Range": content_range}) as r:
+                if r.status in (200, 201):
+                    result = await r.json(content_type=None)
+                    self.gdrivelink = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(result['id'])
+                    self.done_chunk = start + len(part)
+                    self.size = self.done_chunk
+                    return
+                if r.status != 308:
+                    raise Exception(f"Drive refused the chunk: {r.status} {await r.text()}")
+                committed = get_committed_offset(r.headers.get('Range'))
+            offset += committed - start
+            self.done_chunk = committed
+            self.__save_journal()
+            if offset >= len(chunk):
+                return
 
     def __onDownloadError(self, error):
         with global_lock:
@@ -231,6 +489,7 @@ class AioHttpDownload:
         with download_dict_lock:
             del download_dict[self.__listener.uid]
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.__listener.uid)
         if count == 0:
             await self.clean()
         else:
@@ -254,12 +513,16 @@ class AioHttpDownload:
             buttons = button_build.ButtonMaker()
             buttons.buildbutton("⚡GDrive Link⚡", self.gdrivelink)
             LOGGER.info(f'Done Uploading {self.name}')
+            share_url = None
             if INDEX_URL is not None:
                 share_url = requests.utils.requote_uri(f'{INDEX_URL}/{self.name}')
                 buttons.buildbutton("🔥Index Link🔥", share_url)
                 buttons.buildbutton("❣️Join TeamDrive❣️", 'https://t.me/c/1271941524/361972')    
+            MIRROR_CACHE.put(self.__listener.cache_key, mirror_mode(), self.name,
+                             get_readable_file_size(self.size), self.gdrivelink, share_url)
             del download_dict[self.__listener.uid]
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.__listener.uid)
         await sendMarkup(msg, self.__listener.bot, self.__listener.update, InlineKeyboardMarkup(buttons.build_menu(2)))
         if count == 0:
             await self.clean()
@@ -293,7 +556,7 @@ class AioHttpDownload:
             if parent_id is not None:
                 file_metadata['parents'] = [self._parent_id]
 
-            headers = {"Authorization": "Bearer "+gdriveTools.GoogleDriveHelper().get_credentials(), "Content-Type": "application/json; charset=UTF-8"}
+            headers = {"Authorization": "Bearer "+gdriveTools.drive_credentials().token, "Content-Type": "application/json; charset=UTF-8"}
             r = requests.post(
             "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&supportsTeamDrives=True",
             data=json.dumps(file_metadata),
@@ -306,36 +569,6 @@ class AioHttpDownload:
             LOGGER.info(error)
             self.__onDownloadError(str(error)) 
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    async def upload_file(self, chunk, **kwargs) -> None:
-        try:
-            headers = {"Content-Length": str(len(chunk)), "Content-Range": f"bytes {str(self.done_chunk)}-" + str(self.downloaded_chunk - 1) + "/" + str(self.size)}
-            r = requests.put(
-                self.resumableuri,
-                headers=headers,
-                data=chunk
-            )
-            if r.text:
-                LOGGER.info(f"r.text is {r.text}")
-                self.gdrivelink = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(r.json()['id'])
-                await self.__onUploadComplete()
-                return r.text
-            #info = json.loads(r.text.decode("utf-8"))
-            #LOGGER.info(f"id is {info}")
-            #self.gdrivelink = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(r.json()['id'])
-            #LOGGER.info(r.text)
-            #LOGGER.info(f"{r.json()['id']}")
-            #self.__set_permission(r.json()['id'])
-        except HttpError as err:
-            if "416" in str(err):
-                f = open(f"{os.path.join(path, name)}", "w").close
-            else:
-                error = (f"<b>HttpError {err.resp.status}</b>\n{err._get_reason()}")
-                LOGGER.info(f"http error is {error}")
-                self.__onDownloadError(str(error))     
-
-
     @staticmethod
     def getIdFromUrl(link: str):
         if "folders" in link or "file" in link:
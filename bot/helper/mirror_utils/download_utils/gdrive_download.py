@@ -1,5 +1,6 @@
 import os
 import io
+import json
 import time
 import pickle
 import urllib.parse as urlparse
@@ -9,32 +10,173 @@ import random
 import string
 import re
 import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from httplib2 import Http
 from pySmartDL import SmartDL
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
-from google.auth.transport.requests import Request
+from googleapiclient.http import MediaIoBaseDownload, MediaDownloadProgress
+from google.auth.transport.requests import Request, AuthorizedSession
 from bot.helper.ext_utils.exceptions import ProcessCanceled
+from bot.helper.ext_utils.disk_ledger import DISK_LEDGER, job_footprint
+from bot.helper.ext_utils.job_scheduler import JOB_SCHEDULER
 from bot.helper.telegram_helper.message_utils import *
 
 from tenacity import *
 from bot.helper.ext_utils.bot_utils import *
 
 from bot import parent_id, DOWNLOAD_DIR, IS_TEAM_DRIVE, INDEX_URL, \
-    USE_SERVICE_ACCOUNTS, download_dict, download_dict_lock, MAX_TORRENT_SIZE
+    USE_SERVICE_ACCOUNTS, download_dict, download_dict_lock, MAX_TORRENT_SIZE, GDRIVE_DOWNLOAD_WORKERS, \
+    GDRIVE_FILE_CONNECTIONS, GDRIVE_RESUME, GDRIVE_RESUME_DIR
 from bot.helper.mirror_utils.upload_utils import gdriveTools
+from bot.helper.mirror_utils.upload_utils.drive_walker import list_folder, walk_tree
 from bot.helper.mirror_utils.status_utils.gdrivedownload_status import GDDownloadStatus
 from bot.helper.telegram_helper.bot_commands import BotCommands
 
 
 global_lock = threading.Lock()
 GLOBAL_GID = set()
+# drive ids whose resume directory a running job writes into
+RESUMING = set()
 
 
 LOGGER = logging.getLogger(__name__)
 logging.getLogger('googleapiclient.discovery').setLevel(logging.ERROR)
 
+# smaller than the sequential chunks, several of these are buffered at once
+WORKER_CHUNK_SIZE = 10 * 1024 * 1024
+# files are split into segments of this size once they span at least two of them
+SEGMENT_SIZE = 64 * 1024 * 1024
+MEDIA_URL = "https://www.googleapis.com/drive/v3/files/{}?alt=media&supportsAllDrives=true"
+# entries lost between two saves only cost a refetch
+MANIFEST_SAVE_INTERVAL = 5
+
+
+class ResumeManifest:
+    """
+    Remembers which files of a drive job are on disk, keyed by the drive id of the
+    job, so a restarted job skips them. Every file entry keeps the size and
+    md5Checksum drive reported when it was started, a file that changed on drive
+    since is fetched again from scratch.
+    Only one job at a time owns the directory of a drive id, see claim().
+    """
+
+    @classmethod
+    def claim(cls, drive_id):
+        """:return: the manifest of drive_id, None while another job is downloading it"""
+        with global_lock:
+            if drive_id in RESUMING:
+                return None
+            RESUMING.add(drive_id)
+        return cls(drive_id)
+
+    def __init__(self, drive_id):
+        self.__drive_id = drive_id
+        self.path = os.path.join(GDRIVE_RESUME_DIR, drive_id)
+        self.__file = os.path.join(GDRIVE_RESUME_DIR, f"{drive_id}.json")
+        self.__lock = threading.Lock()
+        self.__last_save = 0
+        self.__files = {}
+        try:
+            with open(self.__file) as f:
+                self.__files = json.load(f)
+            LOGGER.info(f"Resuming drive download {drive_id} with {len(self.__files)} known files")
+        except (OSError, ValueError):
+            pass
+        os.makedirs(self.path, exist_ok=True)
+
+    def resume(self, file_, segmented=False):
+        """
+        :return: the entry of a file that was started before with the same content and
+        download mode, None when it has to start over (the entry is reset then)
+        """
+        with self.__lock:
+            entry = self.__files.get(file_['id'])
+            if entry is not None and entry['size'] == file_.get('size') \
+                    and entry['md5Checksum'] == file_.get('md5Checksum') \
+                    and (entry['segments'] is not None) == segmented:
+                return dict(entry)
+            self.__files[file_['id']] = {'size': file_.get('size'), 'md5Checksum': file_.get('md5Checksum'),
+                                         'done': False, 'segments': [] if segmented else None}
+        self.save(force=False)
+        return None
+
+    def mark_segment(self, file_id, start):
+        with self.__lock:
+            self.__files[file_id]['segments'].append(start)
+        self.save(force=False)
+
+    def mark_done(self, file_id):
+        with self.__lock:
+            self.__files[file_id]['done'] = True
+        self.save(force=False)
+
+    def save(self, force=True):
+        with self.__lock:
+            if not force and time.time() - self.__last_save < MANIFEST_SAVE_INTERVAL:
+                return
+            self.__last_save = time.time()
+            try:
+                with open(f"{self.__file}.tmp", 'w') as f:
+                    json.dump(self.__files, f)
+                os.replace(f"{self.__file}.tmp", self.__file)
+            except OSError as e:
+                LOGGER.error(f"Could not save resume manifest {self.__file}: {e}")
+
+    def close(self):
+        """Saves what is on disk for the next run and lets another job claim the drive id"""
+        self.save()
+        with global_lock:
+            RESUMING.discard(self.__drive_id)
+
+    def drop(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.remove(self.__file)
+        except FileNotFoundError:
+            pass
+        with global_lock:
+            RESUMING.discard(self.__drive_id)
+
+
+class RangedMediaDownload:
+    """
+    Chunked download of a get_media request like MediaIoBaseDownload, starting at offset.
+    Every chunk asks for its bytes with an explicit Range header, so a resumed file
+    continues where the last run stopped. next_chunk() answers the same way, and raises
+    HttpError for a failed request (416 for an empty file).
+    """
+
+    def __init__(self, fd, request, chunksize, offset=0):
+        self.__fd = fd
+        self.__uri = request.uri
+        self.__http = request.http
+        self.__headers = dict(request.headers)
+        self.__chunksize = chunksize
+        self.__progress = offset
+        self.__total_size = None
+
+    def next_chunk(self, num_retries=0):
+        headers = dict(self.__headers, range=f"bytes={self.__progress}-{self.__progress + self.__chunksize - 1}")
+        for attempt in range(num_retries + 1):
+            resp, content = self.__http.request(self.__uri, 'GET', headers=headers)
+            if resp.status < 500 and resp.status != 429:
+                break
+            if attempt < num_retries:
+                time.sleep(random.random() + 2 ** attempt)
+        if resp.status not in (200, 206):
+            raise HttpError(resp, content, uri=self.__uri)
+        self.__fd.write(content)
+        self.__progress += len(content)
+        if 'content-range' in resp:
+            self.__total_size = int(resp['content-range'].rsplit('/', 1)[1])
+        elif 'content-length' in resp:
+            self.__total_size = int(resp['content-length'])
+        done = self.__total_size is None or self.__progress >= self.__total_size
+        return MediaDownloadProgress(self.__progress, self.__total_size), done
+
 
 class GDdownload:
     def __init__(self, name=None, listener=None):
@@ -50,7 +192,6 @@ class GDdownload:
         self.__G_DRIVE_BASE_DOWNLOAD_URL = "https://drive.google.com/uc?id={}&export=download"
         self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL = "https://drive.google.com/drive/folders/{}"
         self.__listener = None
-        self.__service = gdriveTools.GoogleDriveHelper().authorize()
         self._parent_id = parent_id
         self.completed = 0
         self.list = 1
@@ -79,6 +220,19 @@ class GDdownload:
         self.gdfoldersize = 0
         self.sfile = 0
         self.sfolder = 0
+        self.parallel = False
+        # bytes found on disk from an earlier run of the job in resume mode
+        self.resumed_bytes = 0
+        self.__manifest = None
+        self.__errored = False
+        self.__local = threading.local()
+        self.__progress_lock = threading.Lock()
+        self.__in_flight = {}
+
+    @property
+    def __service(self):
+        # the drive client of whichever thread runs the call
+        return gdriveTools.drive_service()
 
     @property
     def gid(self):
@@ -103,6 +257,11 @@ class GDdownload:
         except ZeroDivisionError:
             return 0    
 
+    def in_flight(self):
+        """:return number of files the folder workers are fetching right now"""
+        with self.__progress_lock:
+            return len(self.__in_flight)
+
     def __onDownloadStart(self, name, file_id, listener):
         if name.find("/"):
             name = name.replace("/", "~")
@@ -118,9 +277,12 @@ class GDdownload:
 
 
     def add_download(self, link: str, path, listener):
+        # the size walk and the clone take a while, the job is running from here
+        listener.onDownloadStarted()
         if (listener.isZip or listener.isTar or listener.extract):
+            # the listener callbacks close the job once the download started or errored
+            handed_over = False
             try:
-                total, used, free = shutil.disk_usage('.')
                 fileId = self.getIdFromUrl(link)
                 self.__listener = listener
                 meta = self.getFileMetadata(fileId)
@@ -147,21 +309,36 @@ class GDdownload:
                         maxsize = f"Max Size Currently Allowed is <b>{get_readable_file_size(allowed_size)}</b> and Your Download Size is <b>{get_readable_file_size(self.gdfoldersize)}</b>.\n<b>Thus Downlaod Stopped</b>"
                         sendMessage(maxsize, listener.bot, listener.update)
                         return
-                    elif self.gdfoldersize > free:
-                        sendMessage(f"<b>Not Enough Free Space on device</b>\n#gddiskfull",listener.bot,listener.update)
+                    footprint = job_footprint(self.gdfoldersize, listener.isTar, listener.isZip, listener.extract)
+                    if not DISK_LEDGER.reserve(listener.uid, footprint):
+                        # sized only now, wait in the queue for the space instead of failing
+                        if JOB_SCHEDULER.requeue(listener.uid, footprint):
+                            handed_over = True
+                            sendMessage(f"<b>Waiting for {get_readable_file_size(footprint)} of Free Space</b>",
+                                        listener.bot, listener.update)
+                        else:
+                            sendMessage(f"<b>Not Enough Free Space on device</b>\n#gddiskfull",listener.bot,listener.update)
                         return
                     else:
+                        handed_over = True
                         self.__onDownloadStart(meta.get('name'), fileId, listener)
                         self._download(fileId, path)
                         update_all_messages()
             except HttpError as err:
+                handed_over = True
                 error = (f"<b>HttpError {err.resp.status}</b>\n{err._get_reason()}")
                 self.__onDownloadError(str(error)) 
+            finally:
+                if not handed_over:
+                    JOB_SCHEDULER.finish(listener.uid)
         else:
             #clone them!
             msg = sendMessage(f"Cloning: <code>{link}</code>",listener.bot,listener.update)    
             gd = gdriveTools.GoogleDriveHelper()
-            result, button = gd.clone(link, listener.update)
+            try:
+                result, button = gd.clone(link, listener.update)
+            finally:
+                JOB_SCHEDULER.finish(listener.uid)
             deleteMessage(msg)
             if button == "":
                 sendMessage(result,listener.bot,listener.update)
@@ -187,31 +364,53 @@ class GDdownload:
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def _download(self, file_id: str, localpath) -> None:
         try:
-            drive_file = self.__service.files().get(fileId=file_id, fields="id, name, mimeType",
+            drive_file = self.__service.files().get(fileId=file_id, fields="id, name, mimeType, size, md5Checksum",
                                                 supportsTeamDrives=True).execute()
             self.start_time = time.time()
             self.updater = setInterval(self.update_interval, self._on_download_progress)                                    
+            if not os.path.exists(localpath):
+                os.mkdir(localpath)
+            # in resume mode the job is built in its own directory and moved over when done
+            workpath = localpath
+            if GDRIVE_RESUME:
+                self.__manifest = ResumeManifest.claim(file_id)
+                if self.__manifest is not None:
+                    workpath = self.__manifest.path
+                    DISK_LEDGER.track(self.__listener.uid, workpath)
+                else:
+                    LOGGER.info(f"{file_id} is already being downloaded, this job does not resume")
             if drive_file['mimeType'] == self.__G_DRIVE_DIR_MIME_TYPE:
                 self.isfolder = True
-                if not os.path.exists(localpath):
-                    os.mkdir(localpath)
-                path = self._create_server_dir(localpath, drive_file['name'])
-                self._download_dir(path, **drive_file)
+                path = self._create_server_dir(workpath, drive_file['name'])
+                if GDRIVE_DOWNLOAD_WORKERS > 1:
+                    self.parallel = True
+                    self.__download_dir_parallel(path, drive_file['id'])
+                else:
+                    self._download_dir(path, **drive_file)
             else:
-                if not os.path.exists(localpath):
-                    os.mkdir(localpath)
-                self._download_file(localpath, **drive_file)
+                self._download_file(workpath, **drive_file)
             self._output = os.path.join(localpath, drive_file['name'])
+            if self.__manifest is not None and not self.__errored:
+                shutil.move(os.path.join(workpath, drive_file['name'].replace("/", "~")), self._output)
+                self.__manifest.drop()
+                self.__manifest = None
         except HttpError as err:
             error = (f"<b>HttpError {err.resp.status}</b>\n{err._get_reason()}")
             self.__onDownloadError(str(error)) 
         except ProcessCanceled:
+            if self.__manifest is not None:
+                self.__manifest.drop()
+                self.__manifest = None
             self.__onDownloadError("<b>GDrive Download Stopped.</b>")
         finally:
+                # whatever is still on disk can be resumed by the next run of the job
+                if self.__manifest is not None:
+                    self.__manifest.close()
                 self.updater.cancel()
                 self.__onDownloadComplete()
 
     def __onDownloadError(self, error):
+        self.__errored = True
         with global_lock:
             try:
                 GLOBAL_GID.remove(self.gid)
@@ -238,6 +437,100 @@ class GDdownload:
                 self._download_file(path, **file_)
                 
 
+    def __download_dir_parallel(self, path, folder_id):
+        """
+        Recreates the folder tree locally, then fetches its files with
+        GDRIVE_DOWNLOAD_WORKERS threads so small files do not wait on each other
+        """
+        tree = self.__walk(folder_id)
+        jobs = []
+        pending = [(path, folder_id)]
+        while pending:
+            if self._is_canceled:
+                raise ProcessCanceled
+            current_path, current_id = pending.pop()
+            files = tree.get(current_id, [])
+            self.list += len(files)
+            for file_ in files:
+                if file_['mimeType'] == self.__G_DRIVE_DIR_MIME_TYPE:
+                    pending.append((self._create_server_dir(current_path, file_['name']), file_['id']))
+                else:
+                    jobs.append((current_path, file_))
+        LOGGER.info(f"Downloading {len(jobs)} files of {self.name} with {GDRIVE_DOWNLOAD_WORKERS} workers")
+        with ThreadPoolExecutor(max_workers=GDRIVE_DOWNLOAD_WORKERS, initializer=self.__init_worker) as executor:
+            futures = [executor.submit(self.__download_worker, *job) for job in jobs]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # stops the other workers at their next chunk
+                self._is_canceled = True
+                raise
+
+    def __walk(self, folder_id):
+        return walk_tree(folder_id, gdriveTools.drive_service, lambda: self._is_canceled)
+
+    def __init_worker(self):
+        # googleapiclient services are not thread safe, every worker gets its own
+        self.__local.service = gdriveTools.drive_service()
+
+    def __download_worker(self, path, file_):
+        if self._is_canceled:
+            raise ProcessCanceled
+        file_id = file_['id']
+        file_path = os.path.join(path, file_['name'])
+        offset = self.__resume_offset(file_, file_path)
+        if offset is None:
+            return
+        request = self.__local.service.files().get_media(fileId=file_id, supportsTeamDrives=True)
+        with self.__progress_lock:
+            self.__in_flight[file_id] = offset
+        try:
+            with io.FileIO(file_path, 'ab' if offset else 'wb') as d_f:
+                d_file_obj = RangedMediaDownload(d_f, request, WORKER_CHUNK_SIZE, offset)
+                done = False
+                while done is False:
+                    if self._is_canceled:
+                        raise ProcessCanceled
+                    status, done = d_file_obj.next_chunk(num_retries=5)
+                    with self.__progress_lock:
+                        self.uploaded_bytes += status.resumable_progress - self.__in_flight[file_id]
+                        self.__in_flight[file_id] = status.resumable_progress
+        except HttpError as err:
+            # drive answers 416 for empty files, FileIO already created them
+            if err.resp.status != 416:
+                raise
+        finally:
+            with self.__progress_lock:
+                done_bytes = self.__in_flight.pop(file_id, 0)
+        with self.__progress_lock:
+            self.completed += 1
+            self.completed_bytes += done_bytes
+        if self.__manifest is not None:
+            self.__manifest.mark_done(file_id)
+
+    def __resume_offset(self, file_, file_path):
+        """
+        :return: where the download of file_ continues, None when an earlier run of the
+        job already finished it
+        """
+        if self.__manifest is None or self.__manifest.resume(file_) is None or not os.path.isfile(file_path):
+            return 0
+        offset = os.path.getsize(file_path)
+        size = int(file_.get('size', 0))
+        if offset > size:
+            return 0
+        with self.__progress_lock:
+            if offset == size:
+                self.completed += 1
+                self.completed_bytes += size
+            self.resumed_bytes += offset
+        if offset == size:
+            self.__manifest.mark_done(file_['id'])
+            return None
+        LOGGER.info(f"Resuming {file_['name']} from {get_readable_file_size(offset)}")
+        return offset
+
     def _create_server_dir(self, current_path: str, folder_name: str) -> str:
         folder_name = folder_name.replace("/" , "~")
         path = str(os.path.join(current_path, folder_name))
@@ -249,56 +542,57 @@ class GDdownload:
 
 
     def _on_download_progress(self):
-        if self.status is not None:
-            self.size = self.status.total_size
-            chunk_size = self.status.total_size * self.status.progress() - self._file_downloaded_bytes
-            self._file_downloaded_bytes = self.status.total_size * self.status.progress()
+        if self.parallel:
+            # the folder workers count their bytes into uploaded_bytes themselves
+            self.total_time += self.update_interval
+        elif self.status is not None:
+            with self.__progress_lock:
+                self.size = self.status.total_size
+                chunk_size = self.status.total_size * self.status.progress() - self._file_downloaded_bytes
+                self._file_downloaded_bytes = self.status.total_size * self.status.progress()
             LOGGER.debug(f'Downloading {self.name}, chunk size: {get_readable_file_size(chunk_size)}')
             self.uploaded_bytes += chunk_size
             self.total_time += self.update_interval
 
 
+    def __start_file(self, done, size):
+        """Points the progress at the next file, done bytes of it are on disk from an earlier run"""
+        # the resumed part is in resumed_bytes already, counting it as downloaded would spike the speed
+        with self.__progress_lock:
+            self.status = MediaDownloadProgress(done, size)
+            self._file_downloaded_bytes = done
+
     def _list_drive_dir(self, file_id: str) -> list:
-        query = f"'{file_id}' in parents and (name contains '*')"
-        fields = 'nextPageToken, files(id, name, mimeType)'
-        page_token = None
-        page_size = 100
-        files = []
-        while True:
-            response = self.__service.files().list(supportsTeamDrives=True,
-                                                includeTeamDriveItems=True,
-                                                q=query, spaces='drive',
-                                                fields=fields, pageToken=page_token,
-                                                pageSize=page_size, corpora='allDrives',
-                                                orderBy='folder, name').execute()
-            files.extend(response.get('files', []))
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-            if self._is_canceled:
-                self.__onDownloadError("Download Has Been Cancelled Wew!")
-        return files
+        return list_folder(self.__service, file_id)
 
 
     def _download_file(self, path: str, name: str, **kwargs) -> None:
+        size = int(kwargs.get('size', 0))
+        if GDRIVE_FILE_CONNECTIONS > 1 and size >= 2 * SEGMENT_SIZE:
+            try:
+                self.__download_segmented(path, name, kwargs)
+            except requests.RequestException as err:
+                self.__onDownloadError(f"<b>Segmented download failed</b>\n{err}")
+            return
+        offset = self.__resume_offset(dict(kwargs, name=name), os.path.join(path, name))
+        if offset is None:
+            return
         try:
-            total, used, free = shutil.disk_usage('.')
-            #free = get_readable_file_size(free)
             request = self.__service.files().get_media(fileId=kwargs['id'], supportsTeamDrives=True)
-            with io.FileIO(os.path.join(path, name), 'wb') as d_f:
-                d_file_obj = MediaIoBaseDownload(d_f, request, chunksize=50*1024*1024)
+            with io.FileIO(os.path.join(path, name), 'ab' if offset else 'wb') as d_f:
+                d_file_obj = RangedMediaDownload(d_f, request, 50*1024*1024, offset)
+                self.__start_file(offset, size)
                 self.c_time = time.time()
                 self.currentname = name
                 done = False
                 while done is False:
                     self.status, done = d_file_obj.next_chunk(num_retries=5)
-                    if self.status is not None:
-                        if self.status.total_size > free:
-                            raise ProcessCanceled
                     if self._is_canceled:
                         raise ProcessCanceled   
             self.completed += 1
             self.completed_bytes += self.status.total_size
+            if self.__manifest is not None:
+                self.__manifest.mark_done(kwargs['id'])
         except HttpError as err:
             if "416" in str(err):
                 f = open(f"{os.path.join(path, name)}", "w").close
@@ -306,10 +600,98 @@ class GDdownload:
                 error = (f"<b>HttpError {err.resp.status}</b>\n{err._get_reason()}")
                 self.__onDownloadError(str(error))           
 
+    def __download_segmented(self, path, name, file_):
+        """
+        Fetches the file over GDRIVE_FILE_CONNECTIONS parallel Range requests, each
+        segment is written at its own offset into a preallocated file. Progress goes
+        through self.status like the sequential download, so _on_download_progress
+        does not care which one ran.
+        """
+        file_id = file_['id']
+        size = int(file_['size'])
+        file_path = os.path.join(path, name)
+        finished = []
+        if self.__manifest is not None and os.path.isfile(file_path):
+            entry = self.__manifest.resume(file_, segmented=True)
+            if entry is not None:
+                if entry['done']:
+                    self.completed += 1
+                    self.completed_bytes += size
+                    self.resumed_bytes += size
+                    return
+                finished = entry['segments']
+        elif self.__manifest is not None:
+            self.__manifest.resume(file_, segmented=True)
+        self.c_time = time.time()
+        self.currentname = name
+        segments = [(start, min(start + SEGMENT_SIZE, size)) for start in range(0, size, SEGMENT_SIZE)
+                    if start not in finished]
+        self.__start_file(size - sum(end - start for start, end in segments), size)
+        self.resumed_bytes += self.status.resumable_progress
+        LOGGER.info(f"Downloading {name} in {len(segments)} segments over {GDRIVE_FILE_CONNECTIONS} connections")
+        flags = os.O_WRONLY | os.O_CREAT | (0 if finished else os.O_TRUNC)
+        fd = os.open(file_path, flags, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                os.ftruncate(fd, size)
+            with ThreadPoolExecutor(max_workers=min(GDRIVE_FILE_CONNECTIONS, len(segments))) as executor:
+                futures = [executor.submit(self.__fetch_segment, fd, file_id, start, end)
+                           for start, end in segments]
+                try:
+                    for future in as_completed(futures):
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            os.close(fd)
+        self.completed += 1
+        self.completed_bytes += size
+        if self.__manifest is not None:
+            self.__manifest.mark_done(file_id)
+
+    def __segment_session(self):
+        # one authorized session per thread, requests sessions are not thread safe
+        session = getattr(self.__local, 'session', None)
+        if session is None:
+            session = self.__local.session = AuthorizedSession(gdriveTools.drive_credentials())
+        return session
+
+    def __add_segment_progress(self, length):
+        with self.__progress_lock:
+            self.status = MediaDownloadProgress(self.status.resumable_progress + length, self.status.total_size)
+
+    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
+           retry=retry_if_exception_type(requests.RequestException), before=before_log(LOGGER, logging.DEBUG),
+           reraise=True)
+    def __fetch_segment(self, fd, file_id, start, end):
+        written = 0
+        try:
+            with self.__segment_session().get(MEDIA_URL.format(file_id), stream=True, timeout=60,
+                                              headers={'Range': f'bytes={start}-{end - 1}'}) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise requests.HTTPError(f"Drive ignored the range request ({r.status_code})", response=r)
+                for data in r.iter_content(chunk_size=1024 * 1024):
+                    if self._is_canceled:
+                        raise ProcessCanceled
+                    os.pwrite(fd, data, start + written)
+                    written += len(data)
+                    self.__add_segment_progress(len(data))
+            if written != end - start:
+                raise requests.RequestException(f"Got {written} of {end - start} bytes at {start}")
+            if self.__manifest is not None:
+                self.__manifest.mark_segment(file_id, start)
+        except requests.RequestException:
+            # the retry starts the segment over
+            self.__add_segment_progress(-written)
+            raise
+
     def _download_file_quota(self, path: str, name: str, file_id) -> None:
         try:
-            total, used, free = shutil.disk_usage('.')
-            #free = get_readable_file_size(free)
             request = self.__service.files().get_media(fileId=file_id, supportsTeamDrives=True)
             with io.FileIO(os.path.join(path, name), 'wb') as d_f:
                 d_file_obj = MediaIoBaseDownload(d_f, request, chunksize=50*1024)
@@ -342,31 +724,14 @@ class GDdownload:
         return parse_qs(parsed.query)['id'][0]   
 
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def getFilesByFolderId(self,folder_id):
-        page_token = None
-        q = f"'{folder_id}' in parents"
-        files = []
-        while True:
-            response = self.__service.files().list(supportsTeamDrives=True,
-                                                   includeTeamDriveItems=True,
-                                                   q=q,
-                                                   spaces='drive',
-                                                   pageSize=200,
-                                                   fields='nextPageToken, files(id, name, mimeType,size)',
-                                                   pageToken=page_token).execute()
-            for file in response.get('files', []):
-                files.append(file)
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-        return files     
+        return list_folder(self.__service, folder_id)
             
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def gdrivesize(self, meta) -> str:
-        self.computed_size = 0
+        # a requeued job walks its folder again
+        self.computed_size = self.sfolder = self.sfile = 0
         try:
             if meta.get("mimeType") == self.__G_DRIVE_DIR_MIME_TYPE:
                 size = self.foldersize(meta.get('id'))
@@ -383,19 +748,16 @@ class GDdownload:
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def foldersize(self, folder_id):
-        files = self.getFilesByFolderId(folder_id)
-        if len(files) == 0:
-            return 0
-        for file in files:
-            if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
-                size = self.foldersize(file.get('id'))
-                self.sfolder += 1
-            else:
-                try:
-                    self.computed_size += int(file.get('size'))
-                    self.sfile += 1
-                except TypeError:
-                    pass       
+        for files in self.__walk(folder_id).values():
+            for file in files:
+                if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                    self.sfolder += 1
+                else:
+                    try:
+                        self.computed_size += int(file.get('size'))
+                        self.sfile += 1
+                    except TypeError:
+                        pass       
         return self.computed_size    
 
     def getsizehandle(self, client, message, link):
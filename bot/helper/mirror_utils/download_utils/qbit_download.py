@@ -27,11 +27,134 @@ LOGGER = logging.getLogger(__name__)
 # logging.getLogger('requests').setLevel(logging.ERROR)
 # logging.getLogger('urllib3').setLevel(logging.ERROR)
 
+QBIT_PREFERENCES = {"disk_cache":20,"incomplete_files_ext":True,"max_connec":3000,"max_connec_per_torrent":300,"async_io_threads":6,"max_active_torrents":MAX_SIMULTANEOUS_DOWNLOADS,"max_active_downloads":MAX_SIMULTANEOUS_DOWNLOADS,"max_active_uploads":MAX_SIMULTANEOUS_DOWNLOADS}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _connect(host, port, uname, passw, retry):
+    LOGGER.info(f"Trying to login in qBittorrent using creds {host} {port} {uname} {passw}")
+
+    client = qba.Client(host=host,port=port,username=uname,password=passw)
+
+    #try to connect to the server :)
+    try:
+        client.auth_log_in()
+        LOGGER.info("Client connected successfully to the torrent server. :)")
+        client.application.set_preferences(QBIT_PREFERENCES)
+        LOGGER.debug("Setting the cache size to 20 incomplete_files_ext:True,max_connec:3000,max_connec_per_torrent:300,async_io_threads:6")
+        return client
+    except qba.LoginFailed as e:
+        LOGGER.error("An errot occured invalid creds detected\n{}\n{}".format(e,traceback.format_exc()))
+        return None
+    except qba.APIConnectionError:
+        if retry == 0:
+            LOGGER.error("Tried to get the client 3 times no luck")
+            return None
+
+        LOGGER.info("Oddly enough the qbittorrent server is not running.... Attempting to start at port {}".format(port))
+        subprocess.run(["qbittorrent-nox", "-d", f"--webui-port={port}"])
+        return _connect(host, port, uname, passw, retry - 1)
+
+
+def get_client(host="localhost", port="8090", uname="admin", passw="adminadmin", retry=2) -> qba.TorrentsAPIMixIn:
+    """
+    Returns the process wide qBittorrent client. It logs in and applies the preferences
+    only the first time, after that the session cookie is reused by every torrent and
+    qbittorrentapi logs in again by itself when the webui answers 403.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _connect(host, port, uname, passw, retry)
+        return _client
+
+
+def relogin():
+    # explicit fallback for a session the webui dropped
+    client = get_client()
+    if client is not None:
+        client.auth_log_in()
+
+
+class QbitMonitor:
+    """
+    One poller for every torrent the bot is running. Each tick pulls the sync/maindata
+    delta since the last rid, merges it into the cached torrent states and hands every
+    tracked torrent its merged state, so the webui sees one request per tick in total.
+    """
+
+    def __init__(self, interval=5):
+        self.__interval = interval
+        self.__lock = threading.Lock()
+        # hash: QbitWrap
+        self.__handlers = {}
+        self.__updater = None
+        # only touched from the poll thread
+        self.__rid = 0
+        self.__torrents = {}
+
+    def register(self, torrent_hash, handler):
+        with self.__lock:
+            self.__handlers[torrent_hash] = handler
+            if self.__updater is None:
+                self.__updater = setInterval(self.__interval, self.__poll)
+
+    def unregister(self, torrent_hash):
+        with self.__lock:
+            self.__handlers.pop(torrent_hash, None)
+            if not self.__handlers and self.__updater is not None:
+                self.__updater.cancel()
+                self.__updater = None
+
+    def __sync(self, client):
+        try:
+            data = client.sync_maindata(rid=self.__rid)
+        except qba.Forbidden403Error:
+            relogin()
+            # rids belong to a webui session, the new one starts from a full update
+            self.__rid = 0
+            data = client.sync_maindata(rid=self.__rid)
+        self.__rid = data.get('rid', 0)
+        if data.get('full_update'):
+            self.__torrents = {}
+        for torrent_hash, delta in (data.get('torrents') or {}).items():
+            self.__torrents.setdefault(torrent_hash, {'hash': torrent_hash}).update(delta)
+        for torrent_hash in data.get('torrents_removed') or []:
+            self.__torrents.pop(torrent_hash, None)
+
+    def __poll(self):
+        with self.__lock:
+            handlers = dict(self.__handlers)
+        client = get_client()
+        if not handlers or client is None:
+            return
+        try:
+            self.__sync(client)
+        except Exception as e:
+            LOGGER.error(f"qBittorrent sync failed: {e}")
+            return
+        for torrent_hash, handler in handlers.items():
+            state = self.__torrents.get(torrent_hash)
+            if state is None and not handler.seen:
+                # freshly added torrents can take a tick to show up in maindata
+                continue
+            handler.seen = True
+            try:
+                tor_info = None if state is None else qba.TorrentDictionary(dict(state), client=client)
+                handler.update_progress(tor_info)
+            except Exception as e:
+                LOGGER.error("{}\n{}".format(e, traceback.format_exc()))
+
+
+QBIT_MONITOR = QbitMonitor()
+
+
 class QbitWrap:
     def __init__(self):
         super().__init__()
         self.__listener = None
-        self.updater = None
         self.update_interval = 5
         self._torrent = None
         self.gid = None
@@ -45,49 +168,13 @@ class QbitWrap:
         self.checkindrive = True
         self.sizeavail = True
         self.gl_enabled = True
-
-    def get_client(self, host=None,port=None,uname=None,passw=None,retry=2) -> qba.TorrentsAPIMixIn:
-        """Creats and returns a client to communicate with qBittorrent server. Max Retries 2
-        """
-        #getting the conn 
-        host = host if host is not None else "localhost"
-        port = port if port is not None else "8090"
-        uname = uname if uname is not None else "admin"
-        passw = passw if passw is not None else "adminadmin"
-        LOGGER.info(f"Trying to login in qBittorrent using creds {host} {port} {uname} {passw}")
-
-        client = qba.Client(host=host,port=port,username=uname,password=passw)
-        
-        #try to connect to the server :)
-        try:
-            client.auth_log_in()
-            LOGGER.info("Client connected successfully to the torrent server. :)")
-            client.application.set_preferences({"disk_cache":20,"incomplete_files_ext":True,"max_connec":3000,"max_connec_per_torrent":300,"async_io_threads":6,"max_active_torrents":MAX_SIMULTANEOUS_DOWNLOADS,"max_active_downloads":MAX_SIMULTANEOUS_DOWNLOADS,"max_active_uploads":MAX_SIMULTANEOUS_DOWNLOADS})
-            LOGGER.debug("Setting the cache size to 20 incomplete_files_ext:True,max_connec:3000,max_connec_per_torrent:300,async_io_threads:6")
-            return client
-        except qba.LoginFailed as e:
-            LOGGER.error("An errot occured invalid creds detected\n{}\n{}".format(e,traceback.format_exc()))
-            return None
-        except qba.APIConnectionError:
-            if retry == 0:
-                LOGGER.error("Tried to get the client 3 times no luck")
-                return None
-            
-            LOGGER.info("Oddly enough the qbittorrent server is not running.... Attempting to start at port {}".format(port))
-            cmd = f"qbittorrent-nox -d --webui-port={port}"
-            cmd = cmd.split(" ")
-
-            result = subprocess.run(["qbittorrent-nox", "-d", f"--webui-port={port}"])
-            # subpr = subprocess.Popen(*cmd, stdout=subprocess.PIPE)
-            # #subpr = aio.create_subprocess_exec(*cmd,stderr=aio.subprocess.PIPE,stdout=aio.subprocess.PIPE)
-            # subpr.communicate()
-            return self.get_client(host,port,uname,passw,retry=retry-1)
-
+        # set once the monitor saw this torrent in maindata
+        self.seen = False
 
     def add_torrent_magnet(self, magnet,message):
         print("""Adds a torrent by its magnet link.
         """)
-        client = self.get_client()
+        client = get_client()
         try:
             ctor = len(client.torrents_info())
             
@@ -150,7 +237,7 @@ class QbitWrap:
             LOGGER.error("The path supplied to the torrent file was invalid.\n path:-{}".format(path))
             return False
 
-        client = self.get_client()
+        client = get_client()
         try:
             ctor = len(client.torrents_info())
 
@@ -208,37 +295,35 @@ class QbitWrap:
         LOGGER.info(f'Cancelling download on user request')
         self._is_canceled = True   
 
-    def update_progress(self, client=None,message=None,torrent=None,task=None,except_retry=0,sleepsec=None):
-        #task = QBTask(torrent, message, client)
+    def __stop_updates(self):
+        QBIT_MONITOR.unregister(self._torrent.hash)
+
+    def update_progress(self, tor_info):
+        """
+        Called by QBIT_MONITOR every tick with the merged maindata state of this torrent,
+        tor_info is None once qBittorrent dropped the torrent
+        """
         try:
             client = self._client
             message = self.message
             task = self.task
-            torrent = self._torrent
-            sleepsec = int(DOWNLOAD_STATUS_UPDATE_INTERVAL)
-            #switch to iteration from recursion as python dosent have tailing optimization :O
-            #RecursionError: maximum recursion depth exceeded
             is_meta = False
             is_stalled = False
-            tor_info = client.torrents_info(torrent_hashes=torrent.hash)
             #update cancellation
-
-            #LOGGER.info(f"hash is {tor_info.hash}")
             if self._is_canceled:
-                self.updater.cancel()
+                self.__stop_updates()
                 raise ProcessCanceled
 
-            if len(tor_info) > 0:
-                tor_info = tor_info[0]
-            else:
+            if tor_info is None:
                 task.cancel = True
-                task.set_inactive()
-                message.edit("Torrent canceled ```{}``` ".format(torrent.name),buttons=None)
+                self.__stop_updates()
+                self.__onDownloadError(f"<b>Torrent {self._torrent.name} was removed from qBittorrent.</b>")
+                return
             
             if int(tor_info.size) > (int(MAX_TORRENT_SIZE) * 1024 * 1024 * 1024):
                 self.__onDownloadError(f"<b>Torrent Max Size Allowed is {MAX_TORRENT_SIZE}GB. Thus Download Stopped!.</b>")
                 client.torrents_delete(torrent_hashes=tor_info.hash,delete_files=True)
-                self.updater.cancel()
+                self.__stop_updates()
             try:
                 task.refresh_info(tor_info)
 
@@ -251,7 +336,7 @@ class QbitWrap:
                 if (is_meta and (time.time() - self.meta_time) > 360):
                     self.__onDownloadError(f"<b>Getting MetaData of {tor_info.name} Failed</b>. <i>Thus Download Stopped!.</i>")
                     client.torrents_delete(torrent_hashes=tor_info.hash,delete_files=True)
-                    self.updater.cancel()
+                    self.__stop_updates()
                 
                 if  tor_info.state == "stalledDL":
                     is_stalled = True
@@ -262,7 +347,7 @@ class QbitWrap:
                 if (is_stalled and (time.time() - self.stalled_time) > 360):
                     self.__onDownloadError(f"<b>{tor_info.name} was Stalled and Thus Failed</b>. <i>Thus Download Stopped!.</i>\n#deadtorrent")
                     client.torrents_delete(torrent_hashes=tor_info.hash,delete_files=True)
-                    self.updater.cancel()
+                    self.__stop_updates()
 
                 if tor_info.state != "metaDL":
                     if self.checkindrive:
@@ -285,7 +370,7 @@ class QbitWrap:
 
                     self.__onDownloadError(f"<b>Torrent {tor_info.name} Errored Out!. Thus Download Stopped!.</b>")
                     client.torrents_delete(torrent_hashes=tor_info.hash,delete_files=True)
-                    self.updater.cancel()
+                    self.__stop_updates()
                 
                 #aio timeout have to switch to global something
                 # time.sleep(sleepsec)
@@ -305,13 +390,14 @@ class QbitWrap:
                         except:
                             #self.__onDownloadError(f"<b>Torrent Download of {tor_info.name} Failed!. Thus Download Stopped!.</b>")
                             client.torrents_delete(torrent_hashes=tor_info.hash,delete_files=True)
-                            self.updater.cancel()
+                            self.__stop_updates()
 
                         task.set_path(savepath)
-                        self.isactive = False
+                        self.is_active = False
                         print("torrent Downloaded!!!!!")
-                        self.__onDownloadComplete()
-                        self.updater.cancel()
+                        self.__stop_updates()
+                        # the upload runs off the monitor thread so other torrents keep updating
+                        threading.Thread(target=self.__onDownloadComplete).start()
                     else:
                         #return update_progress(client,message,torrent)
                         pass
@@ -434,7 +520,7 @@ class QbitWrap:
         return pr
 
     def deregister_torrent(self, hashid):
-        client = self.get_client()
+        client = get_client()
         client.torrents_delete(torrent_hashes=hashid,delete_files=True)
 
     def ghostleech(self):
@@ -458,7 +544,7 @@ class QbitWrap:
 
     def register_torrent(self, bot,message,link,listener,magnet=False,file=False):
         # try:
-        client = self.get_client()
+        client = get_client()
         self.__listener = listener
         if magnet:
             LOGGER.info(f"magnet :- {link}")
@@ -478,7 +564,7 @@ class QbitWrap:
                 self.message = message
                 if self.gl_enabled:
                     self.ghostleech()
-                self.updater = setInterval(self.update_interval, self.update_progress) 
+                QBIT_MONITOR.register(torrent.hash, self)
                 update_all_messages()
         if file:
             torrent = self.add_torrent_file(link,message)
@@ -498,7 +584,7 @@ class QbitWrap:
                 self.message = message
                 if self.gl_enabled:
                     self.ghostleech()
-                self.updater = setInterval(self.update_interval, self.update_progress) 
+                QBIT_MONITOR.register(torrent.hash, self)
                 update_all_messages()
         # except ProcessCanceled:
         #         self.__onDownloadError("<b>QbitTorrent Download Stopped.</b>")
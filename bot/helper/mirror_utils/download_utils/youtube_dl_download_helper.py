@@ -88,6 +88,8 @@ class YoutubeDLHelper(DownloadHelper):
     def __onDownloadStart(self):
         with download_dict_lock:
             download_dict[self.__listener.uid] = YoutubeDLDownloadStatus(self, self.__listener)
+        # extractMetaData of a big playlist takes a while, the job is running from here
+        self.__listener.onDownloadStarted()
 
     def __onDownloadComplete(self):
         self.__listener.onDownloadComplete()
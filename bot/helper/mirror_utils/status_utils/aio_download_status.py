@@ -75,6 +75,8 @@ class AioDownloadStatus(Status):
         return self    
 
     def eta(self):
+        if not self.obj.size:
+            return '-'
         try:
             seconds = (self.obj.size - self.obj.downloaded_chunk) / self.speed_raw()
             return f'{get_readable_time(seconds)}'
@@ -1,10 +1,77 @@
+import time
+import threading
+from aria2p import Download
 from bot import aria2, DOWNLOAD_DIR, LOGGER
-from bot.helper.ext_utils.bot_utils import MirrorStatus, get_readable_file_size, get_readable_time, get_readable_time_status
+from bot.helper.ext_utils.bot_utils import MirrorStatus, get_readable_file_size, get_readable_time, get_readable_time_status, \
+    setInterval
 from .status import Status
 
+# only what the status accessors and the listener callbacks read
+STATUS_KEYS = ['gid', 'status', 'totalLength', 'completedLength', 'downloadSpeed', 'uploadSpeed',
+               'connections', 'numSeeders', 'followedBy', 'following', 'belongsTo', 'dir', 'files',
+               'bittorrent', 'errorCode', 'errorMessage']
+STATE_TTL = 1
+# gids nobody asked about for this long are not polled anymore
+IDLE_GID_TIMEOUT = 30
+
+
+class AriaStatePoller:
+    """
+    Snapshot of the aria2 downloads the bot is tracking. A timer refreshes every gid
+    with a single system.multicall of tellStatus once per STATE_TTL, the status
+    accessors only read the snapshot and never wait on the rpc.
+    """
+
+    def __init__(self, api, ttl=STATE_TTL):
+        self.__api = api
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        # gid: last time it was asked for
+        self.__gids = {}
+        self.__cache = {}
+        self.__timer = None
+
+    def __refresh(self):
+        now = time.time()
+        with self.__lock:
+            self.__gids = {gid: seen for gid, seen in self.__gids.items() if now - seen < IDLE_GID_TIMEOUT}
+            gids = list(self.__gids)
+        if not gids:
+            return
+        client = self.__api.client
+        try:
+            results = client.multicall2([(client.TELL_STATUS, [gid, STATUS_KEYS]) for gid in gids])
+        except Exception as e:
+            LOGGER.error(f"aria2 multicall failed: {e}")
+            return
+        cache = {}
+        for gid, result in zip(gids, results):
+            # a one item list on success, a fault struct for gids aria2 forgot about
+            if isinstance(result, list) and result:
+                cache[gid] = Download(self.__api, result[0])
+        with self.__lock:
+            self.__cache = cache
+
+    def get(self, gid):
+        with self.__lock:
+            self.__gids[gid] = time.time()
+            if self.__timer is None:
+                self.__timer = setInterval(self.__ttl, self.__refresh)
+            download = self.__cache.get(gid)
+        if download is None:
+            # a gid is fetched on its own only until the next tick has it, aria2p raises
+            # the usual error for unknown gids
+            download = self.__api.get_download(gid)
+            with self.__lock:
+                self.__cache.setdefault(gid, download)
+        return download
+
+
+ARIA_POLLER = AriaStatePoller(aria2)
+
 
 def get_download(gid):
-    return aria2.get_download(gid)
+    return ARIA_POLLER.get(gid)
 
 
 class AriaDownloadStatus(Status):
@@ -99,11 +166,9 @@ class AriaDownloadStatus(Status):
         return self.__uid
 
     def gid(self):
-        self.__update()
         return self.__genid
 
     def genid(self):
-        self.__update()
         return self.__gid
 
 
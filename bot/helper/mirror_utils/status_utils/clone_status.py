@@ -0,0 +1,87 @@
+from .status import Status
+from bot.helper.ext_utils.bot_utils import MirrorStatus, get_readable_file_size, get_readable_time
+from bot import DOWNLOAD_DIR, LOGGER
+
+
+class CloneStatus(Status):
+    def __init__(self, obj, name, message, gid):
+        self.obj = obj
+        self.__name = name
+        self.__gid = gid
+        self.uid = message.id
+        self.message = message
+
+    def gid(self):
+        return self.__gid
+
+    def path(self):
+        return f"{DOWNLOAD_DIR}{self.uid}"
+
+    def name(self):
+        return self.__name
+
+    def processed_bytes(self):
+        return self.obj.cloned_bytes
+
+    def size_raw(self):
+        return self.obj.transferred_size
+
+    def size(self):
+        return get_readable_file_size(self.size_raw())
+
+    def status(self):
+        return MirrorStatus.STATUS_CLONING
+
+    def progress_raw(self):
+        try:
+            return self.obj.cloned_bytes / self.obj.transferred_size * 100
+        except ZeroDivisionError:
+            return 0
+
+    def progress(self):
+        return f'{round(self.progress_raw())}%'
+
+    def speed_raw(self):
+        """
+        :return: Clone speed in Bytes/Seconds
+        """
+        return self.obj.clone_speed()
+
+    def speed(self):
+        return f'{get_readable_file_size(self.speed_raw())}ps'
+
+    def eta(self):
+        try:
+            seconds = (self.obj.transferred_size - self.obj.cloned_bytes) / self.speed_raw()
+            return f'{get_readable_time(seconds)}'
+        except ZeroDivisionError:
+            return '-'
+
+    def completed(self):
+        return f"{self.obj.cloned_files} / {self.obj.total_files}"
+
+    def download(self):
+        return self
+
+    def cancel_download(self):
+        LOGGER.info(f'Cancelling clone on user request: {self.name()}')
+        self.obj.cancel_clone()
+
+    #another sasta hack for source to work we return the source message
+    def sourceobj(self):
+        return self.message
+
+    def isgdfolder(self):
+        return None
+
+    def genid(self):
+        return None
+
+    def which_client(self):
+        return "GDRIVECLONE"
+
+    def seeds(self):
+        return None
+
+    def leechers(self):
+        return None
@@ -24,12 +24,16 @@ class GDDownloadStatus(Status):
         return self.obj.name
 
     def processed_bytes(self):
+        if self.obj.parallel:
+            return self.obj.uploaded_bytes + self.obj.resumed_bytes
         return self.obj._file_downloaded_bytes
 
     def size_raw(self):
         return self.obj.gdfoldersize
 
     def size_raw_progress(self):
+        if self.obj.parallel:
+            return self.obj.gdfoldersize
         return self.obj.size
 
     def getListener(self):
@@ -50,13 +54,20 @@ class GDDownloadStatus(Status):
 
     def progress_raw(self):
         try:
-            return self.obj._file_downloaded_bytes / self.obj.size * 100
+            return self.processed_bytes() / self.size_raw_progress() * 100
         except ZeroDivisionError:
             return 0
 
     def downloaded_bytes(self):
+        if self.obj.parallel:
+            return get_readable_file_size(self.processed_bytes())
         return get_readable_file_size(self.obj.completed_bytes)                    
 
+    def in_flight(self):
+        if self.obj.parallel:
+            return self.obj.in_flight()
+        return None
+
     def downloadingname(self):
         return self.obj.currentname          
 
@@ -80,7 +91,7 @@ class GDDownloadStatus(Status):
 
     def eta(self):
         try:
-            seconds = (self.obj.size - self.obj._file_downloaded_bytes) / self.speed_raw()
+            seconds = (self.size_raw_progress() - self.processed_bytes()) / self.speed_raw()
             return f'{get_readable_time(seconds)}'
         except ZeroDivisionError:
             return '-'
@@ -0,0 +1,96 @@
+import threading
+
+from bot import DOWNLOAD_DIR, LOGGER
+from bot.helper.ext_utils.bot_utils import MirrorStatus
+from bot.helper.ext_utils.job_scheduler import JOB_SCHEDULER
+from .status import Status
+
+
+class QueueStatus(Status):
+    """A job waiting for a download slot in JobScheduler or for a worker of a pipeline stage"""
+
+    def __init__(self, name, gid, listener, engine, cancel=None):
+        self.__name = name
+        self.__gid = gid
+        self.__engine = engine
+        # drops the job from wherever it waits, JOB_SCHEDULER or a pipeline stage
+        self.__cancel = cancel or JOB_SCHEDULER.cancel
+        self.listener = listener
+        self.uid = listener.uid
+        self.message = listener.message
+        self.source = listener.source
+
+    def gid(self):
+        return self.__gid
+
+    def sourcemsg(self):
+        return self.source
+
+    def sourceobj(self):
+        return self.source
+
+    def path(self):
+        return f"{DOWNLOAD_DIR}{self.uid}"
+
+    def processed_bytes(self):
+        return 0
+
+    def size_raw(self):
+        return 0
+
+    def size(self):
+        return '-'
+
+    def status(self):
+        return MirrorStatus.STATUS_WAITING
+
+    def name(self):
+        return self.__name
+
+    def progress_raw(self):
+        return 0
+
+    def progress(self):
+        return '0%'
+
+    def speed_raw(self):
+        return 0
+
+    def speed(self):
+        return '-'
+
+    def eta(self):
+        return '-'
+
+    def download(self):
+        return self
+
+    def cancel_download(self):
+        LOGGER.info(f'Cancelling queued {self.__engine} job on user request: {self.__gid}')
+        if self.__cancel(self.uid):
+            # /cancelall calls this with download_dict_lock held, which the listener takes
+            threading.Thread(target=self.listener.onDownloadError, args=('Cancelled while queued',)).start()
+
+    def completed(self):
+        return None
+
+    def isgdfolder(self):
+        return None
+
+    def getListener(self):
+        return self.listener
+
+    def genid(self):
+        return None
+
+    def which_client(self):
+        return "Queue"
+
+    def upload_path(self):
+        return f'{DOWNLOAD_DIR}{self.uid}/{self.name()}'
+
+    def seeds(self):
+        return None
+
+    def leechers(self):
+        return None
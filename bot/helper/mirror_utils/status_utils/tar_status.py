@@ -1,26 +1,40 @@
 from .status import Status
-from bot.helper.ext_utils.bot_utils import get_readable_file_size, MirrorStatus
+from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_time, MirrorStatus
 
 
 class TarStatus(Status):
-    def __init__(self, name, path, size, gid, source):
+    def __init__(self, name, path, size, gid, source, obj=None):
         self.__name = name
         self.__path = path
         self.__size = size
         self.__gid = gid
         self.message = source
+        # GoogleDriveHelper when the archive is streamed to drive, None otherwise
+        self.obj = obj
 
-    # The progress of Tar function cannot be tracked. So we just return dummy values.
-    # If this is possible in future,we should implement it
+    # The progress of a plain Tar to disk cannot be tracked. So we just return dummy values.
+    # Streamed archives report the source bytes packed so far
+
+    def progress_raw(self):
+        try:
+            return self.processed_bytes() / self.__size * 100
+        except ZeroDivisionError:
+            return 0
 
     def progress(self):
-        return '0'
+        if self.obj is None:
+            return '0'
+        return f'{round(self.progress_raw())}%'
 
     def speed(self):
-        return '0'
+        if self.obj is None:
+            return '0'
+        return f'{get_readable_file_size(self.speed_raw())}ps'
 
     def speed_raw(self):
-        return '0'      
+        if self.obj is None:
+            return '0'
+        return self.obj.speed()
 
     def name(self):
         return self.__name
@@ -35,13 +49,24 @@ class TarStatus(Status):
         return get_readable_file_size(self.__size)
 
     def eta(self):
-        return '0s'
+        if self.obj is None:
+            return '0s'
+        try:
+            seconds = (self.__size - self.processed_bytes()) / self.speed_raw()
+            return f'{get_readable_time(seconds)}'
+        except ZeroDivisionError:
+            return '-'
 
     def status(self):
         return MirrorStatus.STATUS_ARCHIVING
 
     def processed_bytes(self):
-        return 0
+        if self.obj is None:
+            return 0
+        return self.obj.archived_bytes
+
+    def size_raw(self):
+        return self.__size
 
     def completed(self):
         return None    
@@ -0,0 +1,97 @@
+import os
+import pickle
+import logging
+import threading
+
+import requests
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build_from_document
+
+LOGGER = logging.getLogger(__name__)
+
+TOKEN_FILE = "token.pickle"
+OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/drive/v3/rest"
+
+
+class DriveAuth:
+    """
+    Loads and refreshes the credential of every account once and keeps it for the
+    whole run, the token is refreshed again only when it is about to expire. Drive
+    clients are built from the discovery document googleapiclient ships with and are
+    cached per thread and per account, googleapiclient services are not thread safe.
+    Account None is token.pickle, any other is the accounts/<index>.json service account.
+    """
+
+    def __init__(self, token_file=TOKEN_FILE, scopes=OAUTH_SCOPE):
+        self.__token_file = token_file
+        self.__scopes = scopes
+        self.__lock = threading.Lock()
+        self.__credentials = {}
+        self.__document = None
+        self.__local = threading.local()
+
+    def credentials(self, sa_index=None):
+        """:return: the valid credentials of the account, refreshed if they expired"""
+        with self.__lock:
+            credentials = self.__credentials.get(sa_index)
+            if credentials is None:
+                credentials = self.__credentials[sa_index] = self.__load(sa_index)
+            if not credentials.valid:
+                credentials.refresh(Request())
+                if sa_index is None:
+                    self.__save(credentials)
+            return credentials
+
+    def service(self, sa_index=None):
+        """:return: the drive client of the calling thread for the account"""
+        credentials = self.credentials(sa_index)
+        services = getattr(self.__local, 'services', None)
+        if services is None:
+            services = self.__local.services = {}
+        service = services.get(sa_index)
+        if service is None:
+            service = services[sa_index] = build_from_document(self.__discovery(), credentials=credentials)
+        return service
+
+    def __discovery(self):
+        with self.__lock:
+            if self.__document is None:
+                try:
+                    from googleapiclient.discovery_cache import get_static_doc
+                    self.__document = get_static_doc('drive', 'v3')
+                except ImportError:
+                    pass
+                if self.__document is None:
+                    # googleapiclient older than 2.0 ships no documents, fetch it once
+                    LOGGER.info("No bundled drive discovery document, fetching it")
+                    response = requests.get(DISCOVERY_URL, timeout=30)
+                    response.raise_for_status()
+                    self.__document = response.text
+            return self.__document
+
+    def __load(self, sa_index):
+        if sa_index is not None:
+            LOGGER.info(f"Authorizing with {sa_index}.json service account")
+            return service_account.Credentials.from_service_account_file(
+                f'accounts/{sa_index}.json', scopes=self.__scopes)
+        credentials = None
+        if os.path.exists(self.__token_file):
+            with open(self.__token_file, 'rb') as f:
+                credentials = pickle.load(f)
+        if credentials is None or not (credentials.valid or credentials.refresh_token):
+            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', self.__scopes)
+            LOGGER.info(flow)
+            credentials = flow.run_console(port=0)
+            self.__save(credentials)
+        return credentials
+
+    def __save(self, credentials):
+        # Save the credentials for the next run
+        with open(self.__token_file, 'wb') as token:
+            pickle.dump(credentials, token)
+
+
+DRIVE_AUTH = DriveAuth()
@@ -0,0 +1,178 @@
+import re
+import sqlite3
+import logging
+import threading
+
+from googleapiclient.errors import HttpError
+
+from bot.helper.ext_utils.bot_utils import setInterval
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_DB = "drive_index.db"
+# seconds between two pulls of the drive changes feed
+INDEX_SYNC_INTERVAL = 60
+LIST_FIELDS = 'nextPageToken, files(id, name, mimeType, size, modifiedTime)'
+CHANGE_FIELDS = 'nextPageToken, newStartPageToken, ' \
+                'changes(fileId, removed, file(id, name, mimeType, size, modifiedTime, parents, trashed))'
+
+
+class DriveIndex:
+    """
+    SQLite full text index of the files directly inside the folders /list and the
+    torrent duplicate check search. It is filled by listing those folders once and
+    then kept current from the drive changes feed, the page token is stored next to
+    the files so a restart only pulls the changes it missed.
+    """
+
+    def __init__(self, roots, db_path=INDEX_DB):
+        self.__roots = set(roots)
+        self.__lock = threading.Lock()
+        # the first sync runs on its own thread and may still be going when the timer fires
+        self.__sync_lock = threading.Lock()
+        self.__service = None
+        self.__updater = None
+        self.__db = sqlite3.connect(db_path, check_same_thread=False)
+        try:
+            self.__db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS files USING fts5("
+                              "id UNINDEXED, name, mimeType UNINDEXED, size UNINDEXED, "
+                              "modifiedTime UNINDEXED, parent UNINDEXED)")
+            self.__fts = True
+        except sqlite3.OperationalError:
+            LOGGER.warning("SQLite has no fts5, the drive index falls back to LIKE searches")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS files (id TEXT, name TEXT, mimeType TEXT, "
+                              "size TEXT, modifiedTime TEXT, parent TEXT)")
+            self.__fts = False
+        self.__db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+        self.__db.commit()
+
+    def __get_state(self, key):
+        row = self.__db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __set_state(self, key, value):
+        self.__db.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def ready(self):
+        """True once every root has been listed, until then searches go to the api"""
+        with self.__lock:
+            return self.__get_state('roots') == ','.join(sorted(self.__roots)) \
+                and self.__get_state('page_token') is not None
+
+    def start(self, authorize):
+        """Builds the index in the background and keeps pulling changes into it"""
+        self.__authorize = authorize
+        self.__updater = setInterval(INDEX_SYNC_INTERVAL, self.sync)
+        threading.Thread(target=self.sync, daemon=True).start()
+
+    def sync(self):
+        if not self.__sync_lock.acquire(blocking=False):
+            return
+        try:
+            # the first sync and the timer run on different threads, each uses its own client
+            self.__service = self.__authorize()
+            if not self.ready:
+                self.__rebuild()
+            else:
+                self.__pull_changes()
+        except HttpError as err:
+            if err.resp.status in (400, 404):
+                # the stored page token expired, start over from a fresh listing
+                LOGGER.warning(f"Drive index page token rejected, rebuilding: {err}")
+                with self.__lock:
+                    self.__set_state('page_token', None)
+                    self.__db.commit()
+            else:
+                LOGGER.error(f"Drive index sync failed: {err}")
+        except Exception as e:
+            LOGGER.error(f"Drive index sync failed: {e}")
+        finally:
+            self.__sync_lock.release()
+
+    def __rebuild(self):
+        # the token is taken first, changes made during the listing are replayed later
+        token = self.__service.changes().getStartPageToken(supportsAllDrives=True).execute()['startPageToken']
+        rows = []
+        names = {}
+        for root in self.__roots:
+            names[root] = self.__service.files().get(supportsAllDrives=True, fileId=root,
+                                                     fields='name').execute().get('name')
+            page_token = None
+            while True:
+                response = self.__service.files().list(supportsAllDrives=True,
+                                                       includeItemsFromAllDrives=True,
+                                                       q=f"'{root}' in parents and trashed = false",
+                                                       spaces='drive',
+                                                       pageSize=1000,
+                                                       fields=LIST_FIELDS,
+                                                       pageToken=page_token).execute()
+                rows += [self.__row(file, root) for file in response.get('files', [])]
+                page_token = response.get('nextPageToken', None)
+                if page_token is None:
+                    break
+        with self.__lock:
+            self.__db.execute("DELETE FROM files")
+            self.__db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+            for root, name in names.items():
+                self.__set_state(f'name:{root}', name)
+            self.__set_state('roots', ','.join(sorted(self.__roots)))
+            self.__set_state('page_token', token)
+            self.__db.commit()
+        LOGGER.info(f"Drive index built with {len(rows)} files")
+
+    def __pull_changes(self):
+        with self.__lock:
+            page_token = self.__get_state('page_token')
+        count = 0
+        while page_token is not None:
+            response = self.__service.changes().list(pageToken=page_token,
+                                                     supportsAllDrives=True,
+                                                     includeItemsFromAllDrives=True,
+                                                     pageSize=1000,
+                                                     fields=CHANGE_FIELDS).execute()
+            with self.__lock:
+                for change in response.get('changes', []):
+                    self.__apply(change)
+                    count += 1
+                page_token = response.get('nextPageToken')
+                self.__set_state('page_token', page_token or response.get('newStartPageToken'))
+                self.__db.commit()
+        if count:
+            LOGGER.info(f"Drive index applied {count} changes")
+
+    def __apply(self, change):
+        self.__db.execute("DELETE FROM files WHERE id = ?", (change['fileId'],))
+        file = change.get('file')
+        if change.get('removed') or file is None or file.get('trashed'):
+            return
+        for parent in file.get('parents', []):
+            if parent in self.__roots:
+                self.__db.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", self.__row(file, parent))
+
+    @staticmethod
+    def __row(file, parent):
+        return (file['id'], file.get('name'), file.get('mimeType'), file.get('size'),
+                file.get('modifiedTime'), parent)
+
+    def folder_name(self, root):
+        with self.__lock:
+            return self.__get_state(f'name:{root}')
+
+    def search(self, root, text, limit):
+        """:return: files of root whose name contains every word of text, newest first"""
+        words = re.findall(r'\w+', text)
+        if not words:
+            return []
+        with self.__lock:
+            if self.__fts:
+                rows = self.__db.execute(
+                    "SELECT id, name, mimeType, size FROM files WHERE files MATCH ? AND parent = ? "
+                    "ORDER BY modifiedTime DESC LIMIT ?",
+                    (' '.join(f'"{word}"*' for word in words), root, limit)).fetchall()
+            else:
+                rows = self.__db.execute(
+                    "SELECT id, name, mimeType, size FROM files WHERE name LIKE ? AND parent = ? "
+                    "ORDER BY modifiedTime DESC LIMIT ?", (f'%{text}%', root, limit)).fetchall()
+        return [{'id': id_, 'name': name, 'mimeType': mime_type, 'size': size}
+                for id_, name, mime_type, size in rows]
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from googleapiclient.errors import HttpError
+from tenacity import *
+
+from bot.helper.ext_utils.exceptions import ProcessCanceled
+
+LOGGER = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+# only what sizing, cloning and downloading a tree look at
+LIST_FIELDS = 'nextPageToken, files(id, name, mimeType, size, md5Checksum)'
+PAGE_SIZE = 1000
+# folders listed at once by walk_tree
+WALK_WORKERS = 8
+# /getsize followed by /clone or a mirror of the same link lists the tree only once
+CACHE_TTL = 300
+
+
+class FolderCache:
+    """Children of recently listed drive folders, keyed by folder id"""
+
+    def __init__(self, ttl):
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__folders = {}
+        self.__last_sweep = time.time()
+
+    def get(self, folder_id):
+        with self.__lock:
+            entry = self.__folders.get(folder_id)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.__folders[folder_id]
+                return None
+            return entry[1]
+
+    def put(self, folder_id, children):
+        with self.__lock:
+            now = time.time()
+            # expired folders nobody asked for again are swept once per ttl
+            if now - self.__last_sweep > self.__ttl:
+                self.__last_sweep = now
+                for key in [key for key, entry in self.__folders.items() if entry[0] < now]:
+                    del self.__folders[key]
+            self.__folders[folder_id] = (now + self.__ttl, children)
+
+    def invalidate(self, folder_id):
+        with self.__lock:
+            self.__folders.pop(folder_id, None)
+
+
+FOLDER_CACHE = FolderCache(CACHE_TTL)
+
+
+@retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
+       retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
+def list_folder(service, folder_id):
+    """:return: direct children of folder_id, from the cache while it is fresh"""
+    children = FOLDER_CACHE.get(folder_id)
+    if children is not None:
+        return list(children)
+    children = []
+    page_token = None
+    while True:
+        response = service.files().list(supportsTeamDrives=True,
+                                        includeTeamDriveItems=True,
+                                        q=f"'{folder_id}' in parents",
+                                        spaces='drive',
+                                        pageSize=PAGE_SIZE,
+                                        fields=LIST_FIELDS,
+                                        orderBy='folder, name',
+                                        pageToken=page_token).execute()
+        children.extend(response.get('files', []))
+        page_token = response.get('nextPageToken', None)
+        if page_token is None:
+            break
+    FOLDER_CACHE.put(folder_id, children)
+    return list(children)
+
+
+def walk_tree(folder_id, authorize, is_cancelled=None):
+    """
+    Lists every folder under folder_id breadth first, with up to WALK_WORKERS folders
+    listed at once. googleapiclient services are not thread safe, so every worker
+    builds its own with authorize().
+    :return: dict of folder id to its children, covering the whole tree
+    """
+    local = threading.local()
+
+    def list_children(current_id):
+        children = FOLDER_CACHE.get(current_id)
+        if children is not None:
+            return list(children)
+        if getattr(local, 'service', None) is None:
+            local.service = authorize()
+        return list_folder(local.service, current_id)
+
+    tree = {}
+    # a folder with several parents is still listed once
+    seen = {folder_id}
+    with ThreadPoolExecutor(max_workers=WALK_WORKERS) as executor:
+        pending = {executor.submit(list_children, folder_id): folder_id}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                if is_cancelled is not None and is_cancelled():
+                    raise ProcessCanceled
+                for future in done:
+                    children = future.result()
+                    tree[pending.pop(future)] = children
+                    for child in children:
+                        if child.get('mimeType') == FOLDER_MIME_TYPE and child['id'] not in seen:
+                            seen.add(child['id'])
+                            pending[executor.submit(list_children, child['id'])] = child['id']
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+    return tree
@@ -1,5 +1,4 @@
 import os
-import pickle
 import urllib.parse as urlparse
 from urllib.parse import parse_qs
 
@@ -8,14 +7,13 @@ import json
 import requests
 import logging
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from bot.helper.telegram_helper import button_build
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from bot.helper.ext_utils.exceptions import ProcessCanceled
+from bot.helper.ext_utils.exceptions import ProcessCanceled, DriveQuotaExceeded
 
-from google.auth.transport.requests import Request
-from google.oauth2 import service_account
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google.auth.transport.requests import AuthorizedSession
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from bot.helper.mirror_utils.download_utils.gdrive_download import GDdownload
@@ -25,32 +23,72 @@ import random
 import string
 
 from bot import parent_id, DOWNLOAD_DIR, IS_TEAM_DRIVE, INDEX_URL,\
-    USE_SERVICE_ACCOUNTS, download_dict, ENABLE_DRIVE_SEARCH
+    USE_SERVICE_ACCOUNTS, download_dict, download_dict_lock, ENABLE_DRIVE_SEARCH, UPLOAD_WORKERS, SA_DAILY_CAP, SA_USAGE_FILE, \
+    CLONE_WORKERS, Interval, DOWNLOAD_STATUS_UPDATE_INTERVAL, USE_DRIVE_INDEX
 from bot.helper.ext_utils.bot_utils import *
-from bot.helper.ext_utils.fs_utils import get_mime_type
+from bot.helper.ext_utils.fs_utils import get_mime_type, get_path_size, stream_tar, stream_zip
+from bot.helper.mirror_utils.upload_utils.stream_upload import ResumableUploadStream, create_upload_session, \
+    RATE_LIMIT_REASONS
+from bot.helper.mirror_utils.upload_utils.sa_pool import ServiceAccountPool
+from bot.helper.mirror_utils.upload_utils.drive_auth import DRIVE_AUTH
+from bot.helper.mirror_utils.upload_utils.drive_walker import list_folder, walk_tree
+from bot.helper.mirror_utils.upload_utils.drive_index import DriveIndex
+from bot.helper.mirror_utils.status_utils.clone_status import CloneStatus
+from bot.helper.telegram_helper.message_utils import update_all_messages, delete_all_messages
 
 LOGGER = logging.getLogger(__name__)
 logging.getLogger('googleapiclient.discovery').setLevel(logging.ERROR)
 
 if USE_SERVICE_ACCOUNTS and os.path.isdir("accounts"):
     SERVICE_ACCOUNT_INDEX = random.randrange(0, len(os.listdir("accounts")))
+    SA_POOL = ServiceAccountPool("accounts", SA_DAILY_CAP, SA_USAGE_FILE)
 else:    
     SERVICE_ACCOUNT_INDEX = 0
+    SA_POOL = None
+
+# drive takes at most 100 calls in one batch request
+BATCH_SIZE = 100
+BATCH_RETRIES = 5
+MAX_BACKOFF = 64
+# mime type of a streamed tar by the codec it is compressed with
+ARCHIVE_MIME_TYPES = {'none': "application/x-tar", 'gzip': "application/gzip", 'zstd': "application/zstd"}
+
+# team drive folders the torrent duplicate check looks in
+# SEARCH_DRIVES = ['1-_xVhSg4S4TYyYQ4PQDlvdvgU47QKLye','1d_nMzq_N19GFIwZn-lHjI001G8pesmb9','1-SOFqWFHpckALJz437-irVhAnjzxgLkW','1SrbdybfP0gB8HNup2uPMYzvidT10o2qW','1Au7Ed8ibC8tE0l3Tf4UNR55qM9ogkca9','18ngROC4tLF2uKGpo0VkE5Elp94MJMIk4','1IcbJGgxXBuhrxkoOW51WjrsfH2c0E2h-','1CxdVc9C-6-sllOe8lD1IqWy1uKbvKmBD','1D5N5DddEoz1KCUGHjUYD3TeuqskTvbZj','1guot-8-dGoY1tJ2UeroBi_QkDAC_wMDS','1rMsivIt0M6BlZXgiOaLWmeyap8EX6YWE','1iGNP47SiCy-NI9h755EdtAa4hK4aaaJ5', '14AECxncxxNC0Bg9vDTErlMBcYDeB1y81']
+SEARCH_DRIVES = ["17zzf_d3Wi16a9m6gOwizlKOiz8YpfXTX"]
+
+if USE_DRIVE_INDEX:
+    DRIVE_INDEX = DriveIndex([parent_id] + SEARCH_DRIVES)
+else:
+    DRIVE_INDEX = None
+
+
+def account_index(sa_index=None):
+    """:return: the DRIVE_AUTH account of sa_index, the service account in use when it is None"""
+    if not USE_SERVICE_ACCOUNTS:
+        return None
+    return SERVICE_ACCOUNT_INDEX if sa_index is None else sa_index
+
+
+def drive_service(sa_index=None):
+    return DRIVE_AUTH.service(account_index(sa_index))
+
+
+def drive_credentials(sa_index=None):
+    return DRIVE_AUTH.credentials(account_index(sa_index))
+
+
+def start_drive_index():
+    if DRIVE_INDEX is not None:
+        DRIVE_INDEX.start(drive_service)
 
 
 class GoogleDriveHelper:
     def __init__(self, name=None, listener=None):
-        self.__G_DRIVE_TOKEN_FILE = "token.pickle"
-        # Check https://developers.google.com/drive/scopes for all available scopes
-        self.__OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
-        # Redirect URI for installed apps, can be left as is
-        self.__REDIRECT_URI = "urn:ietf:wg:oauth:2.0:oob"
         self.__G_DRIVE_DIR_MIME_TYPE = "application/vnd.google-apps.folder"
         self.__G_DRIVE_BASE_DOWNLOAD_URL = "https://drive.google.com/uc?id={}&export=download"
         self.__G_DRIVE_DIR_BASE_DOWNLOAD_URL = "https://drive.google.com/drive/folders/{}"
         self.__listener = listener
-        self.__service = self.authorize()
-        self.__listener = listener
         self._file_uploaded_bytes = 0
         self.uploaded_bytes = 0
         self.UPDATE_INTERVAL = 5
@@ -66,6 +104,19 @@ class GoogleDriveHelper:
         self.temppath = DOWNLOAD_DIR
         self._is_canceled = False
         self.quotadelete = None
+        self.__progress_lock = threading.Lock()
+        # source bytes fed into a streamed archive
+        self.archived_bytes = 0
+        self.transferred_size = 0
+        self.cloned_bytes = 0
+        self.cloned_files = 0
+        self.total_files = 0
+        self.clone_start_time = 0
+        self.__clone_cancelled = False
+        # seconds every clone worker waits before its next batch, shared so one
+        # rate limited worker slows down the whole pool
+        self.__backoff = 0
+        self.__backoff_lock = threading.Lock()
 
     def cancel(self):
         self.is_cancelled = True
@@ -81,6 +132,16 @@ class GoogleDriveHelper:
         except ZeroDivisionError:
             return 0
 
+    def clone_speed(self):
+        try:
+            return self.cloned_bytes / (time.time() - self.clone_start_time)
+        except ZeroDivisionError:
+            return 0
+
+    def cancel_clone(self):
+        self.__clone_cancelled = True
+        self._is_canceled = True
+
     @staticmethod
     def getIdFromUrl(link: str):
         if "folders" in link or "file" in link:
@@ -92,15 +153,26 @@ class GoogleDriveHelper:
         parsed = urlparse.urlparse(link)
         return parse_qs(parsed.query)['id'][0]
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def _on_upload_progress(self):
-        if self.status is not None:
-            chunk_size = self.status.total_size * self.status.progress() - self._file_uploaded_bytes
-            self._file_uploaded_bytes = self.status.total_size * self.status.progress()
-            LOGGER.debug(f'Uploading {self.name}, chunk size: {get_readable_file_size(chunk_size)}')
+        # uploaded_bytes is fed by every upload_file call as chunks land,
+        # so all that is left here is the clock used for the speed
+        self.total_time += self.update_interval
+
+    def __add_uploaded_bytes(self, chunk_size):
+        with self.__progress_lock:
             self.uploaded_bytes += chunk_size
-            self.total_time += self.update_interval
+        LOGGER.debug(f'Uploading {self.name}, chunk size: {get_readable_file_size(chunk_size)}')
+
+    @property
+    def __service(self):
+        # the helper is built on one thread and used on others, so the client is looked up per call
+        return self.authorize()
+
+    def __get_service(self):
+        return self.__service
+
+    def __sa_service(self, index):
+        return self.authorize(index)
 
     def __upload_empty_file(self, path, file_name, mime_type, parent_id=None):
         media_body = MediaFileUpload(path,
@@ -116,30 +188,45 @@ class GoogleDriveHelper:
         return self.__service.files().create(supportsTeamDrives=True,
                                              body=file_metadata, media_body=media_body).execute()
 
-    def switchServiceAccount(self):
-        global SERVICE_ACCOUNT_INDEX
-        current = SERVICE_ACCOUNT_INDEX
-        SERVICE_ACCOUNT_INDEX = random.randrange(0, len(os.listdir("accounts"))+1)
-        if current == SERVICE_ACCOUNT_INDEX:
-            self.switchServiceAccount()
-        LOGGER.info(f"Switching to {SERVICE_ACCOUNT_INDEX}.json service account")
-        self.__service = self.authorize()
-
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    def __set_permission(self, drive_id):
+    def __set_permission(self, drive_id, service=None):
         permissions = {
             'role': 'reader',
             'type': 'anyone',
             'value': None,
             'withLink': True
         }
-        return self.__service.permissions().create(supportsTeamDrives=True, fileId=drive_id,
-                                                   body=permissions).execute()
+        if service is None:
+            service = self.__get_service()
+        return service.permissions().create(supportsTeamDrives=True, fileId=drive_id,
+                                            body=permissions).execute()
 
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def upload_file(self, file_path, file_name, mime_type, parent_id):
+        if SA_POOL is None:
+            return self.__upload_file(file_path, file_name, mime_type, parent_id, self.__get_service())
+        size = os.path.getsize(file_path)
+        while True:
+            sa_index = SA_POOL.acquire(size)
+            if sa_index is None:
+                raise DriveQuotaExceeded("All service accounts have hit their quota for today")
+            try:
+                link = self.__upload_file(file_path, file_name, mime_type, parent_id,
+                                          self.__sa_service(sa_index))
+            except DriveQuotaExceeded as e:
+                LOGGER.info(f"Got: {e} on {sa_index}.json, Trying Again.")
+                SA_POOL.mark_exhausted(sa_index)
+                SA_POOL.release(sa_index, refund=size)
+                continue
+            except Exception:
+                SA_POOL.release(sa_index, refund=size)
+                raise
+            SA_POOL.release(sa_index, refund=size if link is None else 0)
+            return link
+
+    def __upload_file(self, file_path, file_name, mime_type, parent_id, service):
         # File body description
         file_metadata = {
             'name': file_name,
@@ -153,13 +240,13 @@ class GoogleDriveHelper:
             media_body = MediaFileUpload(file_path,
                                          mimetype=mime_type,
                                          resumable=False)
-            response = self.__service.files().create(supportsTeamDrives=True,
-                                                     body=file_metadata, media_body=media_body).execute()
+            response = service.files().create(supportsTeamDrives=True,
+                                              body=file_metadata, media_body=media_body).execute()
             if not IS_TEAM_DRIVE:
-                self.__set_permission(response['id'])
+                self.__set_permission(response['id'], service)
 
-            drive_file = self.__service.files().get(supportsTeamDrives=True,
-                                                    fileId=response['id']).execute()
+            drive_file = service.files().get(supportsTeamDrives=True,
+                                             fileId=response['id']).execute()
             download_url = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(drive_file.get('id'))
             return download_url
         media_body = MediaFileUpload(file_path,
@@ -168,30 +255,35 @@ class GoogleDriveHelper:
                                      chunksize=50 * 1024 * 1024)
 
         # Insert a file
-        drive_file = self.__service.files().create(supportsTeamDrives=True,
-                                                   body=file_metadata, media_body=media_body)
+        drive_file = service.files().create(supportsTeamDrives=True,
+                                            body=file_metadata, media_body=media_body)
         response = None
+        file_uploaded_bytes = 0
         while response is None:
             if self.is_cancelled:
                 return None
             try:
-                self.status, response = drive_file.next_chunk()
+                status, response = drive_file.next_chunk()
+                if status is not None:
+                    self.__add_uploaded_bytes(status.resumable_progress - file_uploaded_bytes)
+                    file_uploaded_bytes = status.resumable_progress
             except HttpError as err:
                 if err.resp.get('content-type', '').startswith('application/json'):
                     reason = json.loads(err.content).get('error').get('errors')[0].get('reason')
-                    if reason == 'userRateLimitExceeded' or reason == 'dailyLimitExceeded':
-                        if USE_SERVICE_ACCOUNTS:
-                            self.switchServiceAccount()
-                            LOGGER.info(f"Got: {reason}, Trying Again.")
-                            return self.upload_file(file_path, file_name, mime_type, parent_id)
+                    if reason in RATE_LIMIT_REASONS:
+                        if SA_POOL is not None:
+                            # upload_file books the file on another service account
+                            self.__add_uploaded_bytes(-file_uploaded_bytes)
+                            raise DriveQuotaExceeded(reason)
                     else:
+                        self.__add_uploaded_bytes(-file_uploaded_bytes)
                         raise err
-        self._file_uploaded_bytes = 0
+        self.__add_uploaded_bytes(os.path.getsize(file_path) - file_uploaded_bytes)
         # Insert new permissions
         if not IS_TEAM_DRIVE:
-            self.__set_permission(response['id'])
+            self.__set_permission(response['id'], service)
         # Define file instance and get url for download
-        drive_file = self.__service.files().get(supportsTeamDrives=True, fileId=response['id']).execute()
+        drive_file = service.files().get(supportsTeamDrives=True, fileId=response['id']).execute()
         download_url = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(drive_file.get('id'))
         return download_url
 
@@ -247,12 +339,85 @@ class GoogleDriveHelper:
         LOGGER.info("Deleting downloaded file/folder..")
         return link
 
+    def __add_archived_bytes(self, size):
+        self.archived_bytes += size
+
+    def __stream_archive(self, org_path, archive_type, codec, mime_type, sa_index):
+        """:return: metadata of the drive file the archive was streamed into with account sa_index"""
+        session = AuthorizedSession(self.load_credentials(sa_index))
+        upload_url = create_upload_session(session, self.name, mime_type, parent_id)
+        stream = ResumableUploadStream(session, upload_url,
+                                       on_progress=self.__add_uploaded_bytes,
+                                       is_cancelled=lambda: self.is_cancelled)
+        if archive_type == "zip":
+            stream_zip(org_path, stream, self.__add_archived_bytes)
+        else:
+            stream_tar(org_path, stream, self.__add_archived_bytes, codec)
+        return stream.finish()
+
+    def upload_archive(self, org_path, archive_type, codec='none'):
+        """
+        Archives org_path as tar or zip and streams it straight into a drive resumable
+        upload, so the archive never touches the disk and archiving overlaps the upload.
+        A tar is compressed with codec. Reports back to the listener exactly like upload() does.
+        """
+        self.__listener.onUploadStarted()
+        LOGGER.info(f"Streaming {archive_type}: {org_path} as {self.name}")
+        mime_type = "application/zip" if archive_type == "zip" else ARCHIVE_MIME_TYPES[codec]
+        self.start_time = time.time()
+        self.updater = setInterval(self.update_interval, self._on_upload_progress)
+        sa_index = None
+        size = get_path_size(org_path)
+        try:
+            while True:
+                if SA_POOL is not None:
+                    sa_index = SA_POOL.acquire(size)
+                    if sa_index is None:
+                        raise DriveQuotaExceeded("All service accounts have hit their quota for today")
+                try:
+                    response = self.__stream_archive(org_path, archive_type, codec, mime_type, sa_index)
+                    break
+                except DriveQuotaExceeded as e:
+                    if SA_POOL is None:
+                        raise
+                    # a stream cannot move mid-way, the archive starts over on the next account
+                    LOGGER.info(f"Got: {e} on {sa_index}.json, Trying Again.")
+                    SA_POOL.mark_exhausted(sa_index)
+                    SA_POOL.release(sa_index, refund=size)
+                    sa_index = None
+                    self.__add_uploaded_bytes(-self.uploaded_bytes)
+                    self.archived_bytes = 0
+            if not IS_TEAM_DRIVE:
+                self.__set_permission(response['id'], None if sa_index is None else self.__sa_service(sa_index))
+            link = self.__G_DRIVE_BASE_DOWNLOAD_URL.format(response['id'])
+            LOGGER.info("Uploaded To G-Drive: " + self.name)
+        except ProcessCanceled:
+            self.__listener.onUploadError('Upload has been manually cancelled')
+            return
+        except Exception as e:
+            if isinstance(e, RetryError):
+                LOGGER.info(f"Total Attempts: {e.last_attempt.attempt_number}")
+                err = e.last_attempt.exception()
+            else:
+                err = e
+            LOGGER.error(err)
+            self.__listener.onUploadError(str(err))
+            return
+        finally:
+            self.updater.cancel()
+            if SA_POOL is not None:
+                SA_POOL.release(sa_index, refund=size - self.uploaded_bytes)
+        self.__listener.onUploadComplete(link)
+        return link
+
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    def copyFile(self, file_id, dest_id):
+    def copyFile(self, file_id, dest_id, size=0):
         if self._is_canceled:
             LOGGER.info("Called Process CAnceled in copy file")
             raise ProcessCanceled
+        if SA_POOL is not None:
+            return self.__copy_file_sa(file_id, dest_id, size)
         body = {
             'parents': [dest_id]
         }
@@ -270,38 +435,56 @@ class GoogleDriveHelper:
         except HttpError as err:
             if err.resp.get('content-type', '').startswith('application/json'):
                 reason = json.loads(err.content).get('error').get('errors')[0].get('reason')
-                if reason == 'userRateLimitExceeded' or reason == 'dailyLimitExceeded':
+                if reason in RATE_LIMIT_REASONS:
                     self.stop_clone()
                     return
                 else:
                     raise err
 
+    def __copy_file_sa(self, file_id, dest_id, size):
+        # copies count against the daily cap of the account doing them as well
+        while True:
+            sa_index = SA_POOL.acquire(size)
+            if sa_index is None:
+                self.stop_clone()
+                return
+            try:
+                res = self.__sa_service(sa_index).files().copy(supportsAllDrives=True, fileId=file_id,
+                                                                body={'parents': [dest_id]}).execute()
+            except HttpError as err:
+                SA_POOL.release(sa_index, refund=size)
+                if err.resp.get('content-type', '').startswith('application/json'):
+                    reason = json.loads(err.content).get('error').get('errors')[0].get('reason')
+                    if reason in RATE_LIMIT_REASONS:
+                        SA_POOL.mark_exhausted(sa_index)
+                        continue
+                raise err
+            SA_POOL.release(sa_index)
+            return res
+
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
     def getFileMetadata(self,file_id):
         return self.__service.files().get(supportsAllDrives=True, fileId=file_id,
                                               fields="name,id,mimeType,size").execute()
 
-    @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
-           retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
+    def fileExists(self, link):
+        """:return: False if the file behind a drive link was deleted or trashed"""
+        try:
+            meta = self.__service.files().get(supportsAllDrives=True, fileId=self.getIdFromUrl(link),
+                                              fields="id,trashed").execute()
+        except (KeyError, IndexError):
+            return False
+        except HttpError as err:
+            if err.resp.status == 404:
+                return False
+            # a flaky api is no reason to mirror again
+            LOGGER.warning(f"Could not check {link}: {err}")
+            return True
+        return not meta.get('trashed', False)
+
     def getFilesByFolderId(self,folder_id):
-        page_token = None
-        q = f"'{folder_id}' in parents"
-        files = []
-        while True:
-            response = self.__service.files().list(supportsTeamDrives=True,
-                                                   includeTeamDriveItems=True,
-                                                   q=q,
-                                                   spaces='drive',
-                                                   pageSize=200,
-                                                   fields='nextPageToken, files(id, name, mimeType,size)',
-                                                   pageToken=page_token).execute()
-            for file in response.get('files', []):
-                files.append(file)
-            page_token = response.get('nextPageToken', None)
-            if page_token is None:
-                break
-        return files
+        return list_folder(self.__service, folder_id)
 
     def clone(self, link, message):
         if message.from_user.username:
@@ -321,7 +504,7 @@ class GoogleDriveHelper:
             if meta.get("mimeType") == self.__G_DRIVE_DIR_MIME_TYPE:
                 dir_id = self.create_directory(meta.get('name'), parent_id)
                 self.quotadelete = dir_id
-                result = self.cloneFolder(meta.get('name'), meta.get('name'), meta.get('id'), dir_id)
+                result = self.__clone_with_status(meta, dir_id, message)
                 if ENABLE_DRIVE_SEARCH:
                     msg += f'<b>Filename</b>: <code>{meta.get("name")}</code>\n\n' \
                         f'<b>Size</b>: <code>{get_readable_file_size(self.transferred_size)}</code>' \
@@ -337,7 +520,7 @@ class GoogleDriveHelper:
                     buttons.buildbutton("🔥Index Link🔥", url)
             else:
                 try:
-                    file = self.copyFile(meta.get('id'), parent_id)
+                    file = self.copyFile(meta.get('id'), parent_id, int(meta.get('size') or 0))
                     self.quotadelete = file.get("id")
                     msg += f'<b>Filename</b>: <code>{meta.get("name")}</code>\n\n'
                     buttons = button_build.ButtonMaker()
@@ -360,8 +543,11 @@ class GoogleDriveHelper:
                         error = f"<b>HttpError 403</b>\nThe Clone Quota for this File has Exceeded.\n#Clone_Stopped!"
                         return error , ""            
         except ProcessCanceled:
-            LOGGER.info(f"Clone Stopped Cuz of Download Quota!")
             self.deletefilebyid(self.quotadelete)
+            if self.__clone_cancelled:
+                LOGGER.info(f"Clone of {meta.get('name')} cancelled by user")
+                return f"<b>Clone of</b> <code>{meta.get('name')}</code> <b>has been cancelled!</b>", ""
+            LOGGER.info(f"Clone Stopped Cuz of Download Quota!")
             error = f"<b>HttpError 403</b>\nThe Clone Quota for this File has Exceeded.</b>\n#Clone_Stopped!"
             return error , ""
         except Exception as err:
@@ -373,37 +559,242 @@ class GoogleDriveHelper:
             return error, ""
         return msg, InlineKeyboardMarkup(buttons.build_menu(2))
 
+    def __clone_with_status(self, meta, dir_id, message):
+        # folder clones show up in /status like any other task and can be cancelled by gid
+        gid = ''.join(random.SystemRandom().choices(string.ascii_letters + string.digits, k=4))
+        with download_dict_lock:
+            download_dict[message.id] = CloneStatus(self, meta.get('name'), message, gid)
+        if len(Interval) == 0:
+            Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages))
+        try:
+            return self.cloneFolder(meta.get('name'), meta.get('name'), meta.get('id'), dir_id)
+        finally:
+            with download_dict_lock:
+                download_dict.pop(message.id, None)
+                count = len(download_dict)
+            if count == 0:
+                try:
+                    Interval[0].cancel()
+                    del Interval[0]
+                    delete_all_messages()
+                except IndexError:
+                    pass
+
     def cloneFolder(self, name, local_path, folder_id, parent_id):
-        if self._is_canceled:
-            raise ProcessCanceled
-        LOGGER.info(f"Syncing: {local_path}")
-        files = self.getFilesByFolderId(folder_id)
-        new_id = None
+        """
+        Recreates the whole folder tree level by level first, then copies the files in
+        batch requests spread over CLONE_WORKERS threads
+        """
+        self.clone_start_time = time.time()
+        tree = walk_tree(folder_id, self.authorize, lambda: self._is_canceled)
+        files = []
+        level = [(folder_id, parent_id, local_path)]
+        while level:
+            if self._is_canceled:
+                raise ProcessCanceled
+            folders = []
+            for src_id, dest_id, path in level:
+                LOGGER.info(f"Syncing: {path}")
+                for file in tree.get(src_id, []):
+                    if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
+                        folders.append((file, dest_id, os.path.join(path, file.get('name'))))
+                    else:
+                        files.append((file, dest_id))
+                        self.transferred_size += int(file.get('size') or 0)
+                        self.total_files += 1
+            dir_ids = self.__create_directories([(file.get('name'), dest_id) for file, dest_id, _ in folders])
+            level = [(file.get('id'), dir_id, path) for (file, _, path), dir_id in zip(folders, dir_ids)]
         if len(files) == 0:
             return parent_id
-        for file in files:
-            if file.get('mimeType') == self.__G_DRIVE_DIR_MIME_TYPE:
-                file_path = os.path.join(local_path, file.get('name'))
-                current_dir_id = self.create_directory(file.get('name'), parent_id)
-                new_id = self.cloneFolder(file.get('name'), file_path, file.get('id'), current_dir_id)
+        batches = [files[i:i + BATCH_SIZE] for i in range(0, len(files), BATCH_SIZE)]
+        LOGGER.info(f"Cloning {len(files)} files in {len(batches)} batches with {CLONE_WORKERS} workers")
+        with ThreadPoolExecutor(max_workers=CLONE_WORKERS) as executor:
+            futures = [executor.submit(self.__copy_batch, batch) for batch in batches]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                self._is_canceled = True
+                for future in futures:
+                    future.cancel()
+                raise
+        if self._is_canceled:
+            raise ProcessCanceled
+        return parent_id
+
+    def __create_directories(self, folders):
+        """
+        Creates (name, parent_id) folders with batch requests
+        :return: ids of the new folders in the same order
+        """
+        dir_ids = []
+        for i in range(0, len(folders), BATCH_SIZE):
+            chunk = folders[i:i + BATCH_SIZE]
+            calls = {
+                str(key): lambda name=name, dest_id=dest_id: self.__service.files().create(
+                    supportsTeamDrives=True, fields='id',
+                    body={"name": name, "mimeType": self.__G_DRIVE_DIR_MIME_TYPE, "parents": [dest_id]})
+                for key, (name, dest_id) in enumerate(chunk)}
+            results = self.__execute_batch(self.__service, calls)
+            ids = [results[str(key)].get('id') for key in range(len(chunk))]
+            if not IS_TEAM_DRIVE:
+                permissions = {
+                    'role': 'reader',
+                    'type': 'anyone',
+                    'value': None,
+                    'withLink': True
+                }
+                self.__execute_batch(self.__service, {
+                    drive_id: lambda drive_id=drive_id: self.__service.permissions().create(
+                        supportsTeamDrives=True, fileId=drive_id, body=permissions)
+                    for drive_id in ids})
+            dir_ids += ids
+        return dir_ids
+
+    def __add_cloned(self, size):
+        with self.__progress_lock:
+            self.cloned_bytes += size
+            self.cloned_files += 1
+
+    def __copy_batch(self, batch):
+        if self._is_canceled:
+            return
+        pending = {str(key): item for key, item in enumerate(batch)}
+
+        def on_copied(key, response):
+            file, _ = pending.pop(key)
+            self.__add_cloned(int(file.get('size') or 0))
+
+        def on_failed(key, err):
+            # a file drive refuses to copy is skipped, the rest of the folder still goes through
+            nonlocal skipped
+            file, _ = pending.pop(key)
+            skipped += int(file.get('size') or 0)
+            LOGGER.error(f"Could not copy {file.get('name')}: {err}")
+
+        while pending:
+            # bytes booked on this round's account for files that were skipped
+            skipped = 0
+            size = sum(int(file.get('size') or 0) for file, _ in pending.values())
+            if SA_POOL is None:
+                sa_index = None
+                service = self.__get_service()
             else:
-                try:
-                    self.transferred_size += int(file.get('size'))
-                except TypeError:
-                    pass
-                try:
-                    self.copyFile(file.get('id'), parent_id)
-                    new_id = parent_id
-                except ProcessCanceled:
-                    raise ProcessCanceled    
-                except Exception as e:
-                    if isinstance(e, RetryError):
-                        LOGGER.info(f"Total Attempts: {e.last_attempt.attempt_number}")
-                        err = e.last_attempt.exception()
-                    else:
-                        err = e
-                    LOGGER.error(err)
-        return new_id
+                sa_index = SA_POOL.acquire(size)
+                if sa_index is None:
+                    self.stop_clone()
+                    raise ProcessCanceled
+                service = self.__sa_service(sa_index)
+            calls = {
+                key: lambda file_id=file.get('id'), dest_id=dest_id: service.files().copy(
+                    supportsAllDrives=True, fileId=file_id, fields='id', body={'parents': [dest_id]})
+                for key, (file, dest_id) in pending.items()}
+            try:
+                self.__execute_batch(service, calls, on_copied, on_failed)
+            except DriveQuotaExceeded as e:
+                if SA_POOL is None:
+                    self.stop_clone()
+                    raise ProcessCanceled
+                # only the files that did not make it go to the next account
+                LOGGER.info(f"Got: {e} on {sa_index}.json, Trying Again.")
+                SA_POOL.mark_exhausted(sa_index)
+                SA_POOL.release(sa_index, refund=skipped + sum(int(file.get('size') or 0)
+                                                               for file, _ in pending.values()))
+                continue
+            except Exception:
+                if SA_POOL is not None:
+                    SA_POOL.release(sa_index, refund=skipped + sum(int(file.get('size') or 0)
+                                                                   for file, _ in pending.values()))
+                raise
+            if SA_POOL is not None:
+                SA_POOL.release(sa_index, refund=skipped)
+
+    @staticmethod
+    def __error_reason(err):
+        if err.resp.get('content-type', '').startswith('application/json'):
+            try:
+                return json.loads(err.content).get('error').get('errors')[0].get('reason')
+            except (ValueError, AttributeError, IndexError, TypeError):
+                return None
+        return None
+
+    def __is_retryable(self, err):
+        if not isinstance(err, HttpError):
+            return False
+        status = err.resp.status
+        if status == 429 or status >= 500:
+            return True
+        return status == 403 and self.__error_reason(err) in RATE_LIMIT_REASONS + ('rateLimitExceeded',)
+
+    def __slow_down(self):
+        with self.__backoff_lock:
+            self.__backoff = min(max(self.__backoff * 2, 1), MAX_BACKOFF)
+            return self.__backoff
+
+    def __speed_up(self):
+        with self.__backoff_lock:
+            self.__backoff = self.__backoff / 2 if self.__backoff > 1 else 0
+
+    def __execute_batch(self, service, calls, on_success=None, on_failed=None):
+        """
+        Runs {request_id: request factory} through drive batch requests, calls that failed
+        with 403 rate limits, 429 or 5xx are built again and retried with a backoff shared
+        by every worker of this clone. Other errors go to on_failed or are raised.
+        :return: {request_id: response}
+        :raises DriveQuotaExceeded: when the daily quota is gone or drive keeps rate
+        limiting after BATCH_RETRIES rounds
+        """
+        results = {}
+        pending = dict(calls)
+        attempt = 0
+        while pending:
+            if self._is_canceled:
+                raise ProcessCanceled
+            if self.__backoff:
+                time.sleep(self.__backoff + random.random())
+            errors = {}
+
+            def callback(request_id, response, exception):
+                if exception is not None:
+                    errors[request_id] = exception
+                    return
+                results[request_id] = response
+                if on_success is not None:
+                    on_success(request_id, response)
+
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id, factory in pending.items():
+                batch.add(factory(), request_id=request_id)
+            try:
+                batch.execute()
+            except HttpError as err:
+                # the whole batch was refused, every call in it failed the same way
+                if not self.__is_retryable(err):
+                    raise err
+                errors = {request_id: err for request_id in pending if request_id not in results}
+            for request_id, err in list(errors.items()):
+                if self.__is_retryable(err):
+                    if self.__error_reason(err) == 'dailyLimitExceeded':
+                        raise DriveQuotaExceeded('dailyLimitExceeded')
+                    continue
+                if on_failed is None:
+                    raise err
+                on_failed(request_id, err)
+                del errors[request_id]
+            pending = {request_id: pending[request_id] for request_id in errors}
+            if not pending:
+                self.__speed_up()
+                break
+            attempt += 1
+            reason = self.__error_reason(next(iter(errors.values())))
+            if attempt > BATCH_RETRIES:
+                if reason in RATE_LIMIT_REASONS:
+                    raise DriveQuotaExceeded(reason)
+                raise next(iter(errors.values()))
+            backoff = self.__slow_down()
+            LOGGER.warning(f"{len(pending)} batched calls failed ({reason}), retrying in {backoff}s "
+                           f"({attempt}/{BATCH_RETRIES})")
+        return results
 
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
@@ -422,6 +813,8 @@ class GoogleDriveHelper:
         return file_id
 
     def upload_dir(self, input_directory, parent_id):
+        if UPLOAD_WORKERS > 1:
+            return self.__upload_dir_parallel(input_directory, parent_id)
         list_dirs = os.listdir(input_directory)
         if len(list_dirs) == 0:
             return parent_id
@@ -441,6 +834,49 @@ class GoogleDriveHelper:
                 new_id = parent_id
         return new_id
 
+    def __create_dir_tree(self, input_directory, parent_id, files):
+        """
+        Mirrors the local folder tree on drive and collects every file with the id of the
+        drive folder it has to go in
+        """
+        for item in os.listdir(input_directory):
+            if self.is_cancelled:
+                return
+            current_file_name = os.path.join(input_directory, item)
+            if os.path.isdir(current_file_name):
+                current_dir_id = self.create_directory(item, parent_id)
+                self.__create_dir_tree(current_file_name, current_dir_id, files)
+            else:
+                files.append((current_file_name, parent_id))
+
+    def __upload_worker(self, file_path, parent_id):
+        if self.is_cancelled:
+            return None
+        mime_type = get_mime_type(file_path)
+        return self.upload_file(file_path, os.path.basename(file_path), mime_type, parent_id)
+
+    def __upload_dir_parallel(self, input_directory, parent_id):
+        files = []
+        self.__create_dir_tree(input_directory, parent_id, files)
+        if self.is_cancelled:
+            return None
+        LOGGER.info(f"Uploading {len(files)} files with {UPLOAD_WORKERS} workers")
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = [executor.submit(self.__upload_worker, file_path, dir_id)
+                       for file_path, dir_id in files]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # one failed file fails the whole folder, stop the rest of the pool
+                self.cancel()
+                for future in futures:
+                    future.cancel()
+                raise
+        if self.is_cancelled:
+            return None
+        return parent_id
+
     def deletefile(self, link: str):
         try:
             file_id = self.getIdFromUrl(link)
@@ -470,58 +906,14 @@ class GoogleDriveHelper:
         finally:
             return msg            
 
-    def authorize(self):
-        # Get credentials
-        credentials = None
-        if not USE_SERVICE_ACCOUNTS:
-            if os.path.exists(self.__G_DRIVE_TOKEN_FILE):
-                with open(self.__G_DRIVE_TOKEN_FILE, 'rb') as f:
-                    credentials = pickle.load(f)
-            if credentials is None or not credentials.valid:
-                if credentials and credentials.expired and credentials.refresh_token:
-                    credentials.refresh(Request())
-                else:
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        'credentials.json', self.__OAUTH_SCOPE)
-                    LOGGER.info(flow)
-                    credentials = flow.run_console(port=0)
-
-                # Save the credentials for the next run
-                with open(self.__G_DRIVE_TOKEN_FILE, 'wb') as token:
-                    pickle.dump(credentials, token)
-        else:
-            LOGGER.info(f"Authorizing with {SERVICE_ACCOUNT_INDEX}.json service account")
-            credentials = service_account.Credentials.from_service_account_file(
-                f'accounts/{SERVICE_ACCOUNT_INDEX}.json',
-                scopes=self.__OAUTH_SCOPE)
-        return build('drive', 'v3', credentials=credentials, cache_discovery=False)
+    def authorize(self, sa_index=None):
+        return drive_service(sa_index)
+
+    def load_credentials(self, sa_index=None):
+        return drive_credentials(sa_index)
 
     def get_credentials(self):
-        # Get credentials
-        credentials = None
-        if not USE_SERVICE_ACCOUNTS:
-            if os.path.exists(self.__G_DRIVE_TOKEN_FILE):
-                with open(self.__G_DRIVE_TOKEN_FILE, 'rb') as f:
-                    credentials = pickle.load(f)
-            if credentials is None or not credentials.valid:
-                if credentials and credentials.expired and credentials.refresh_token:
-                    credentials.refresh(Request())
-                else:
-                    flow = InstalledAppFlow.from_client_secrets_file(
-                        'credentials.json', self.__OAUTH_SCOPE)
-                    LOGGER.info(flow)
-                    credentials = flow.run_console(port=0)
-
-                # Save the credentials for the next run
-                with open(self.__G_DRIVE_TOKEN_FILE, 'wb') as token:
-                    pickle.dump(credentials, token)
-        else:
-            LOGGER.info(f"Authorizing with {SERVICE_ACCOUNT_INDEX}.json service account")
-            credentials = service_account.Credentials.from_service_account_file(
-                f'accounts/{SERVICE_ACCOUNT_INDEX}.json',
-                scopes=self.__OAUTH_SCOPE)
-            credentials.refresh(Request())
-        return credentials.token    
+        return drive_credentials().token
 
     def escapes(self, str):
         chars = ['\\', "'", '"', r'\a', r'\b', r'\f', r'\n', r'\r', r'\t']
@@ -535,23 +927,36 @@ class GoogleDriveHelper:
 
     @retry(wait=wait_exponential(multiplier=2, min=3, max=6), stop=stop_after_attempt(5),
            retry=retry_if_exception_type(HttpError), before=before_log(LOGGER, logging.DEBUG))
-    def drive_list(self, fileName):
-        msg = ""
-        fileName = self.escapes(str(fileName))
-        # Create Search Query for API request.
-        msg += f'<h4>Results for {fileName}</h4>'
-        query = f"'{parent_id}' in parents and (name contains '{fileName}')"
+    def __search_folder(self, folder_id, fileName, limit):
+        """
+        :return: files directly in folder_id whose name contains fileName, newest first,
+        from the local drive index once it is built
+        """
+        if DRIVE_INDEX is not None and DRIVE_INDEX.ready:
+            return DRIVE_INDEX.search(folder_id, fileName, limit)
+        query = f"'{folder_id}' in parents and (name contains '{self.escapes(fileName)}')"
         response = self.__service.files().list(supportsTeamDrives=True,
                                             includeTeamDriveItems=True,
                                             q=query,
                                             spaces='drive',
-                                            pageSize=50,
+                                            pageSize=limit,
                                             fields='files(id, name, mimeType, size)',
                                             orderBy='modifiedTime desc').execute()
-        meta = self.getFileMetadata(parent_id)
-        msg += f"<h4>👉🏻 Search Results in {meta.get('name')} Team Drive</h4>"    
-        if response["files"]:                                              
-            for file in response.get('files', []):
+        return response.get('files', [])
+
+    def __folder_name(self, folder_id):
+        if DRIVE_INDEX is not None and DRIVE_INDEX.ready:
+            return DRIVE_INDEX.folder_name(folder_id)
+        return self.getFileMetadata(folder_id).get('name')
+
+    def drive_list(self, fileName):
+        msg = ""
+        files = self.__search_folder(parent_id, str(fileName), 50)
+        fileName = self.escapes(str(fileName))
+        msg += f'<h4>Results for {fileName}</h4>'
+        msg += f"<h4>👉🏻 Search Results in {self.__folder_name(parent_id)} Team Drive</h4>"    
+        if files:                                              
+            for file in files:
                 if file.get(
                         'mimeType') == "application/vnd.google-apps.folder":  # Detect Whether Current Entity is a Folder or File.
                     msg += f"➼ <code>{file.get('name')}</code><br>" \
@@ -575,26 +980,13 @@ class GoogleDriveHelper:
     def search_drives(self, fileName):
         msg = ""
         count = 0
-        fileName = self.escapes(str(fileName))
-        # Create Search Query for API request.
-        # OUR_TDS = ['1-_xVhSg4S4TYyYQ4PQDlvdvgU47QKLye','1d_nMzq_N19GFIwZn-lHjI001G8pesmb9','1-SOFqWFHpckALJz437-irVhAnjzxgLkW','1SrbdybfP0gB8HNup2uPMYzvidT10o2qW','1Au7Ed8ibC8tE0l3Tf4UNR55qM9ogkca9','18ngROC4tLF2uKGpo0VkE5Elp94MJMIk4','1IcbJGgxXBuhrxkoOW51WjrsfH2c0E2h-','1CxdVc9C-6-sllOe8lD1IqWy1uKbvKmBD','1D5N5DddEoz1KCUGHjUYD3TeuqskTvbZj','1guot-8-dGoY1tJ2UeroBi_QkDAC_wMDS','1rMsivIt0M6BlZXgiOaLWmeyap8EX6YWE','1iGNP47SiCy-NI9h755EdtAa4hK4aaaJ5', '14AECxncxxNC0Bg9vDTErlMBcYDeB1y81']
-        OUR_TDS = ["17zzf_d3Wi16a9m6gOwizlKOiz8YpfXTX"]
-        for tdid in OUR_TDS:
+        for tdid in SEARCH_DRIVES:
             INDEX_URL = f"https://three.shinobispecial.workers.dev/0:/BOT_3_WS"
             count += 1
-            query = f"'{tdid}' in parents and (name contains '{fileName}')"
-            response = self.__service.files().list(supportsTeamDrives=True,
-                                                includeTeamDriveItems=True,
-                                                q=query,
-                                                spaces='drive',
-                                                pageSize=20,
-                                                fields='files(id, name, mimeType, size)',
-                                                orderBy='modifiedTime desc').execute()
-            meta = self.getFileMetadata(tdid)
-            #msg += f"<h4>👉🏻 Search Results in {meta.get('name')} Team Drive</h4>"    
-            if response["files"]:          
-                msg += f"<h4>👉🏻 Search Results in {meta.get('name')} Team Drive</h4>"                                        
-                for file in response.get('files', []):
+            files = self.__search_folder(tdid, str(fileName), 20)
+            if files:          
+                msg += f"<h4>👉🏻 Search Results in {self.__folder_name(tdid)} Team Drive</h4>"                                        
+                for file in files:
                     if file.get(
                             'mimeType') == "application/vnd.google-apps.folder":  # Detect Whether Current Entity is a Folder or File.
                         msg += f"➼ <code>{file.get('name')}</code><br>" \
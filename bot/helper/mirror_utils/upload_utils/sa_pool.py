@@ -0,0 +1,115 @@
+import os
+import json
+import glob
+import logging
+import threading
+from datetime import datetime
+
+LOGGER = logging.getLogger(__name__)
+
+SA_USAGE_FILE = "data/sa_usage.json"
+
+
+class ServiceAccountPool:
+    """
+    Hands out the accounts/*.json service accounts to concurrent uploads and clones.
+    Every account keeps a count of the bytes sent through it today, an account is
+    skipped once the next transfer would push it over the daily cap, so we rotate
+    before drive starts answering with userRateLimitExceeded.
+    """
+
+    def __init__(self, accounts_dir, daily_cap, usage_file=SA_USAGE_FILE):
+        self.__lock = threading.Lock()
+        self.__daily_cap = daily_cap
+        self.__usage_file = usage_file
+        self.__accounts = []
+        for path in glob.glob(os.path.join(accounts_dir, "*.json")):
+            try:
+                self.__accounts.append(int(os.path.splitext(os.path.basename(path))[0]))
+            except ValueError:
+                LOGGER.warning(f"Skipping service account with non numeric name: {path}")
+        self.__accounts.sort()
+        self.__in_flight = {index: 0 for index in self.__accounts}
+        self.__day = self.__today()
+        self.__sent = {}
+        self.__exhausted = set()
+        self.__load_usage()
+        LOGGER.info(f"Service account pool ready with {len(self.__accounts)} accounts")
+
+    @staticmethod
+    def __today():
+        return datetime.utcnow().strftime("%Y-%m-%d")
+
+    def __load_usage(self):
+        try:
+            with open(self.__usage_file, "r") as f:
+                usage = json.load(f)
+        except (OSError, ValueError):
+            return
+        if usage.get("day") != self.__day:
+            return
+        self.__sent = {int(k): v for k, v in usage.get("sent", {}).items()}
+        self.__exhausted = set(usage.get("exhausted", []))
+
+    def __save_usage(self):
+        try:
+            os.makedirs(os.path.dirname(self.__usage_file) or '.', exist_ok=True)
+            with open(self.__usage_file, "w") as f:
+                json.dump({"day": self.__day, "sent": self.__sent,
+                           "exhausted": list(self.__exhausted)}, f)
+        except OSError as e:
+            LOGGER.error(f"Could not save service account usage: {e}")
+
+    def __roll_day(self):
+        today = self.__today()
+        if today != self.__day:
+            LOGGER.info("New quota day, resetting service account usage")
+            self.__day = today
+            self.__sent = {}
+            self.__exhausted = set()
+
+    def __len__(self):
+        return len(self.__accounts)
+
+    def acquire(self, size=0, exclude=None):
+        """
+        Picks the least busy account that still has room for size bytes today and books
+        the bytes against it. Falls back to the least used account that has not been rate
+        limited when every account is over the cap.
+        :return: index of the service account or None if all of them are rate limited
+        """
+        with self.__lock:
+            self.__roll_day()
+            candidates = [index for index in self.__accounts
+                          if index not in self.__exhausted and index != exclude]
+            if not candidates:
+                return None
+            fitting = [index for index in candidates
+                       if self.__sent.get(index, 0) + size <= self.__daily_cap]
+            if fitting:
+                candidates = fitting
+            else:
+                LOGGER.warning("Every service account is over the daily cap, using the least used one")
+            index = min(candidates, key=lambda i: (self.__in_flight[i], self.__sent.get(i, 0)))
+            self.__in_flight[index] += 1
+            self.__sent[index] = self.__sent.get(index, 0) + size
+            return index
+
+    def release(self, index, refund=0):
+        """
+        Gives the account back to the pool, refund is the part of the booked bytes that
+        was never sent (cancelled or failed transfers)
+        """
+        if index is None:
+            return
+        with self.__lock:
+            self.__in_flight[index] = max(self.__in_flight[index] - 1, 0)
+            if refund > 0:
+                self.__sent[index] = max(self.__sent.get(index, 0) - refund, 0)
+            self.__save_usage()
+
+    def mark_exhausted(self, index):
+        with self.__lock:
+            LOGGER.info(f"Service account {index}.json hit its quota, skipping it for today")
+            self.__exhausted.add(index)
+            self.__save_usage()
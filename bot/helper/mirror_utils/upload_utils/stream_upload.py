@@ -0,0 +1,150 @@
+import io
+import re
+import json
+import time
+import logging
+import requests
+
+from bot.helper.ext_utils.exceptions import ProcessCanceled, DriveQuotaExceeded
+
+LOGGER = logging.getLogger(__name__)
+
+UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&supportsAllDrives=true"
+# drive wants every chunk but the last one to be a multiple of 256KB
+CHUNK_SIZE = 50 * 1024 * 1024
+MAX_RETRIES = 5
+# 403 reasons that mean the account is done for today, retrying it does not help
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'dailyLimitExceeded')
+
+
+def check_rate_limit(r):
+    """Raises DriveQuotaExceeded for a response that rate limited the uploading account"""
+    if r.status_code != 403:
+        return
+    try:
+        reason = r.json()['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return
+    if reason in RATE_LIMIT_REASONS:
+        raise DriveQuotaExceeded(reason)
+
+
+def create_upload_session(session, file_name, mime_type, parent_id=None):
+    """
+    Opens a resumable upload session and returns its url
+    :param session: google.auth AuthorizedSession of the uploading account
+    """
+    file_metadata = {
+        'name': file_name,
+        'description': 'mirror',
+        'mimeType': mime_type
+    }
+    if parent_id is not None:
+        file_metadata['parents'] = [parent_id]
+    r = session.post(UPLOAD_URL, data=json.dumps(file_metadata),
+                     headers={"Content-Type": "application/json; charset=UTF-8"})
+    check_rate_limit(r)
+    r.raise_for_status()
+    return r.headers['Location']
+
+
+def get_committed_offset(range_header):
+    """:return first byte drive has not stored yet from the Range header of a 308 response"""
+    if not range_header:
+        return 0
+    match = re.search(r'bytes=0-(\d+)', range_header)
+    if match is None:
+        return 0
+    return int(match.group(1)) + 1
+
+
+class ResumableUploadStream(io.RawIOBase):
+    """
+    Write only file object that pushes everything written to it into a drive resumable
+    upload session in fixed size chunks. The total size does not have to be known, chunks
+    are sent as bytes a-b/* and finish() closes the upload with the real length.
+    """
+
+    def __init__(self, session, upload_url, chunk_size=CHUNK_SIZE, on_progress=None, is_cancelled=None):
+        super().__init__()
+        self.__session = session
+        self.__url = upload_url
+        self.__chunk_size = chunk_size
+        self.__on_progress = on_progress
+        self.__is_cancelled = is_cancelled
+        self.__buffer = bytearray()
+        self.__offset = 0
+        self.__written = 0
+        self.response = None
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.__written
+
+    def write(self, b):
+        if self.__is_cancelled is not None and self.__is_cancelled():
+            raise ProcessCanceled
+        self.__buffer += b
+        self.__written += len(b)
+        while len(self.__buffer) >= self.__chunk_size:
+            chunk = bytes(self.__buffer[:self.__chunk_size])
+            del self.__buffer[:self.__chunk_size]
+            self.__send(chunk)
+        return len(b)
+
+    def finish(self):
+        """
+        Sends whatever is left in the buffer as the last chunk
+        :return: metadata of the created drive file
+        """
+        chunk = bytes(self.__buffer)
+        self.__buffer = bytearray()
+        self.__send(chunk, final=True)
+        return self.response
+
+    def __query_offset(self, total):
+        r = self.__session.put(self.__url, headers={"Content-Range": f"bytes */{total}"})
+        if r.status_code in (200, 201):
+            self.response = r.json()
+            return None
+        return get_committed_offset(r.headers.get('Range'))
+
+    def __send(self, chunk, final=False):
+        start = self.__offset
+        end = start + len(chunk)
+        total = str(end) if final else '*'
+        attempt = 0
+        while self.response is None:
+            if chunk:
+                content_range = f"bytes {start}-{end - 1}/{total}"
+            else:
+                content_range = f"bytes */{total}"
+            try:
+                r = self.__session.put(self.__url, data=chunk, headers={"Content-Range": content_range})
+                if r.status_code in (200, 201):
+                    self.response = r.json()
+                    committed = end
+                elif r.status_code == 308:
+                    committed = get_committed_offset(r.headers.get('Range'))
+                else:
+                    check_rate_limit(r)
+                    raise requests.HTTPError(f"{r.status_code} {r.text}", response=r)
+            except requests.RequestException as err:
+                attempt += 1
+                if attempt > MAX_RETRIES:
+                    raise err
+                LOGGER.warning(f"Chunk upload failed, retrying ({attempt}/{MAX_RETRIES}): {err}")
+                time.sleep(2 ** attempt)
+                committed = self.__query_offset(total)
+                if committed is None:
+                    committed = end
+            if self.__on_progress is not None and committed > self.__offset:
+                self.__on_progress(committed - self.__offset)
+            self.__offset = committed
+            if committed >= end and not final:
+                return
+            # drive kept only part of the chunk, resend the rest
+            chunk = chunk[committed - start:]
+            start = committed
@@ -4,7 +4,7 @@ from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import time
 from bot import AUTO_DELETE_MESSAGE_DURATION, LOGGER, \
     status_reply_dict, status_reply_dict_lock
-from bot.helper.ext_utils.bot_utils import get_readable_message
+from bot.helper.ext_utils.bot_utils import get_readable_message, take_status_snapshot
 from bot.helper.telegram_helper.bot_commands import BotCommands
 import threading
 import os
@@ -96,8 +96,11 @@ def update_all_messages():
                 status_reply_dict[chat_id].text = msg
 
 
-def sendStatusMessage(msg: Message, bot: Client):
-    progress = get_readable_message()
+def sendStatusMessage(msg: Message, bot: Client, snapshot=None):
+    # a status someone just asked for is sampled now, the periodic edits use the sampler's
+    if snapshot is None:
+        snapshot = take_status_snapshot()
+    progress = get_readable_message(snapshot)
     if len(progress) < 4096:
         with status_reply_dict_lock:
             if msg.chat.id in list(status_reply_dict.keys()):
@@ -17,7 +17,7 @@ import bot.helper.ext_utils.fs_utils
 from bot.helper.ext_utils import fs_utils
 from bot.helper.telegram_helper.bot_commands import BotCommands
 from bot.helper.telegram_helper.message_utils import *
-from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_time
+from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_time, get_system_metrics
 
 
 @Client.on_message(
@@ -26,15 +26,14 @@ from bot.helper.ext_utils.bot_utils import get_readable_file_size, get_readable_
 )
 def stats(client: Client, message: Message):
     currentTime = get_readable_time((time.time() - botStartTime))
-    total, used, free = shutil.disk_usage('.')
-    total = get_readable_file_size(total)
-    used = get_readable_file_size(used)
-    free = get_readable_file_size(free)
-    cpuUsage = psutil.cpu_percent(interval=0.5)
-    memory = psutil.virtual_memory().percent
-    netio = psutil.net_io_counters()
-    sent = netio[0]
-    recieved = netio[1]
+    metrics = get_system_metrics()
+    total = get_readable_file_size(metrics.disk_total)
+    used = get_readable_file_size(metrics.disk_used)
+    free = get_readable_file_size(metrics.disk_free)
+    cpuUsage = metrics.cpu
+    memory = metrics.memory
+    sent = metrics.sent
+    recieved = metrics.recv
     stats = f'   ╭──「𝕊𝕙𝕚ℕ𝕠𝕓𝕚 」\n' \
             f'<b>├</b>\n' \
             f'<b>├ ⏱Bot Uptime:</b> {currentTime}\n' \
@@ -47,6 +46,8 @@ def stats(client: Client, message: Message):
             f'<b>├ 📊Bandwidth :</b>\n' \
             f'<b>├ Sent:</b> {get_readable_file_size(sent)} ' \
             f'<b>✦ Recieved:</b> {get_readable_file_size(recieved)}\n' \
+            f'<b>├ Rate:</b> ▲ {get_readable_file_size(metrics.sent_rate)}ps ' \
+            f'<b>✦</b> ▼ {get_readable_file_size(metrics.recv_rate)}ps\n' \
             f'<b>├━━━━━━━━━━━━━━━</b>\n' \
             f'<b>├ 🖥Server Stats :</b>\n' \
             f'<b>├ CPU:</b> {cpuUsage}% ' \
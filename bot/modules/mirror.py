@@ -6,17 +6,22 @@ from pyrogram import (
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.types import Message
 from bot import Interval, INDEX_URL
-from bot import AUTHORIZED_CHATS, DOWNLOAD_DIR, DOWNLOAD_STATUS_UPDATE_INTERVAL, download_dict, download_dict_lock, OWNER_ID, ENABLE_DRIVE_SEARCH
+from bot import AUTHORIZED_CHATS, DOWNLOAD_DIR, DOWNLOAD_STATUS_UPDATE_INTERVAL, download_dict, download_dict_lock, OWNER_ID, ENABLE_DRIVE_SEARCH, STREAM_ARCHIVE
 
 from bot.helper.ext_utils import fs_utils, bot_utils
 from bot.helper.ext_utils.bot_utils import setInterval
 from bot.helper.ext_utils.exceptions import DirectDownloadLinkException, NotSupportedExtractionArchive
+from bot.helper.ext_utils.mirror_cache import MIRROR_CACHE, mirror_mode, key_for_link, key_for_media
+from bot.helper.ext_utils.pipeline import POSTPROCESS_STAGE, UPLOAD_STAGE
+from bot.helper.ext_utils.disk_ledger import DISK_LEDGER, job_footprint
+from bot.helper.ext_utils.job_scheduler import JOB_SCHEDULER, job_priority, ENGINE_ARIA2, ENGINE_QBIT, \
+    ENGINE_GDRIVE, ENGINE_TELEGRAM, ENGINE_WGET
 from bot.helper.mirror_utils.download_utils.aria2_download import AriaDownloadHelper
 from bot.helper.mirror_utils.download_utils.direct_link_generator import direct_link_generator
 from bot.helper.mirror_utils.download_utils.telegram_downloader import TelegramDownloadHelper
 from bot.helper.mirror_utils.download_utils.gdrive_download import GDdownload
-from bot.helper.mirror_utils.download_utils.aio_download import AioHttpDownload
-from bot.helper.mirror_utils.download_utils.qbit_download import QbitWrap
+from bot.helper.mirror_utils.download_utils.aio_download import AioHttpDownload, load_relay_journals
+from bot.helper.mirror_utils.download_utils.qbit_download import QbitWrap, get_client
 from bot.helper.mirror_utils.upload_utils.gdriveTools import GoogleDriveHelper
 from bot.helper.mirror_utils.status_utils import listeners
 from bot.helper.mirror_utils.status_utils.extract_status import ExtractStatus
@@ -24,6 +29,7 @@ from bot.helper.mirror_utils.status_utils.tar_status import TarStatus
 from bot.helper.mirror_utils.status_utils.zip_status import ZipStatus
 from bot.helper.mirror_utils.status_utils.upload_status import UploadStatus
 from bot.helper.mirror_utils.status_utils.gdrivedownload_status import GDDownloadStatus
+from bot.helper.mirror_utils.status_utils.queue_status import QueueStatus
 from bot.helper.mirror_utils.upload_utils import gdriveTools
 from bot.helper.telegram_helper import button_build
 from time import sleep
@@ -45,11 +51,11 @@ import asyncio as aio
 ariaDlManager = AriaDownloadHelper()
 ariaDlManager.start_listener()
 
-qbit = QbitWrap()
-qbitclient = qbit.get_client()
+# logs in, starts qbittorrent-nox if needed and applies the preferences once
+get_client()
 
 class MirrorListener(listeners.MirrorListeners):
-    def __init__(self, bot, update, isTar=False,tag=None, extract=False, isZip=False, source=None, genid=None, password=None):
+    def __init__(self, bot, update, isTar=False,tag=None, extract=False, isZip=False, source=None, genid=None, password=None, cache_key=None):
         super().__init__(bot, update)
         self.isTar = isTar
         self.tag = tag
@@ -58,9 +64,11 @@ class MirrorListener(listeners.MirrorListeners):
         self.source = source
         self.genid = genid
         self.password = password
+        # the finished link is remembered under this key, see mirror_cache
+        self.cache_key = cache_key
 
     def onDownloadStarted(self):
-            pass
+        JOB_SCHEDULER.started(self.uid)
 
     def onDownloadProgress(self):
         # We are handling this on our own!
@@ -74,9 +82,22 @@ class MirrorListener(listeners.MirrorListeners):
         except IndexError:
             pass
 
+    def __stream_archive(self, m_path, size, gid, source, archive_type):
+        # archive goes straight into a drive upload session, no second copy on disk
+        codec = fs_utils.tar_codec(m_path) if archive_type == "tar" else 'none'
+        up_name = f"{pathlib.PurePath(m_path).name}.{fs_utils.archive_suffix(archive_type, codec)}"
+        drive = gdriveTools.GoogleDriveHelper(up_name, self)
+        status_class = ZipStatus if archive_type == "zip" else TarStatus
+        with download_dict_lock:
+            download_dict[self.uid] = status_class(up_name, f"{DOWNLOAD_DIR}{self.uid}", size, gid, source, drive)
+        update_all_messages()
+        # the archive never lands on disk, the space held for it goes to the queued jobs
+        DISK_LEDGER.release(self.uid)
+        JOB_SCHEDULER.wake()
+        drive.upload_archive(m_path, archive_type, codec)
+
     def onDownloadComplete(self):
         with download_dict_lock:
-            total, used, free = shutil.disk_usage('.')
             LOGGER.info(f"Download completed: {download_dict[self.uid].name()}")
             download = download_dict[self.uid]
             name = download.name()
@@ -86,12 +107,34 @@ class MirrorListener(listeners.MirrorListeners):
             m_path = download.upload_path()
             LOGGER.info(f"After finishing Download! {download.which_client()} path is {m_path} {self.isTar} {self.isZip} {self.extract}")
             uname = f'<a href="tg://user?id={self.message.from_user.id}">{self.message.from_user.first_name}</a>'
+        # the files are on disk, the download slot goes to the next job while this one moves down the pipeline
+        JOB_SCHEDULER.release(self.uid)
+        archive_type = "tar" if self.isTar else "zip" if self.isZip else None
+        if archive_type is not None and STREAM_ARCHIVE and os.path.isdir(m_path):
+            # a streamed archive is built while it uploads, it only needs an upload worker
+            download.is_archiving = True
+            self.__enqueue(UPLOAD_STAGE, name, download.gid(),
+                           lambda: self.__stream_archive(m_path, size, download.gid(), source, archive_type))
+        elif archive_type is not None or self.extract:
+            self.__enqueue(POSTPROCESS_STAGE, name, download.gid(),
+                           lambda: self.__post_process(download, name, size, source, dir_path, m_path, uname))
+        else:
+            self.__enqueue(UPLOAD_STAGE, name, download.gid(), lambda: self.__upload(m_path))
+
+    def __enqueue(self, stage, name, gid, work):
+        with download_dict_lock:
+            download_dict[self.uid] = QueueStatus(name, gid, self, stage.name, stage.cancel)
+        stage.submit(self, work)
+
+    def __post_process(self, download, name, size, source, dir_path, m_path, uname):
+        # a job sized at admission already holds this, the others reserve the headroom now
+        room = DISK_LEDGER.reserve(self.uid, job_footprint(size, self.isTar, self.isZip, self.extract))
         if self.isTar:
             download.is_archiving = True
             Isdir = os.path.isdir(m_path)
             if Isdir:
                 try:
-                    if size < free:
+                    if room:
                         with download_dict_lock:
                             download_dict[self.uid] = TarStatus(name, m_path, size, download.gid(), source)
                         path = fs_utils.tar(m_path, self)
@@ -116,7 +159,7 @@ class MirrorListener(listeners.MirrorListeners):
             Isdir = os.path.isdir(m_path)
             if Isdir:
                 try:
-                    if size < free:
+                    if room:
                         with download_dict_lock:
                             download_dict[self.uid] = ZipStatus(name, m_path, size, download.gid(), source)
                         path = fs_utils.zip(m_path, dir_path, self)
@@ -139,7 +182,7 @@ class MirrorListener(listeners.MirrorListeners):
         elif self.extract:
             download.is_extracting = True
             try:
-                if size < free:
+                if room:
                     path = fs_utils.get_base_name(m_path)
                     LOGGER.info(
                         f"Extracting : {name} "
@@ -171,8 +214,12 @@ class MirrorListener(listeners.MirrorListeners):
                 notsupportedarchive = f'<b>{uname} Not supported archive</b>.\n#Stopped'
                 self.onExtractError(notsupportedarchive, fullpath)
                 return
-        else:
-            path = m_path
+        # the source of an archive or extraction is gone, only the result waits for upload
+        DISK_LEDGER.resize(self.uid, fs_utils.get_path_size(path))
+        JOB_SCHEDULER.wake()
+        self.__enqueue(UPLOAD_STAGE, pathlib.PurePath(path).name, download.gid(), lambda: self.__upload(path))
+
+    def __upload(self, path):
         up_name = pathlib.PurePath(path).name
         if up_name == "None":
             up_name = "".join(os.listdir(f'{DOWNLOAD_DIR}{self.uid}/'))
@@ -198,6 +245,7 @@ class MirrorListener(listeners.MirrorListeners):
                 LOGGER.error(str(e))
                 pass
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         uname = f'<a href="tg://user?id={self.message.from_user.id}">{self.message.from_user.first_name}</a>'
         msg = f"{uname} {error}"
         sendMessage(msg, self.bot, self.update)
@@ -221,6 +269,7 @@ class MirrorListener(listeners.MirrorListeners):
                 LOGGER.error(str(e))
                 pass
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         uname = f'<a href="tg://user?id={self.message.from_user.id}">{self.message.from_user.first_name}</a>'
         msg = f"{uname} Stopped Cuz : {error}"
         sendMessage(msg, self.bot, self.update)
@@ -243,6 +292,7 @@ class MirrorListener(listeners.MirrorListeners):
                 LOGGER.error(str(e))
                 pass
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         uname = f'<a href="tg://user?id={self.message.from_user.id}">{self.message.from_user.first_name}</a>'
         msg = f"{uname} The File You Are Trying To Download is Already Downloaded: \n\n#AlreadyDownloaded\n\n{response}"
         sendMessage(msg, self.bot, self.update)
@@ -264,6 +314,7 @@ class MirrorListener(listeners.MirrorListeners):
                 LOGGER.error(str(e))
                 pass
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         uname = f'<a href="tg://user?id={self.message.from_user.id}">{self.message.from_user.first_name}</a>'
         msg = f"{uname} {response}"
         sendMessage(msg, self.bot, self.update)
@@ -303,17 +354,21 @@ class MirrorListener(listeners.MirrorListeners):
             buttons = button_build.ButtonMaker()
             buttons.buildbutton("⚡GDrive Link⚡", link)
             LOGGER.info(f'Done Uploading {download_dict[self.uid].name()}')
+            share_url = None
             if INDEX_URL is not None:
                 share_url = requests.utils.requote_uri(f'{INDEX_URL}/{download_dict[self.uid].name()}')
                 if os.path.isdir(f'{DOWNLOAD_DIR}/{self.uid}/{download_dict[self.uid].name()}'):
                     share_url += '/'
                 buttons.buildbutton("🔥Index Link🔥", share_url)
+            MIRROR_CACHE.put(self.cache_key, mirror_mode(self.isTar, self.extract, self.isZip),
+                             download_dict[self.uid].name(), download_dict[self.uid].size(), link, share_url)
             try:
                 fs_utils.clean_download(download_dict[self.uid].path())
             except FileNotFoundError:
                 pass
             del download_dict[self.uid]
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         LOGGER.info(f"IN Here!")    
         sendMarkup(msg, self.bot, self.update, InlineKeyboardMarkup(buttons.build_menu(2)))
         if count == 0:
@@ -332,6 +387,7 @@ class MirrorListener(listeners.MirrorListeners):
             if download.which_client() == "Qbit":
                     download.cancel_download()
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         sendMessage(error, self.bot, self.update)
         if count == 0:
             self.clean()
@@ -347,12 +403,58 @@ class MirrorListener(listeners.MirrorListeners):
                 pass
             del download_dict[self.message.id]
             count = len(download_dict)
+        JOB_SCHEDULER.finish(self.uid)
         sendMessage(e_str, self.bot, self.update)
         if count == 0:
             self.clean()
         else:
             update_all_messages()  
 
+def getCachedResult(cache_key, mode):
+    """:return: the earlier mirror of cache_key, None if there is none or its drive file is gone"""
+    cached = MIRROR_CACHE.get(cache_key, mode)
+    if cached is not None and not GoogleDriveHelper().fileExists(cached['link']):
+        LOGGER.info(f"Cached mirror of {cache_key} ({mode}) is gone from drive, mirroring again")
+        MIRROR_CACHE.forget(cache_key, mode)
+        return None
+    return cached
+
+
+def sendCachedResult(result, uname, bot, message):
+    """Answers a repeated request with the drive link of the earlier mirror"""
+    buttons = button_build.ButtonMaker()
+    buttons.buildbutton("⚡GDrive Link⚡", result['link'])
+    if result['index_link'] is not None:
+        buttons.buildbutton("🔥Index Link🔥", result['index_link'])
+    msg = f"{uname} <b>This was mirrored before, here it is again</b>\n\n" \
+          f"<b>Filename</b>: <code>{result['name']}</code>\n\n<b>Size</b>: <code>{result['size']}</code>\n#Cached"
+    # awaited by the async handlers, pyrogram hands them a coroutine
+    return sendMarkup(msg, bot, message, InlineKeyboardMarkup(buttons.build_menu(2)))
+
+
+def onRelayDone(listener, future):
+    """Reports a /wget relay that raised, the relay reports everything else itself"""
+    if future.cancelled():
+        error = "Relay cancelled"
+    elif future.exception() is not None:
+        LOGGER.error(f"Relay {listener.uid} failed: {future.exception()}")
+        error = f"Relay failed: {future.exception()}"
+    else:
+        return
+    # runs on the event loop, the listener talks to telegram through the sync api
+    threading.Thread(target=listener.onDownloadError, args=(error,)).start()
+
+
+def queueDownload(listener, engine, name, gid, start, size=0):
+    """
+    Hands the download to JOB_SCHEDULER, start() runs now or once the engine has a free
+    slot and the disk has room for the job, size is 0 when it is not known up front
+    """
+    status = QueueStatus(name, gid, listener, engine)
+    space = job_footprint(size, listener.isTar, listener.isZip, listener.extract)
+    return JOB_SCHEDULER.submit(listener.uid, engine, start, status, job_priority(listener.message), space)
+
+
 def _mirror(bot: Client, message: Message, isTar=False, extract=False, isZip=False):
     args = message.text.split(" ",maxsplit=1)
     reply_to = message.reply_to_message
@@ -389,10 +491,17 @@ def _mirror(bot: Client, message: Message, isTar=False, extract=False, isZip=Fal
             if len(link) == 0:
                 if file is not None:
                     if file.mime_type != "application/x-bittorrent":
+                        cache_key = key_for_media(file)
+                        cached = getCachedResult(cache_key, mirror_mode(isTar, extract, isZip))
+                        if cached is not None:
+                            sendCachedResult(cached, uname, bot, message)
+                            return
                         source = sendMessage(f"{uname} has sent:\n\n<i>{message_args[0]}</i> <code>A Telegram Media File</code>\n\ncc: {cc}",bot,message)
-                        listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source)
+                        listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, cache_key=cache_key)
                         tg_downloader = TelegramDownloadHelper(listener)
-                        tg_downloader.add_download(reply_to, f'{DOWNLOAD_DIR}{listener.uid}/')
+                        queueDownload(listener, ENGINE_TELEGRAM, file.file_name or 'A Telegram Media File', genid,
+                                      lambda: tg_downloader.add_download(reply_to, f'{DOWNLOAD_DIR}{listener.uid}/'),
+                                      file.file_size or 0)
                         uriadded = sendUriAdded(message, bot)
                         sendMessage(f"{uriadded}", bot, message)
                         if len(Interval) == 0:
@@ -408,6 +517,12 @@ def _mirror(bot: Client, message: Message, isTar=False, extract=False, isZip=Fal
             sendMessage('No download source provided', bot, message)
             return
 
+        # keyed before direct_link_generator, whose links often expire
+        cache_key = key_for_link(link)
+        cached = getCachedResult(cache_key, mirror_mode(isTar, extract, isZip))
+        if cached is not None:
+            sendCachedResult(cached, uname, bot, message)
+            return
 
         try:
             link = direct_link_generator(link)
@@ -428,32 +543,37 @@ def _mirror(bot: Client, message: Message, isTar=False, extract=False, isZip=Fal
                 return
                 
         if (isitgdrive):
-            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source) 
+            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, cache_key=cache_key) 
             gd = GDdownload()
             if len(Interval) == 0:
                 Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages)) 
-            gd.add_download(link, f'{DOWNLOAD_DIR}{listener.uid}',listener)   
+            # add_download sizes the folder and reserves its space once the job is started
+            queueDownload(listener, ENGINE_GDRIVE, link, genid,
+                          lambda: gd.add_download(link, f'{DOWNLOAD_DIR}{listener.uid}', listener))
         elif istorrentfile:
-            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, None, None)
+            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, None, None, cache_key=cache_key)
             LOGGER.info("Meh QBittorrent Torrent") 
             if len(Interval) == 0:
                 Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages)) 
             uriadded = sendUriAdded(message, bot)    
             sendMessage(f"{uriadded}", bot, message)  
             qo = QbitWrap()  
-            qo.register_torrent(bot, message,link, listener, file=True)
+            queueDownload(listener, ENGINE_QBIT, 'A Torrent File', genid,
+                          lambda: qo.register_torrent(bot, message, link, listener, file=True))
         elif isitmagnet:
-            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, None, None)
+            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, None, None, cache_key=cache_key)
             LOGGER.info("Meh QBittorrent Magnet") 
             if len(Interval) == 0:
                 Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages)) 
             uriadded = sendUriAdded(message, bot)    
             sendMessage(f"{uriadded}", bot, message)  
             qo = QbitWrap()  
-            qo.register_torrent(bot, message,link, listener, magnet=True)
+            queueDownload(listener, ENGINE_QBIT, link, genid,
+                          lambda: qo.register_torrent(bot, message, link, listener, magnet=True))
         else:
-            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, genid)
-            ariaDlManager.add_download(link, f'{DOWNLOAD_DIR}/{listener.uid}/',listener)
+            listener = MirrorListener(bot, message, isTar, tag, extract, isZip, source, genid, cache_key=cache_key)
+            queueDownload(listener, ENGINE_ARIA2, link, genid,
+                          lambda: ariaDlManager.add_download(link, f'{DOWNLOAD_DIR}/{listener.uid}/', listener))
             uriadded = sendUriAdded(message, bot)
             sendMessage(f"{uriadded}", bot, message)
             if len(Interval) == 0:
@@ -473,20 +593,49 @@ async def wget(bot: Client, message: Message, isTar=False, extract=False, isZip=
         else:
             cc = f'<a href="tg://user?id={message.from_user.id}">{message.from_user.first_name}</a>'
         uname = f'<a href="tg://user?id={message.from_user.id}">{message.from_user.first_name}</a>'
-        source = sendMessage(f"{uname} has sent:\n\n<i>{args[0]}</i> <code>{args[1]}</code>\n\ncc: {cc}",bot,message)
-        listener = MirrorListener(bot, message, isTar, extract, isZip, source)
         link = args[1]
+        cache_key = key_for_link(link.strip())
+        cached = getCachedResult(cache_key, mirror_mode())
+        if cached is not None:
+            await sendCachedResult(cached, uname, bot, message)
+            return
+        source = sendMessage(f"{uname} has sent:\n\n<i>{args[0]}</i> <code>{args[1]}</code>\n\ncc: {cc}",bot,message)
+        listener = MirrorListener(bot, message, isTar, extract, isZip, source, cache_key=cache_key)
         LOGGER.info("Meh aio https") 
         ao = AioHttpDownload()
         if len(Interval) == 0:
             Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages)) 
         uriadded = sendUriAdded(message, bot)    
         sendMessage(f"{uriadded}", bot, message)    
-        await ao.add_download(link, f'{DOWNLOAD_DIR}{listener.uid}',listener)
+        loop = asyncio.get_event_loop()
+        genid = ''.join(random.SystemRandom().choices(string.ascii_letters + string.digits, k=4))
+        # a promoted relay is started from another thread, it still has to run on this loop
+        queueDownload(listener, ENGINE_WGET, link, genid,
+                      lambda: asyncio.run_coroutine_threadsafe(
+                          ao.add_download(link, f'{DOWNLOAD_DIR}{listener.uid}', listener), loop)
+                      .add_done_callback(lambda future: onRelayDone(listener, future)))
     else:
         sendMessage("Provide A Http Link to Upload.",bot, message)
 
 
+async def resume_wget_relays(bot: Client):
+    """Restarts the /wget relays a restart or crash interrupted, from their journals"""
+    relays = []
+    for journal in load_relay_journals():
+        try:
+            message = await bot.get_messages(journal['chat_id'], journal['message_id'])
+        except Exception as e:
+            LOGGER.error(f"Could not fetch the /wget message of {journal['name']}: {e}")
+            continue
+        listener = MirrorListener(bot, message)
+        relays.append(AioHttpDownload().resume_download(journal, listener))
+    if not relays:
+        return
+    if len(Interval) == 0:
+        Interval.append(setInterval(DOWNLOAD_STATUS_UPDATE_INTERVAL, update_all_messages))
+    await asyncio.gather(*relays)
+
+
 @Client.on_message(
     filters.command(BotCommands.MirrorCommand) &
     filters.chat(AUTHORIZED_CHATS)
@@ -11,7 +11,7 @@ from bot import (
 )
 from bot.helper.telegram_helper.message_utils import *
 from time import sleep
-from bot.helper.ext_utils.bot_utils import get_readable_message
+from bot.helper.ext_utils.bot_utils import get_readable_message, take_status_snapshot
 from bot.helper.telegram_helper.bot_commands import BotCommands
 import threading
 
@@ -21,7 +21,8 @@ import threading
     filters.chat(AUTHORIZED_CHATS)
 )
 def mirror_status(client: Client, update: Message):
-    message = get_readable_message()
+    snapshot = take_status_snapshot()
+    message = get_readable_message(snapshot)
     if len(message) <= 130:
         message = "No active downloads"
         reply_message = sendMessage(message, client, update)
@@ -32,5 +33,5 @@ def mirror_status(client: Client, update: Message):
         if index in status_reply_dict.keys():
             deleteMessage(status_reply_dict[index])
             del status_reply_dict[index]
-    sendStatusMessage(update, client)
+    sendStatusMessage(update, client, snapshot)
     deleteMessage(update)
\ No newline at end of file
@@ -7,10 +7,13 @@ from pyrogram.types import Message
 from bot import AUTHORIZED_CHATS, Interval, DOWNLOAD_DIR, DOWNLOAD_STATUS_UPDATE_INTERVAL, LOGGER
 from bot.helper.ext_utils.bot_utils import setInterval
 from bot.helper.telegram_helper.message_utils import update_all_messages, sendMessage, sendStatusMessage
-from .mirror import MirrorListener
+from .mirror import MirrorListener, queueDownload
+from bot.helper.ext_utils.job_scheduler import ENGINE_YTDL
 from bot.helper.mirror_utils.download_utils.youtube_dl_download_helper import YoutubeDLHelper
 from bot.helper.telegram_helper.bot_commands import BotCommands
 import threading
+import random
+import string
 
 
 def _watch(bot: Client, update: Message, args: list, isTar=False, isZip=False):
@@ -27,7 +30,10 @@ def _watch(bot: Client, update: Message, args: list, isTar=False, isZip=False):
 
     listener = MirrorListener(bot, update, isTar, tag, isZip)
     ydl = YoutubeDLHelper(listener)
-    threading.Thread(target=ydl.add_download,args=(link, f'{DOWNLOAD_DIR}{listener.uid}')).start()
+    genid = ''.join(random.SystemRandom().choices(string.ascii_letters + string.digits, k=4))
+    queueDownload(listener, ENGINE_YTDL, link, genid,
+                  lambda: threading.Thread(target=ydl.add_download,
+                                           args=(link, f'{DOWNLOAD_DIR}{listener.uid}')).start())
     uriadded = sendUriAdded(update, bot)
     sendMessage(f"{uriadded}", bot, update)
     if len(Interval) == 0: